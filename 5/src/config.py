@@ -7,8 +7,66 @@ DEFAULT_EGINGE = "tf-idf"
 
 TOP_K = 10
 
+# construct all search engines in a background thread on startup, otherwise
+# every engine is constructed on its first use
+WARM_UP_ENGINES = True
+
+# similar documents shown on the document page
+TOP_K_SIMILAR = 5
+
 DEFAULT_TF_IDF_METHOD = "ltc.ltc"
 
+# slope of the pivoted normalization (ltu), the index has to be rebuilt after a change
+TF_IDF_PIVOT_SLOPE = 0.75
+
+# number of latent dimensions of the LSA model (SVD rank)
+LSA_DIMENSIONS = 200
+
+# number of precomputed nearest neighbors per document for "more like this"
+MORE_LIKE_THIS_K = 10
+
+# rows of the embedding matrix compared against the whole collection at once,
+# bounds the memory of the neighbor computation to NEIGHBORS_BLOCK_SIZE x N floats
+NEIGHBORS_BLOCK_SIZE = 1024
+
+# approximate nearest neighbor (IVF) search for the sentence transformers engine,
+# used for collections with at least DENSE_ANN_MIN_DOCUMENTS documents
+DENSE_ANN = True
+DENSE_ANN_MIN_DOCUMENTS = 10000
+
+# number of IVF lists (None -> 4 * sqrt(N)), lists probed per query (recall vs latency)
+IVF_LISTS = None
+IVF_NPROBE = 8
+IVF_TRAINING_POINTS_PER_LIST = 64
+
+# compressed embeddings for the sentence transformers engine, None (float32),
+# "int8" (scalar quantization, 4x smaller) or "pq" (product quantization,
+# PQ_SUBSPACES bytes per vector), the best QUANTIZATION_RERANK candidates are
+# re-ranked with the float embeddings
+DENSE_QUANTIZATION = None
+PQ_SUBSPACES = 96
+QUANTIZATION_RERANK = 100
+QUANTIZATION_TRAINING_POINTS = 20000
+
+# "python" - scoring over the index postings
+# "scipy" - vectorized scoring over a sparse TF-IDF matrix built on first use
+DEFAULT_TF_IDF_BACKEND = "python"
+
+# python backend: document-at-a-time WAND evaluation skipping documents which
+# can't make it to top k
+TF_IDF_DYNAMIC_PRUNING = True
+
+# run the exhaustive evaluation next to the pruned or vectorized one and report
+# any differences
+TF_IDF_VERIFY = False
+
+# re-rank the best TF_IDF_PROXIMITY_CANDIDATES results of a multi term query by
+# the proximity of the query terms, the score grows by the factor
+# 1 + TF_IDF_PROXIMITY_WEIGHT / (smallest distance of two query terms in tokens)
+TF_IDF_PROXIMITY_BOOST = False
+TF_IDF_PROXIMITY_WEIGHT = 0.2
+TF_IDF_PROXIMITY_CANDIDATES = 100
+
 stopwords_file_path = os.path.join(
     os.path.dirname(__file__),
     "..",
@@ -18,6 +76,54 @@ stopwords_file_path = os.path.join(
 
 SAVE_TO_DISK = True
 
+# surface form -> lemma cache in front of stanza, queries and documents whose
+# every word is cached skip the stanza pipeline
+LEMMA_CACHE_SIZE = 200_000
+LEMMA_CACHE_FILE = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "out",
+    "lemma_cache.json",
+)
+
+# documents read from the dataset file and processed at once when an index is
+# built, bounds the memory used besides the index itself
+INGEST_BATCH_SIZE = 1000
+
+# worker processes lemmatizing, preprocessing and indexing partitions of the
+# documents when an index is built, 1 builds in this process, None uses all cores
+INDEX_BUILD_WORKERS = 1
+
+# documents buffered in memory before they are flushed to a new index segment,
+# a tier of the merge policy holds segments up to INDEX_MERGE_FACTOR times larger
+# than the previous one, INDEX_MERGE_FACTOR segments of a tier are merged into one
+INDEX_FLUSH_DOCUMENTS = 1000
+INDEX_MERGE_FACTOR = 10
+
+# merge the segments in a background thread, otherwise the flush waits for it
+INDEX_BACKGROUND_MERGE = True
+
+# a segment with at least this fraction of its documents deleted is rewritten
+# on its own to drop the deleted postings
+INDEX_COMPACT_DELETED_RATIO = 0.3
+
+# search results cached per dataset, an entry expires after the TTL (seconds)
+# or when the documents change
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 300
+
+# number of decoded posting lists kept in memory per index segment
+POSTINGS_CACHE_SIZE = 1024
+
+# documents per compressed posting list block of a segment, a block is the unit
+# of decoding (a smaller block skips more precisely, a larger one compresses
+# and decodes faster)
+POSTINGS_BLOCK_SIZE = 128
+
+# terms in at least this many documents get their doc ids materialized as a
+# roaring bitmap for the Boolean queries and the result filters
+BITMAP_MIN_DOCUMENT_FREQUENCY = 1024
+
 PIPELINE = PreprocessingPipeline(
     [
         pre.StopWordsPreprocessor(stopwords_file_path),
@@ -1,7 +1,13 @@
+from itertools import islice
+
 from engines.boolean_parser import BooleanParser
+from engines.boolean_planner import BooleanPlanner, Plan
 from interface.search_engine import SearchEngine
 from model.positional_index import PositionalIndex
 from model.document import Document
+from utils.doc_id_iterator import AndIterator, BitmapIterator
+from utils.heap import HeapEntry
+from utils.roaring import RoaringBitmap
 
 
 class BooleanSearchEngine(SearchEngine):
@@ -9,10 +15,54 @@ class BooleanSearchEngine(SearchEngine):
         print("Initializing Boolean search engine")
         self.index = index
         self.all_docs_ids = set(self.index.documents_dict.keys())
+        # sorted all_docs_ids for the NOT queries, built on first use
+        self.sorted_docs_ids = None
+
+    def add_documents(self, documents: list[Document]):
+        self.all_docs_ids.update(doc.doc_id for doc in documents)
+        self.sorted_docs_ids = None
+
+    def remove_documents(self, doc_ids: list[int]):
+        self.all_docs_ids.difference_update(doc_ids)
+        self.sorted_docs_ids = None
+
+    def get_sorted_docs_ids(self) -> list[int]:
+        sorted_docs_ids = self.sorted_docs_ids
+        if sorted_docs_ids is None:
+            sorted_docs_ids = self.sorted_docs_ids = sorted(self.all_docs_ids)
+        return sorted_docs_ids
 
-    def search(self, query: str, k: int) -> list[Document]:
+    def plan(self, query: str) -> Plan:
         parser = BooleanParser(query)
         ast = parser.parse()
-        ids = ast.evaluate(self.index, self.all_docs_ids)
-        docs = [self.index.documents_dict[doc_id] for doc_id in ids]
-        return docs[:k]
+        return BooleanPlanner(self.index, len(self.all_docs_ids)).plan(ast)
+
+    def explain(self, query: str) -> str:
+        """The plan of the query with the estimated and actual cardinalities."""
+        return "\n".join(
+            self.plan(query).explain(self.index, self.get_sorted_docs_ids())
+        )
+
+    def get_filter(self, query: str) -> RoaringBitmap:
+        """The matches of the query as a bitmap, to filter the ranked engines."""
+        plan = self.plan(query)
+        if plan.bitmap is not None:
+            return plan.bitmap
+        return RoaringBitmap.from_doc_ids(
+            plan.evaluate(self.index, self.get_sorted_docs_ids())
+        )
+
+    def search_scored(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[HeapEntry]:
+        """
+        Boolean retrieval doesn't rank, every match scores 1 in doc id order.
+        The evaluation is lazy and stops after the first k matches.
+        """
+        doc_ids = self.plan(query).evaluate(self.index, self.get_sorted_docs_ids())
+        if doc_filter is not None:
+            doc_ids = AndIterator([doc_ids, BitmapIterator(doc_filter)])
+        return [
+            HeapEntry(score=1.0, document=self.index.documents_dict[doc_id])
+            for doc_id in islice(doc_ids, k)
+        ]
@@ -3,12 +3,26 @@ import re
 from model.positional_index import PositionalIndex
 from model.document import Document
 from lemmatizer import lemmatize
+from utils.doc_id_iterator import (
+    AndIterator,
+    AndNotIterator,
+    ArrayIterator,
+    DocIdIterator,
+    FilterIterator,
+    OrIterator,
+)
+from utils.positional import Span, near_spans, phrase_spans
 import config
 
 
 class Node:
-    def evaluate(self, index: PositionalIndex, all_docs_ids: list[int]) -> set[int]:
-        """Evaluate the node based on the given index and set of all documents."""
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        """
+        Returns a lazy iterator over the matching doc ids in ascending order,
+        `all_docs_ids` (sorted) is only needed by a NOT without a left operand.
+        """
         raise NotImplementedError()
 
 
@@ -19,10 +33,18 @@ class TermNode(Node):
     def __repr__(self):
         return f"Term({self.value})"
 
-    def evaluate(self, index: PositionalIndex, all_docs_ids: list[int]) -> set[int]:
-        """Retrieve document IDs from the inverted index."""
-        postings = index.get_postings(self.value)
-        return set(postings.keys()) if postings else set()
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        """Iterate the posting list of the term, decoded block by block."""
+        return index.get_doc_id_iterator(self.value)
+
+    def get_terms(self) -> list[str]:
+        return [self.value]
+
+    def get_spans(self, index: PositionalIndex, doc_id: int) -> list[Span]:
+        positions = index.get_positions(self.value, doc_id) or []
+        return [(position, position) for position in positions]
 
 
 class NotNode(Node):
@@ -32,9 +54,13 @@ class NotNode(Node):
     def __repr__(self):
         return f"Not({self.child})"
 
-    def evaluate(self, index: PositionalIndex, all_docs_ids: list[int]) -> set[int]:
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
         """Apply complement: NOT A → all_docs - A"""
-        return all_docs_ids - self.child.evaluate(index, all_docs_ids)
+        return AndNotIterator(
+            ArrayIterator(all_docs_ids), self.child.evaluate(index, all_docs_ids)
+        )
 
 
 class AndNode(Node):
@@ -45,10 +71,23 @@ class AndNode(Node):
     def __repr__(self):
         return f"And({self.left}, {self.right})"
 
-    def evaluate(self, index: PositionalIndex, all_docs_ids: list[int]) -> set[int]:
-        """Apply intersection: A AND B → A ∩ B"""
-        return self.left.evaluate(index, all_docs_ids) & self.right.evaluate(
-            index, all_docs_ids
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        """
+        Apply intersection: A AND B → A ∩ B, A AND NOT B is the difference
+        A - B, so the complement of B over the whole collection isn't needed.
+        """
+        left, right = self.left, self.right
+        if isinstance(left, NotNode) and not isinstance(right, NotNode):
+            left, right = right, left
+        if isinstance(right, NotNode):
+            return AndNotIterator(
+                left.evaluate(index, all_docs_ids),
+                right.child.evaluate(index, all_docs_ids),
+            )
+        return AndIterator(
+            [left.evaluate(index, all_docs_ids), right.evaluate(index, all_docs_ids)]
         )
 
 
@@ -60,10 +99,80 @@ class OrNode(Node):
     def __repr__(self):
         return f"Or({self.left}, {self.right})"
 
-    def evaluate(self, index: PositionalIndex, all_docs_ids: list[int]) -> set[int]:
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
         """Apply union: A OR B → A u B"""
-        return self.left.evaluate(index, all_docs_ids) | self.right.evaluate(
-            index, all_docs_ids
+        return OrIterator(
+            [
+                self.left.evaluate(index, all_docs_ids),
+                self.right.evaluate(index, all_docs_ids),
+            ]
+        )
+
+
+class PositionalNode(Node):
+    """Node matched on the positions (token ordinals) of its terms."""
+
+    def get_terms(self) -> list[str]:
+        raise NotImplementedError()
+
+    def get_spans(self, index: PositionalIndex, doc_id: int) -> list[Span]:
+        """The (first, last) positions of the matches in the document, sorted."""
+        raise NotImplementedError()
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        """
+        The documents containing all the terms, the rarest first, are checked
+        on the positions of the terms.
+        """
+        terms = sorted(set(self.get_terms()), key=index.get_document_frequency)
+        if not terms:
+            return ArrayIterator([])
+        iterators = [index.get_doc_id_iterator(term) for term in terms]
+        return FilterIterator(
+            iterators[0] if len(iterators) == 1 else AndIterator(iterators),
+            lambda doc_id: bool(self.get_spans(index, doc_id)),
+        )
+
+
+class PhraseNode(PositionalNode):
+    def __init__(self, terms: list[str]):
+        self.terms = terms
+
+    def __repr__(self):
+        return f"Phrase({' '.join(self.terms)})"
+
+    def get_terms(self) -> list[str]:
+        return self.terms
+
+    def get_spans(self, index: PositionalIndex, doc_id: int) -> list[Span]:
+        """The terms at consecutive positions: "A B" → A at i, B at i + 1."""
+        return phrase_spans(
+            [index.get_positions(term, doc_id) or [] for term in self.terms]
+        )
+
+
+class NearNode(PositionalNode):
+    def __init__(self, left, right, distance: int):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def __repr__(self):
+        return f"Near/{self.distance}({self.left}, {self.right})"
+
+    def get_terms(self) -> list[str]:
+        return self.left.get_terms() + self.right.get_terms()
+
+    def get_spans(self, index: PositionalIndex, doc_id: int) -> list[Span]:
+        """A NEAR/k B → A and B at most k positions apart, in any order."""
+        return near_spans(
+            self.left.get_spans(index, doc_id),
+            self.right.get_spans(index, doc_id),
+            self.distance,
         )
 
 
@@ -72,8 +181,12 @@ class BooleanParser:
     Parses boolean expressions using the following grammar:
     expr: term (OR term)*
     term: factor (AND factor)*
-    factor: [NOT] base
-    base: LPAREN expr RPAREN | TERM
+    factor: [NOT] proximity
+    proximity: base (NEAR/k base)*
+    base: LPAREN expr RPAREN | PHRASE | TERM
+
+    A PHRASE is a quoted sequence of terms ("deskova hra"), the operands of
+    NEAR/k have to be terms, phrases or other NEARs.
     """
 
     def __init__(self, text):
@@ -86,6 +199,8 @@ class BooleanParser:
             ("AND", r"\bAND\b"),
             ("OR", r"\bOR\b"),
             ("NOT", r"\bNOT\b"),
+            ("NEAR", r"\bNEAR/\d+\b"),
+            ("PHRASE", r'"[^"]*"'),
             ("LPAREN", r"\("),
             ("RPAREN", r"\)"),
             ("TERM", r"\w+"),
@@ -151,10 +266,27 @@ class BooleanParser:
         token = self.current_token()
         if token[0] == "NOT":
             self.consume("NOT")
-            child = self.parse_base()
+            child = self.parse_proximity()
             return NotNode(child)
         else:
-            return self.parse_base()
+            return self.parse_proximity()
+
+    def parse_proximity(self):
+        node = self.parse_base()
+        while True:
+            token = self.current_token()
+            if token[0] == "NEAR":
+                distance = int(self.consume("NEAR")[1].split("/")[1])
+                right = self.parse_base()
+                for operand in (node, right):
+                    if not isinstance(operand, (TermNode, PositionalNode)):
+                        raise SyntaxError(
+                            f"NEAR operands have to be terms or phrases, got {operand}"
+                        )
+                node = NearNode(node, right, distance)
+            else:
+                break
+        return node
 
     def parse_base(self):
         token = self.current_token()
@@ -163,12 +295,20 @@ class BooleanParser:
             node = self.parse_expr()
             self.consume("RPAREN")
             return node
+        elif token[0] == "PHRASE":
+            terms = self.preprocess(self.consume("PHRASE")[1].strip('"'))
+            return TermNode(terms[0]) if len(terms) == 1 else PhraseNode(terms)
         elif token[0] == "TERM":
             term = self.consume("TERM")[1]
-            term_doc = Document(text=term)
-            lemmatize(term_doc)
-            term_doc = term_doc.tokenize().preprocess(config.PIPELINE)
-            term_text = term_doc.tokens[0].processed_form if term_doc.tokens else term
-            return TermNode(term_text)
+            terms = self.preprocess(term)
+            return TermNode(terms[0] if terms else term)
         else:
             raise SyntaxError("Unexpected token: " + str(token))
+
+    @staticmethod
+    def preprocess(text: str) -> list[str]:
+        """The terms of the text in order, processed the same way as documents."""
+        term_doc = Document(text=text)
+        lemmatize(term_doc)
+        term_doc = term_doc.tokenize().preprocess(config.PIPELINE)
+        return [token.processed_form for token in term_doc.tokens]
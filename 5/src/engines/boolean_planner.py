@@ -0,0 +1,295 @@
+from functools import reduce
+import operator
+
+from engines.boolean_parser import (
+    AndNode,
+    Node,
+    NotNode,
+    OrNode,
+    PositionalNode,
+    TermNode,
+)
+from model.positional_index import PositionalIndex
+from utils.doc_id_iterator import (
+    AndIterator,
+    AndNotIterator,
+    ArrayIterator,
+    BitmapIterator,
+    DocIdIterator,
+    OrIterator,
+)
+from utils.roaring import RoaringBitmap
+
+
+class Plan:
+    """
+    Node of a Boolean query plan. `estimate` is the expected number of matching
+    documents, computed from the document frequencies assuming the terms occur
+    independently of each other.
+
+    `bitmap` holds the result of a node whose operands all have a bitmap (the
+    frequent terms), computed with the bitmap operations right away.
+    """
+
+    estimate: float
+    bitmap: RoaringBitmap | None = None
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        raise NotImplementedError()
+
+    def children(self) -> list["Plan"]:
+        return []
+
+    def explain(
+        self,
+        index: PositionalIndex,
+        all_docs_ids: list[int],
+        depth: int = 0,
+        label: str = "",
+    ) -> list[str]:
+        """
+        Returns a line per plan node with its estimated and actual cardinality,
+        every node is evaluated on its own to count the actual matches.
+        """
+        actual = sum(1 for _ in self.evaluate(index, all_docs_ids))
+        lines = [
+            f"{'  ' * depth}{label}{self}"
+            f"{' [bitmap]' if self.bitmap is not None else ''}  "
+            f"(estimated {self.estimate:.1f}, actual {actual})"
+        ]
+        for child in self.children():
+            child_label = "- " if child in self.excluded_children() else ""
+            lines += child.explain(index, all_docs_ids, depth + 1, child_label)
+        return lines
+
+    def excluded_children(self) -> list["Plan"]:
+        """The children subtracted from the result, marked in `explain`."""
+        return []
+
+
+class EmptyPlan(Plan):
+    estimate = 0.0
+
+    def __repr__(self):
+        return "Empty"
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        return ArrayIterator([])
+
+
+class TermPlan(Plan):
+    def __init__(self, term: str, df: int, bitmap: RoaringBitmap | None = None):
+        self.term = term
+        self.estimate = float(df)
+        self.bitmap = bitmap
+
+    def __repr__(self):
+        return f"Term({self.term})"
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        if self.bitmap is not None:
+            return BitmapIterator(self.bitmap)
+        return index.get_doc_id_iterator(self.term)
+
+
+class PositionalPlan(Plan):
+    """Phrase or NEAR, estimated by the document frequency of its rarest term."""
+
+    def __init__(self, node: PositionalNode, df: int):
+        self.node = node
+        self.estimate = float(df)
+
+    def __repr__(self):
+        return repr(self.node)
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        return self.node.evaluate(index, all_docs_ids)
+
+
+class ComplementPlan(Plan):
+    """NOT without an operand to subtract it from, all documents - child."""
+
+    def __init__(self, child: Plan, documents_count: int):
+        self.child = child
+        self.estimate = documents_count - child.estimate
+
+    def __repr__(self):
+        return "Complement"
+
+    def children(self) -> list[Plan]:
+        return [self.child]
+
+    def excluded_children(self) -> list[Plan]:
+        return [self.child]
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        return AndNotIterator(
+            ArrayIterator(all_docs_ids), self.child.evaluate(index, all_docs_ids)
+        )
+
+
+class AndPlan(Plan):
+    """
+    Intersection of the included operands, ordered by ascending estimate so the
+    rarest one drives the leapfrogging, minus the union of the excluded ones.
+    """
+
+    def __init__(self, include: list[Plan], exclude: list[Plan], documents_count: int):
+        self.include = sorted(include, key=lambda plan: plan.estimate)
+        self.exclude = exclude
+        probability = 1.0
+        for plan in self.include:
+            probability *= plan.estimate / documents_count
+        for plan in self.exclude:
+            probability *= 1 - plan.estimate / documents_count
+        self.estimate = documents_count * probability
+        if all(plan.bitmap is not None for plan in self.children()):
+            self.bitmap = reduce(operator.and_, (plan.bitmap for plan in self.include))
+            for plan in self.exclude:
+                self.bitmap -= plan.bitmap
+
+    def __repr__(self):
+        return "AndNot" if self.exclude else "And"
+
+    def children(self) -> list[Plan]:
+        return self.include + self.exclude
+
+    def excluded_children(self) -> list[Plan]:
+        return self.exclude
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        if self.bitmap is not None:
+            return BitmapIterator(self.bitmap)
+        iterators = [plan.evaluate(index, all_docs_ids) for plan in self.include]
+        iterator = iterators[0] if len(iterators) == 1 else AndIterator(iterators)
+        if not self.exclude:
+            return iterator
+        excluded = [plan.evaluate(index, all_docs_ids) for plan in self.exclude]
+        return AndNotIterator(
+            iterator, excluded[0] if len(excluded) == 1 else OrIterator(excluded)
+        )
+
+
+class OrPlan(Plan):
+    def __init__(self, children: list[Plan], documents_count: int):
+        self.operands = children
+        probability = 1.0
+        for plan in children:
+            probability *= 1 - plan.estimate / documents_count
+        self.estimate = documents_count * (1 - probability)
+        if all(plan.bitmap is not None for plan in children):
+            self.bitmap = reduce(operator.or_, (plan.bitmap for plan in children))
+
+    def __repr__(self):
+        return "Or"
+
+    def children(self) -> list[Plan]:
+        return self.operands
+
+    def evaluate(
+        self, index: PositionalIndex, all_docs_ids: list[int]
+    ) -> DocIdIterator:
+        if self.bitmap is not None:
+            return BitmapIterator(self.bitmap)
+        return OrIterator(
+            [plan.evaluate(index, all_docs_ids) for plan in self.operands]
+        )
+
+
+class BooleanPlanner:
+    """
+    Turns the AST of `BooleanParser`, which follows the text of the query, into
+    a plan: nested ANDs and ORs are flattened, AND operands are ordered by their
+    document frequency, empty operands short-circuit the AND (and drop out of
+    the OR) and a NOT inside an AND becomes a difference.
+    """
+
+    def __init__(self, index: PositionalIndex, documents_count: int):
+        self.index = index
+        self.documents_count = max(documents_count, 1)
+
+    def plan(self, node: Node) -> Plan:
+        if isinstance(node, TermNode):
+            df = self.index.get_document_frequency(node.value)
+            if not df:
+                return EmptyPlan()
+            return TermPlan(node.value, df, self.index.get_doc_id_bitmap(node.value))
+        if isinstance(node, PositionalNode):
+            terms = node.get_terms()
+            df = min(map(self.index.get_document_frequency, terms), default=0)
+            return PositionalPlan(node, df) if df else EmptyPlan()
+        if isinstance(node, NotNode):
+            child = self.plan(node.child)
+            if isinstance(child, ComplementPlan):
+                return child.child
+            return ComplementPlan(child, self.documents_count)
+        if isinstance(node, AndNode):
+            return self._plan_and(self._flatten(node, AndNode))
+        if isinstance(node, OrNode):
+            return self._plan_or(self._flatten(node, OrNode))
+        raise TypeError(f"Unknown node {node}")
+
+    @staticmethod
+    def _flatten(node: Node, node_type: type) -> list[Node]:
+        """Operands of a chain of the same associative operator."""
+        if not isinstance(node, node_type):
+            return [node]
+        return BooleanPlanner._flatten(node.left, node_type) + BooleanPlanner._flatten(
+            node.right, node_type
+        )
+
+    def _plan_and(self, operands: list[Node]) -> Plan:
+        include, exclude = [], []
+        for operand in operands:
+            plan = self.plan(operand)
+            if isinstance(plan, EmptyPlan):
+                return plan
+            if isinstance(plan, AndPlan):
+                include += plan.include
+                exclude += plan.exclude
+            elif isinstance(plan, ComplementPlan):
+                # A AND NOT B is evaluated as the difference A - B
+                if not isinstance(plan.child, EmptyPlan):
+                    exclude.append(plan.child)
+            else:
+                include.append(plan)
+
+        if not include:
+            # only negated operands, complement of their union
+            if not exclude:
+                return ComplementPlan(EmptyPlan(), self.documents_count)
+            union = (
+                exclude[0]
+                if len(exclude) == 1
+                else OrPlan(exclude, self.documents_count)
+            )
+            return ComplementPlan(union, self.documents_count)
+        if len(include) == 1 and not exclude:
+            return include[0]
+        return AndPlan(include, exclude, self.documents_count)
+
+    def _plan_or(self, operands: list[Node]) -> Plan:
+        children = []
+        for operand in operands:
+            plan = self.plan(operand)
+            if isinstance(plan, OrPlan):
+                children += plan.operands
+            elif not isinstance(plan, EmptyPlan):
+                children.append(plan)
+        if not children:
+            return EmptyPlan()
+        if len(children) == 1:
+            return children[0]
+        return OrPlan(children, self.documents_count)
@@ -3,34 +3,194 @@ from sentence_transformers import SentenceTransformer
 
 from interface.search_engine import SearchEngine
 from model.document import Document
-from utils.heap import HeapEntry, MinHeap
+from model.embedding_store import EmbeddingStore
+from model.ivf_index import IVFIndex
+from model.quantization import QuantizedEmbeddings
+from utils.heap import HeapEntry, top_k_indices
+from utils.neighbors import NeighborTable
+from utils.roaring import RoaringBitmap
+import config
+
+MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
 
 class SentenceTransformersSearchEngine(SearchEngine):
 
-    def __init__(self, documents: list[Document]):
+    def __init__(
+        self,
+        documents: list[Document],
+        cache_dir: str | None = None,
+        ann_dir: str | None = None,
+        quantized_dir: str | None = None,
+    ):
+        """
+        Document embeddings are cached in `cache_dir` (if given), so only new or
+        changed documents are encoded on startup. The approximate nearest neighbor
+        index and the quantized embeddings are persisted to `ann_dir` and
+        `quantized_dir` (if given).
+        """
         print("Initializing Sentence Transformers search engine")
 
         self.documents = documents
+        self.doc_rows = {doc.doc_id: i for i, doc in enumerate(documents)}
+        self.doc_ids = np.array([doc.doc_id for doc in documents], dtype=np.int64)
+        # rows of the deleted documents, skipped in the results
+        self.deleted_rows = set()
 
-        self.model = SentenceTransformer(
-            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-        )
+        self.model = SentenceTransformer(MODEL_NAME)
 
-        sentences = [doc.title + " " + doc.text for doc in self.documents]
+        # the added documents are appended to the cached matrix while it is
+        # memory mapped from the store
+        self.store = None
+        if cache_dir:
+            self.store = EmbeddingStore(cache_dir, MODEL_NAME)
+            self.embeddings = self.store.get_embeddings(
+                self.documents, encode=self.encode
+            )
+        else:
+            self.embeddings = self.encode(
+                [doc.title + " " + doc.text for doc in self.documents]
+            )
 
-        self.embeddings = self.model.encode(sentences, show_progress_bar=True)
+        self.nprobe = config.IVF_NPROBE
+        self.ann = None
+        if config.DENSE_ANN and len(self.documents) >= config.DENSE_ANN_MIN_DOCUMENTS:
+            self.ann = IVFIndex.load_or_build(self.embeddings, ann_dir)
 
-        self.similarities = self.model.similarity(self.embeddings, self.embeddings)
+        # with quantization the float embeddings are only read for re-ranking
+        self.quantized = None
+        if config.DENSE_QUANTIZATION and len(self.documents):
+            self.quantized = QuantizedEmbeddings.load_or_build(
+                self.embeddings, config.DENSE_QUANTIZATION, quantized_dir
+            )
+
+        # "more like this" neighbor table, computed lazily on first use
+        self.neighbors = None
         print("Loaded Sentence Transformers model")
 
-    def search(self, query: str, k: int) -> list[Document]:
-        heap = MinHeap(max_size=k)
+    def encode(self, sentences: list[str]) -> np.ndarray:
+        return self.model.encode(sentences, show_progress_bar=True)
+
+    def add_documents(self, documents: list[Document]):
+        """
+        Encode only the new documents and append them to the embeddings, the
+        ANN lists and the quantized codes. The "more like this" table is reset.
+        """
+        documents = [doc for doc in documents if doc.doc_id not in self.doc_rows]
+        if not documents:
+            return
+        encoded = np.asarray(
+            self.encode([doc.title + " " + doc.text for doc in documents]),
+            dtype=np.float32,
+        )
+        for doc in documents:
+            self.doc_rows[doc.doc_id] = len(self.documents)
+            self.documents.append(doc)
+        self.doc_ids = np.array([doc.doc_id for doc in self.documents], dtype=np.int64)
+        if isinstance(self.embeddings, np.memmap):
+            # appended to the file, the mapped rows are not loaded into memory
+            self.embeddings = self.store.append(documents, encoded)
+        elif len(self.embeddings):
+            self.embeddings = np.concatenate([self.embeddings, encoded])
+        else:
+            self.embeddings = encoded
+
+        if self.ann is not None:
+            self.ann.add(self.embeddings)
+        if self.quantized is not None:
+            self.quantized.add(self.embeddings)
+        self.neighbors = None
+
+    def remove_documents(self, doc_ids: list[int]):
+        """
+        Mark the rows of the deleted documents, the embeddings, the ANN lists
+        and the quantized codes keep them until the engine is rebuilt.
+        """
+        for doc_id in doc_ids:
+            row = self.doc_rows.pop(doc_id, None)
+            if row is not None:
+                self.deleted_rows.add(row)
 
+    def set_nprobe(self, nprobe: int):
+        self.nprobe = nprobe
+
+    def get_settings(self) -> tuple:
+        return (self.nprobe,)
+
+    def search_scored(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[HeapEntry]:
         query_embedding = np.array(self.model.encode(query))
-        scores = self.model.similarity(query_embedding, self.embeddings)[0]
+        # enough candidates to fill k results after dropping the deleted rows
+        candidates_k = k + len(self.deleted_rows)
+
+        if doc_filter is not None:
+            # only the filtered documents are compared, exactly
+            rows = np.flatnonzero(doc_filter.contains_array(self.doc_ids))
+            scores = np.asarray(
+                self.model.similarity(query_embedding, self.embeddings[rows])[0]
+            )
+            top = top_k_indices(scores, candidates_k, self.doc_ids[rows])
+            rows, scores = rows[top], scores[top]
+        elif self.quantized is not None:
+            rows, scores = self.quantized.search(
+                query_embedding,
+                k=candidates_k,
+                rerank=config.QUANTIZATION_RERANK,
+                rows=(
+                    self.ann.candidates(query_embedding, nprobe=self.nprobe)
+                    if self.ann is not None
+                    else None
+                ),
+            )
+        elif self.ann is not None:
+            rows, scores = self.ann.search(
+                query_embedding, k=candidates_k, nprobe=self.nprobe
+            )
+        else:
+            scores = np.asarray(
+                self.model.similarity(query_embedding, self.embeddings)[0]
+            )
+            rows = top_k_indices(scores, candidates_k, self.doc_ids)
+            scores = scores[rows]
+
+        return [
+            HeapEntry(score=float(score), document=self.documents[row])
+            for row, score in zip(rows, scores)
+            if row not in self.deleted_rows
+        ][:k]
 
-        for doc, score in zip(self.documents, scores):
-            heap.push(HeapEntry(score=score, document=doc))
+    def more_like_this(self, doc_id: int, k: int) -> list[Document]:
+        """Returns the documents with the most similar embeddings to the given one."""
+        if doc_id not in self.doc_rows:
+            return []
+        if self.neighbors is None:
+            self.neighbors = NeighborTable(
+                self.embeddings,
+                k=config.MORE_LIKE_THIS_K,
+                block_size=config.NEIGHBORS_BLOCK_SIZE,
+            )
+        indices, _ = self.neighbors.get_neighbors(self.doc_rows[doc_id])
+        return [self.documents[i] for i in indices if i not in self.deleted_rows][:k]
 
-        return heap.sort().get_documents()
+    def ann_recall_report(self, queries: list[str], k: int):
+        """Compare the approximate search with brute force search for the queries."""
+        if self.ann is None:
+            print("Approximate nearest neighbor index is not used")
+            return
+        self.ann.recall_report(
+            np.array(self.model.encode(queries)),
+            k=k,
+            nprobes=[1, 2, 4, 8, 16, 32],
+        )
+
+    def quantization_recall_report(self, queries: list[str], k: int):
+        """Compare the quantized search with the float brute force search."""
+        if self.quantized is None:
+            print("Quantized embeddings are not used")
+            return
+        self.quantized.recall_report(
+            np.array(self.model.encode(queries)),
+            k=k,
+            reranks=[0, k, 5 * k, 10 * k],
+        )
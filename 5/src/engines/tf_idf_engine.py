@@ -1,11 +1,16 @@
-from typing import Callable, List
-from tqdm import tqdm
+from collections import defaultdict
+from typing import Callable
+import numpy as np
 from interface.search_engine import SearchEngine
 from model.document import Document
 from model.positional_index import PositionalIndex
-from utils.heap import HeapEntry, MinHeap
-from utils.vector import VectorUtils
+from utils.doc_id_iterator import AndIterator, BitmapIterator, DocIdIterator
+from utils.heap import HeapEntry, top_k
+from utils.positional import min_distance
+from utils.roaring import RoaringBitmap
 from utils.tfidf import TfIdf
+from utils.tfidf_matrix import TfIdfMatrix
+from utils.wand import PostingCursor, wand_top_k
 import config
 
 
@@ -14,23 +19,70 @@ class TfIdfSearchEngine(SearchEngine):
         print("Initializing TF-IDF search engine")
         self.index = index
         self.method = config.DEFAULT_TF_IDF_METHOD
+        self.backend = config.DEFAULT_TF_IDF_BACKEND
+        self.dynamic_pruning = config.TF_IDF_DYNAMIC_PRUNING
+        self.proximity_boost = config.TF_IDF_PROXIMITY_BOOST
+        self.matrix = None  # built on first use of the scipy backend
 
-        # precompute collection specific values
+        # precompute collection specific values, the per-document norms are
+        # precomputed by the index
         self.total_documents = self.index.get_documents_count()
         self.avg_document_length = self.index.get_avg_document_length()
-        self.collection_terms = self.index.get_unique_terms()
-        self.df_vector = [
-            self.index.get_document_frequency(term=term)
-            for term in self.collection_terms
-        ]
-        self.df_vector_term_map = {
-            term: i for i, term in enumerate(self.collection_terms)
-        }
 
     def set_method(self, method: str):
         self.method = method
 
-    def search(self, query: str, k: int) -> list[Document]:
+    def set_backend(self, backend: str):
+        if backend not in ("python", "scipy"):
+            raise ValueError(f"Invalid TF-IDF backend: {backend}")
+        self.backend = backend
+
+    def get_matrix(self) -> TfIdfMatrix:
+        if self.matrix is None:
+            self.matrix = TfIdfMatrix(
+                index=self.index,
+                total_documents=self.total_documents,
+                avg_document_length=self.avg_document_length,
+                slope=config.TF_IDF_PIVOT_SLOPE,
+            )
+        return self.matrix
+
+    def add_documents(self, documents: list[Document]):
+        # the df counts and the norms are kept by the index, only the collection
+        # statistics and the matrix (if built) need to be updated
+        self.total_documents = self.index.get_documents_count()
+        self.avg_document_length = self.index.get_avg_document_length()
+        if self.matrix is not None:
+            self.matrix.add_documents(
+                self.index,
+                [doc.doc_id for doc in documents],
+                total_documents=self.total_documents,
+                avg_document_length=self.avg_document_length,
+            )
+
+    def remove_documents(self, doc_ids: list[int]):
+        self.total_documents = self.index.get_documents_count()
+        self.avg_document_length = self.index.get_avg_document_length()
+        if self.matrix is not None:
+            self.matrix.remove_documents(
+                self.index,
+                doc_ids,
+                total_documents=self.total_documents,
+                avg_document_length=self.avg_document_length,
+            )
+
+    def set_dynamic_pruning(self, dynamic_pruning: bool):
+        self.dynamic_pruning = dynamic_pruning
+
+    def set_proximity_boost(self, proximity_boost: bool):
+        self.proximity_boost = proximity_boost
+
+    def get_settings(self) -> tuple:
+        return self.method, self.backend, self.dynamic_pruning, self.proximity_boost
+
+    def search_scored(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[HeapEntry]:
         """defaults to ltc.ltc_search"""
 
         print(f"Search method: {self.method}")
@@ -45,6 +97,7 @@ class TfIdfSearchEngine(SearchEngine):
             return search_methods[self.method](
                 query=query,
                 k=k,
+                doc_filter=doc_filter,
             )
         else:
             raise ValueError(f"Invalid search method: {self.method}")
@@ -53,15 +106,11 @@ class TfIdfSearchEngine(SearchEngine):
         self,
         query: str,
         k: int,
-        get_query_tf_idf_vector: Callable[[List[float], List[int]], List[float]],
-        get_doc_tf_idf_vector: Callable[
-            [Document, List[float], List[int]], List[float]
-        ],
-        get_score: Callable[[List[float], List[float], List[float]], float],
-    ) -> list[Document]:
-        # prepare min heap for top k results
-        heap = MinHeap(max_size=k)
-
+        get_doc_norm: Callable[[int], float],
+        get_frequency_iterators: Callable[[str], list[tuple[DocIdIterator, float]]],
+        pivoted: bool,
+        doc_filter: RoaringBitmap | None = None,
+    ) -> list[HeapEntry]:
         # process query
         query_doc = Document(query)
         super().prepare_query(query_doc)
@@ -74,123 +123,247 @@ class TfIdfSearchEngine(SearchEngine):
         query_df_vector = [
             self.index.get_document_frequency(term) for term in query_unique_terms
         ]
-        query_tf_idf_vector = get_query_tf_idf_vector(
-            tf_vector=query_tf_vector, df_vector=query_df_vector
+        query_tf_idf_vector = TfIdf.ltc_weighting(
+            tf_vector=query_tf_vector,
+            df_vector=query_df_vector,
+            total_documents=self.total_documents,
         )
 
-        # get relevant documents
-        relevant_documents = self.get_relevant_documents(query_doc)
-        print(f"Found {len(relevant_documents)} relevant documents")
-        if not relevant_documents:
-            return []
-
-        # get top k results
-        for doc in tqdm(relevant_documents, desc="Searching..."):
-            # optimization - skip collection terms that are not in the document
-            doc_unique_terms = self.index.get_unique_terms(doc_id=doc.doc_id)
-            query_term_to_doc_vector_entry_map = {
-                term: i
-                for i, term in enumerate(doc_unique_terms)
-                if term in query_unique_terms
-            }
-            tf_vector_trimmed = [
-                self.index.get_term_frequency(term=term, doc_id=doc.doc_id)
-                for term in doc_unique_terms
-            ]
-            df_vector_trimmed = [
-                self.df_vector[self.df_vector_term_map[term]]
-                for term in doc_unique_terms
-            ]
-
-            doc_tf_idf_vector = get_doc_tf_idf_vector(
-                doc=doc, tf_vector=tf_vector_trimmed, df_vector=df_vector_trimmed
+        # the proximity boost re-ranks a larger set of candidates
+        boost = self.proximity_boost and len(query_unique_terms) > 1
+        candidates_k = max(k, config.TF_IDF_PROXIMITY_CANDIDATES) if boost else k
+
+        if self.backend == "scipy":
+            entries = self.matrix_top_k(
+                query_unique_terms,
+                query_tf_idf_vector,
+                candidates_k,
+                pivoted,
+                doc_filter,
+            )
+        elif self.dynamic_pruning:
+            entries = self.pruned_top_k(
+                query_unique_terms,
+                query_tf_idf_vector,
+                candidates_k,
+                get_doc_norm,
+                get_frequency_iterators,
+                doc_filter,
+            )
+        else:
+            entries = self.exhaustive_top_k(
+                query_unique_terms,
+                query_tf_idf_vector,
+                candidates_k,
+                get_doc_norm,
+                doc_filter,
             )
 
-            # optimization - calculate only non-zero dot products
-            doc_tf_idf_vector_mapped_to_query_vector = self.map_doc_vector_to_query_vector(
-                doc_vector=doc_tf_idf_vector,
-                query_unique_terms=query_unique_terms,
-                query_term_to_doc_vector_entry_map=query_term_to_doc_vector_entry_map,
+        if config.TF_IDF_VERIFY and (self.backend == "scipy" or self.dynamic_pruning):
+            self.verify_results(
+                results=entries,
+                exhaustive=self.exhaustive_top_k(
+                    query_unique_terms,
+                    query_tf_idf_vector,
+                    candidates_k,
+                    get_doc_norm,
+                    doc_filter,
+                ),
             )
+        if boost:
+            entries = self.proximity_rerank(query_unique_terms, entries, k)
+        return entries
 
-            score = get_score(
-                query_vector=query_tf_idf_vector,
-                doc_vector=doc_tf_idf_vector,
-                doc_vector_mapped=doc_tf_idf_vector_mapped_to_query_vector,
+    def proximity_rerank(
+        self, query_terms: list[str], entries: list[HeapEntry], k: int
+    ) -> list[HeapEntry]:
+        """
+        Multiplies the score of every candidate by 1 + TF_IDF_PROXIMITY_WEIGHT / d,
+        d is the smallest distance (in tokens) between two different query terms
+        in the document, and returns the k best candidates.
+        """
+        boosted = []
+        for entry in entries:
+            doc_id = entry.document.doc_id
+            distance = min_distance(
+                [self.index.get_positions(term, doc_id) or [] for term in query_terms]
             )
-            heap.push(HeapEntry(score=score, document=doc))
+            score = entry.score
+            if distance:
+                score *= 1 + config.TF_IDF_PROXIMITY_WEIGHT / distance
+            boosted.append(HeapEntry(score=score, document=entry.document))
+        # the same tie breaking as top_k, by ascending doc id
+        boosted.sort(key=lambda entry: (-entry.score, entry.document.doc_id))
+        return boosted[:k]
+
+    def exhaustive_top_k(
+        self,
+        query_terms: list[str],
+        query_vector: list[float],
+        k: int,
+        get_doc_norm: Callable[[int], float],
+        doc_filter: RoaringBitmap | None = None,
+    ) -> list[HeapEntry]:
+        """Scores every document containing at least one of the query terms."""
+        # accumulate the dot products term-at-a-time
+        scores = self.accumulate_scores(query_terms, query_vector)
+        print(f"Found {len(scores)} relevant documents")
 
-        return heap.sort().get_documents()
+        doc_ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        dot_products = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        if doc_filter is not None:
+            keep = doc_filter.contains_array(doc_ids)
+            doc_ids, dot_products = doc_ids[keep], dot_products[keep]
+        norms = np.fromiter(
+            (get_doc_norm(doc_id) for doc_id in doc_ids.tolist()),
+            dtype=np.float64,
+            count=len(doc_ids),
+        )
+        cosines = np.divide(
+            dot_products, norms, out=np.zeros_like(dot_products), where=norms != 0
+        )
+
+        return [
+            HeapEntry(score=score, document=self.index.documents_dict[doc_id])
+            for doc_id, score in top_k(cosines, doc_ids, k)
+        ]
 
-    def ltc_ltc_search(self, query: str, k: int) -> list[Document]:
+    def pruned_top_k(
+        self,
+        query_terms: list[str],
+        query_vector: list[float],
+        k: int,
+        get_doc_norm: Callable[[int], float],
+        get_frequency_iterators: Callable[[str], list[tuple[DocIdIterator, float]]],
+        doc_filter: RoaringBitmap | None = None,
+    ) -> list[HeapEntry]:
+        """
+        Document-at-a-time WAND evaluation over a cursor per term and segment
+        (and the in memory documents), the upper bounds come from the max
+        normalized term weights of the segment. The posting lists are decoded
+        block by block as the cursors advance and a posting is weighted only
+        when its document is fully scored. The filter is leapfrogged with the
+        posting lists.
+        """
+        cursors = []
+        postings_length = 0
+        for term, query_weight in zip(query_terms, query_vector, strict=True):
+            df = self.index.get_document_frequency(term)
+            if not df:
+                continue
+            idf = TfIdf.tf_idf([1], [df], self.total_documents)[0]
+            for iterator, max_weight in get_frequency_iterators(term):
+                if doc_filter is not None:
+                    iterator = AndIterator([iterator, BitmapIterator(doc_filter)])
+                cursors.append(
+                    PostingCursor(
+                        iterator,
+                        query_weight=query_weight,
+                        idf=idf,
+                        upper_bound=query_weight * idf * max_weight,
+                    )
+                )
+            postings_length += df
+
+        results, scored = wand_top_k(cursors, k, get_doc_norm)
+        print(f"Fully scored {scored} documents out of {postings_length} postings")
+
+        return [
+            HeapEntry(score=score, document=self.index.documents_dict[doc_id])
+            for doc_id, score in results
+        ]
+
+    def matrix_top_k(
+        self,
+        query_terms: list[str],
+        query_vector: list[float],
+        k: int,
+        pivoted: bool,
+        doc_filter: RoaringBitmap | None = None,
+    ) -> list[HeapEntry]:
+        """Scores all candidate documents at once with the sparse TF-IDF matrix."""
+        matrix = self.get_matrix()
+        doc_ids, scores = matrix.score(
+            [matrix.terms.get_id(term) for term in query_terms], query_vector, pivoted
+        )
+        if doc_filter is not None:
+            keep = doc_filter.contains_array(doc_ids)
+            doc_ids, scores = doc_ids[keep], scores[keep]
+        print(f"Found {len(doc_ids)} relevant documents")
+
+        return [
+            HeapEntry(score=score, document=self.index.documents_dict[doc_id])
+            for doc_id, score in top_k(scores, doc_ids, k)
+        ]
+
+    def verify_results(self, results: list[HeapEntry], exhaustive: list[HeapEntry]):
+        """
+        Compare the pruned or vectorized results with the exhaustive ones, the
+        scores have to match within float tolerance (ties may be reordered).
+        """
+        matches = len(results) == len(exhaustive) and all(
+            np.isclose(result.score, expected.score)
+            for result, expected in zip(results, exhaustive)
+        )
+        if matches:
+            print(f"{self.backend} backend results match the exhaustive evaluation")
+        else:
+            print(
+                f"WARNING: {self.backend} backend results differ from the exhaustive evaluation"
+            )
+            print(f"  results:    {results}")
+            print(f"  exhaustive: {exhaustive}")
+
+    def accumulate_scores(
+        self, query_terms: list[str], query_vector: list[float]
+    ) -> dict[int, float]:
+        """
+        Returns doc_id -> unnormalized dot product of the query vector and the
+        document ltn vector. Only the postings of the query terms are visited,
+        the document normalization is applied afterwards from the precomputed norms.
+        """
+        scores = defaultdict(float)
+        for term, query_weight in zip(query_terms, query_vector, strict=True):
+            frequencies = self.index.get_term_frequencies(term)
+            if not frequencies:
+                continue
+            weights = TfIdf.ltn_weighting(
+                tf_vector=list(frequencies.values()),
+                df_vector=[len(frequencies)] * len(frequencies),
+                total_documents=self.total_documents,
+            )
+            for doc_id, weight in zip(frequencies.keys(), weights):
+                scores[doc_id] += query_weight * weight
+        return scores
+
+    def ltc_ltc_search(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[HeapEntry]:
+        # the query vector is a unit vector, cosine similarity only needs the doc norm
         return self._search(
             query=query,
             k=k,
-            get_query_tf_idf_vector=lambda tf_vector, df_vector: TfIdf.ltc_weighting(
-                tf_vector=tf_vector,
-                df_vector=df_vector,
-                total_documents=self.total_documents,
-            ),
-            get_doc_tf_idf_vector=lambda doc, tf_vector, df_vector: TfIdf.ltc_weighting(
-                tf_vector=tf_vector,
-                df_vector=df_vector,
-                total_documents=self.total_documents,
-            ),
-            get_score=lambda query_vector, doc_vector, doc_vector_mapped: VectorUtils.calculate_cosine_similarity_with_norm(
-                vector_a=query_vector,
-                vector_b=doc_vector_mapped,
-                norm=VectorUtils.compute_magnitude(query_vector)
-                * VectorUtils.compute_magnitude(doc_vector),
-            ),
+            doc_filter=doc_filter,
+            get_doc_norm=self.index.get_document_norm,
+            get_frequency_iterators=self.index.get_frequency_iterators,
+            pivoted=False,
         )
 
-    def ltu_ltc_search(self, query: str, k: int) -> list[Document]:
+    def ltu_ltc_search(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[HeapEntry]:
         return self._search(
             query=query,
             k=k,
-            get_query_tf_idf_vector=lambda tf_vector, df_vector: TfIdf.ltc_weighting(
-                tf_vector=tf_vector,
-                df_vector=df_vector,
-                total_documents=self.total_documents,
-            ),
-            get_doc_tf_idf_vector=lambda doc, tf_vector, df_vector: TfIdf.ltu_weighting(
-                tf_vector=tf_vector,
-                df_vector=df_vector,
-                total_documents=self.total_documents,
-                document_length=self.index.get_document_length(doc.doc_id),
+            doc_filter=doc_filter,
+            get_doc_norm=lambda doc_id: TfIdf.pivoted_norm(
+                norm=self.index.get_document_norm(doc_id),
+                document_length=self.index.get_document_length(doc_id),
                 avg_document_length=self.avg_document_length,
-                slope=0.75,
+                slope=config.TF_IDF_PIVOT_SLOPE,
             ),
-            get_score=lambda query_vector, doc_vector, doc_vector_mapped: VectorUtils.calculate_dot_product_score(
-                vector_a=query_vector,
-                vector_b=doc_vector_mapped,
+            get_frequency_iterators=lambda term: self.index.get_frequency_iterators(
+                term, avg_document_length=self.avg_document_length
             ),
+            pivoted=True,
         )
-
-    def map_doc_vector_to_query_vector(
-        self,
-        doc_vector: list[float],
-        query_unique_terms: list[str],
-        query_term_to_doc_vector_entry_map: dict[str, float],
-    ):
-        """
-        Returns a mapped document vector containing only the terms that are present in the query.
-        Padded with zeros for query terms that are not present in the document.
-        """
-        return [
-            (
-                doc_vector[query_term_to_doc_vector_entry_map[term]]
-                if term in query_term_to_doc_vector_entry_map
-                else 0.0
-            )
-            for term in query_unique_terms
-        ]
-
-    def get_relevant_documents(self, doc_query: Document):
-        tokens = doc_query.tokens
-        relevant_docs_ids = set()
-        for token in tokens:
-            postings = self.index.get_postings(token.processed_form)
-            if postings:
-                relevant_docs_ids.update(postings.keys())
-        return [self.index.documents_dict[doc_id] for doc_id in relevant_docs_ids]
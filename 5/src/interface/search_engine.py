@@ -1,14 +1,48 @@
 from abc import ABC, abstractmethod
 from model.document import Document
+from utils.heap import HeapEntry
+from utils.roaring import RoaringBitmap
 
 from lemmatizer import lemmatize
 
 
 class SearchEngine(ABC):
     @abstractmethod
-    def search(self, query: str, k: int) -> list[Document]:
+    def search_scored(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[HeapEntry]:
+        """
+        Returns the top k documents with their scores, best first. With a
+        filter (e.g. the matches of a Boolean query) only its documents are
+        considered.
+        """
         raise NotImplementedError()
 
+    @abstractmethod
+    def add_documents(self, documents: list[Document]):
+        """
+        Update the engine with documents already added to its index, documents
+        the engine already knows are skipped.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove_documents(self, doc_ids: list[int]):
+        """
+        Update the engine after the documents were deleted from its index, doc
+        ids the engine doesn't know are skipped.
+        """
+        raise NotImplementedError()
+
+    def get_settings(self) -> tuple:
+        """The settings affecting the results, part of the query cache key."""
+        return ()
+
+    def search(
+        self, query: str, k: int, doc_filter: RoaringBitmap | None = None
+    ) -> list[Document]:
+        return [entry.document for entry in self.search_scored(query, k, doc_filter)]
+
     def prepare_query(self, query: Document):
         lemmatize(query)
         query.tokenize().preprocess()
@@ -1,7 +1,11 @@
+import atexit
+
 import stanza
 from stanza.pipeline.core import DownloadMethod
 
 from model.document import Document
+from utils.lemma_cache import LemmaCache
+import config
 
 # stanza.download("cs")
 # nlp = stanza.Pipeline("cs", processors="tokenize,lemma")
@@ -12,22 +16,49 @@ nlp = stanza.Pipeline(
     download_method=DownloadMethod.REUSE_RESOURCES,
 )
 
+# texts whose every word was already seen by stanza are lemmatized from the cache
+cache = LemmaCache(config.LEMMA_CACHE_FILE, max_size=config.LEMMA_CACHE_SIZE)
+atexit.register(cache.save)
+
 
-def reconstruct_sentence(out_doc):
-    lemmatized_sentence = ""
+def reconstruct_sentence(out_doc, new_lemmas: dict[str, str] | None = None):
+    lemmas = []
     for sentence in out_doc.sentences:
-        for word in sentence.words:
-            lemmatized_sentence += word.lemma + " "
-    return lemmatized_sentence.strip()
+        for token in sentence.tokens:
+            # a multi-word token (e.g. "abych" -> "aby" "bych") has a lemma per word
+            lemma = " ".join(word.lemma for word in token.words)
+            cache.put(token.text, lemma)
+            if new_lemmas is not None:
+                new_lemmas[token.text] = lemma
+            lemmas.append(lemma)
+    return " ".join(lemmas)
+
 
+def bulk_lemmatize(documents: list[Document]) -> dict[str, str]:
+    """
+    Lemmatize the documents in place. Returns the lemmas stanza produced, a
+    build worker process sends them to the parent, which merges them into its
+    cache and saves it (the workers don't write the cache file).
+    """
+    new_lemmas = {}
+    uncached_docs = []
+    for doc in documents:
+        content = cache.lemmatize_text(doc.content)
+        if content is None:
+            uncached_docs.append(doc)
+        else:
+            doc.content = content
 
-def bulk_lemmatize(documents: list[Document]):
-    out_docs = nlp.bulk_process([doc.content for doc in documents])
-    zipped_docs = zip(documents, out_docs)
-    for doc, out_doc in zipped_docs:
-        doc.content = reconstruct_sentence(out_doc)
+    if uncached_docs:
+        out_docs = nlp.bulk_process([doc.content for doc in uncached_docs])
+        zipped_docs = zip(uncached_docs, out_docs)
+        for doc, out_doc in zipped_docs:
+            doc.content = reconstruct_sentence(out_doc, new_lemmas)
+    return new_lemmas
 
 
 def lemmatize(document: Document):
-    out_doc = nlp.process(document.content)
-    document.content = reconstruct_sentence(out_doc)
+    content = cache.lemmatize_text(document.content)
+    if content is None:
+        content = reconstruct_sentence(nlp.process(document.content))
+    document.content = content
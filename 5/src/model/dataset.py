@@ -1,67 +1,218 @@
-import json
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+import multiprocessing
 import os
-import pickle
+import time
+from typing import Iterable, Iterator
 
 from model.positional_index import PositionalIndex
+from model.index_directory import IndexDirectory
 from model.document import Document
 from interface.parser import Parser
-from lemmatizer import bulk_lemmatize
-from utils.documents import preprocess_documents, tokenize_documents
+from tqdm import tqdm
+from lemmatizer import bulk_lemmatize, cache as lemma_cache
+from utils.json_stream import iter_json_array, iter_json_lines
 import config
 
 
+def _build_partial_index(
+    documents: list[Document],
+) -> tuple[PositionalIndex, dict[str, float], dict[str, str]]:
+    """
+    Lemmatize, tokenize, preprocess and index one batch of documents (in a
+    worker process for the parallel build). Returns the partial index, the
+    time spent in each stage and the new lemmas for the lemma cache.
+    """
+    timings = {}
+    start = time.perf_counter()
+    lemmas = bulk_lemmatize(documents)
+    timings["lemmatize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for doc in documents:
+        doc.tokenize().preprocess()
+    timings["tokenize + preprocess"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = PositionalIndex(documents=documents)
+    timings["index"] = time.perf_counter() - start
+    return index, timings, lemmas
+
+
 class Dataset:
     index: PositionalIndex
-    pickle_file: str
+    index_dir: str
     json_file: str
     parser: Parser
 
-    def __init__(self, json_file, pickle_file, parser, tag: str = ""):
+    def __init__(self, json_file, index_dir, parser, tag: str = ""):
         self.tag = tag
         self.json_file = json_file
-        self.pickle_file = pickle_file
+        self.index_dir = index_dir
         self.parser = parser
 
-        # if pickle file exists, load it
-        if os.path.exists(self.pickle_file):
-            self.index = self._load_index_from_pickle_file()
-            Document._doc_id_counter += self.index.get_documents_count()
+        # if the index directory holds a finished index, memory map its segments
+        directory = IndexDirectory(self.index_dir)
+        if directory.is_complete():
+            self.index = self._open_index()
+            Document._doc_id_counter = max(
+                Document._doc_id_counter, self.index.get_next_document_id()
+            )
             return
 
+        if directory.exists():
+            print(f"Index in {self.index_dir} is incomplete (interrupted build)")
         self.create_index()
 
     def create_index(self):
-        documents = self._load_documents_from_json_file()
-        bulk_lemmatize(documents)
-        tokenize_documents(documents)
-        preprocess_documents(documents=documents)
-        self.index = PositionalIndex(documents=documents, show_progress=True)
-        self.save_index()
+        """
+        Build the index from the dataset file streamed in batches of
+        `config.INGEST_BATCH_SIZE` documents, only the in flight batches are kept
+        in memory besides the index itself.
+        """
+        report = BuildReport(self.tag)
+        workers = config.INDEX_BUILD_WORKERS or os.cpu_count()
+        batches = self._iter_document_batches(config.INGEST_BATCH_SIZE, report)
+
+        # the documents are flushed to segments as the index grows
+        self.index = (
+            PositionalIndex.create(self.index_dir)
+            if config.SAVE_TO_DISK
+            else PositionalIndex()
+        )
+        with report.stage("build"), tqdm(
+            desc="Indexing documents", unit=" docs"
+        ) as progress:
+            for partial, timings, lemmas in self._build_partial_indexes(
+                batches, workers
+            ):
+                with report.stage("merge"):
+                    self.index.merge(partial)
+                    lemma_cache.update(lemmas)
+                report.add_worker_timings(timings)
+                progress.update(partial.get_documents_count())
+        documents_count = self.index.get_documents_count()
+
+        with report.stage("save"):
+            self.save_index()
+            self.index.wait_for_merges()
+            # only a finished build is opened on the next start
+            self.index.mark_complete()
+            lemma_cache.save()
+
+        report.print(documents=documents_count, workers=workers)
+
+    def _build_partial_indexes(
+        self, batches: Iterable[list[Document]], workers: int
+    ) -> Iterator[tuple[PositionalIndex, dict[str, float], dict[str, str]]]:
+        """
+        Yields the partial index of every batch in doc id order. With more than
+        one worker the batches are indexed in a process pool, at most two
+        batches per worker are in flight to keep the memory bounded.
+        """
+        if workers <= 1:
+            for batch in batches:
+                yield _build_partial_index(batch)
+            return
+
+        print(f"Indexing documents with {workers} worker processes")
+        # spawn, the lemmatizer may hold CUDA state which can't be forked
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.apply_async(_build_partial_index, (batch,)))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    def get_artifact_path(self, name: str) -> str:
+        """Path of a file (or directory) derived from the index, stored next to it."""
+        return f"{os.path.normpath(self.index_dir)}_{name}"
 
     def save_index(self):
+        """Flush the in memory documents to a new segment."""
         if not config.SAVE_TO_DISK:
             print("Saving to disk is disabled, not saving index")
             return
         if self.index is None:
             raise ValueError("Index is None, cannot save to file")
 
-        with open(self.pickle_file, "wb") as f:
-            print(f"Saving positional index to file {self.pickle_file}")
-            pickle.dump(self.index, f)
-            print(f"Saved index with {self.index.get_documents_count()} documents")
+        print(f"Saving positional index to directory {self.index_dir}")
+        self.index.flush()
+        print(
+            f"Saved index with {self.index.get_documents_count()} documents "
+            f"in {len(self.index.segments)} segments"
+        )
 
-    def _load_index_from_pickle_file(self) -> PositionalIndex:
-        with open(self.pickle_file, "rb") as f:
-            print(f"Loading positional index from file {self.pickle_file}")
-            index: PositionalIndex = pickle.load(f)
-            print(f"Loaded index with {index.get_documents_count()} documents")
-            return index
+    def _open_index(self) -> PositionalIndex:
+        print(f"Loading positional index from directory {self.index_dir}")
+        index = PositionalIndex.open(self.index_dir)
+        print(
+            f"Loaded index with {index.get_documents_count()} documents "
+            f"in {len(index.segments)} segments"
+        )
+        return index
 
-    def _load_documents_from_json_file(self) -> list[Document]:
+    def _iter_document_batches(
+        self, batch_size: int, report: "BuildReport"
+    ) -> Iterator[list[Document]]:
+        """
+        Parse the dataset file incrementally, a JSON array or JSON Lines
+        (`.jsonl`, one document per line), yielding batches of documents.
+        """
+        print(f"Streaming documents from file {self.json_file}")
         with open(self.json_file, "r", encoding="utf-8") as f:
-            print(f"Loading documents from file {self.json_file}")
-            documents = []
-            for doc in json.load(f):
-                documents.append(self.parser.parse(doc))
-            print(f"Loaded {len(documents)} documents")
-            return documents
+            if self.json_file.endswith(".jsonl"):
+                items = iter_json_lines(f)
+            else:
+                items = iter_json_array(f)
+
+            while True:
+                with report.stage("load"):
+                    batch = [
+                        self.parser.parse(item) for item in islice(items, batch_size)
+                    ]
+                if not batch:
+                    return
+                yield batch
+
+
+class BuildReport:
+    """Wall clock time of the index build stages, printed after the build."""
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.start = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        # summed over the batches, i.e. CPU time spent in the workers
+        self.worker_stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        # registered up front to print the nested stages after the outer one
+        self.stages.setdefault(name, 0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def add_worker_timings(self, timings: dict[str, float]):
+        for name, seconds in timings.items():
+            self.worker_stages[name] = self.worker_stages.get(name, 0) + seconds
+
+    def print(self, documents: int, workers: int):
+        print(f"Index build report for {self.tag} ({documents} documents)")
+        for name, seconds in self.stages.items():
+            print(f"  {name:<24}{seconds:9.2f} s")
+        if self.worker_stages:
+            print(f"  batch processing ({workers} processes):")
+            for name, seconds in self.worker_stages.items():
+                print(f"    {name:<22}{seconds:9.2f} s")
+            if workers > 1:
+                speedup = sum(self.worker_stages.values()) / self.stages["build"]
+                print(f"  speedup of the build stage {speedup:.1f}x")
+        print(f"  {'total':<24}{time.perf_counter() - self.start:9.2f} s")
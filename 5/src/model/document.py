@@ -1,44 +1,107 @@
+import sys
+from array import array
 from collections import Counter
-from typing import Iterable
+from typing import Iterable, Iterator
 
 from bs4 import BeautifulSoup
 from tokenizeers import RegexMatchTokenizer
 from interface.tokenizer import Tokenizer
 from model.pipeline import PreprocessingPipeline
+from model.token import Token, TokenType
 import config
 
 SHOW_CHARS = 70
 
 
 class Document:
+    """
+    The tokens are stored columnar, an index into the sorted unique terms of the
+    document, the position, the length and the type of every token in compact
+    arrays, instead of a Token object per token.
+    """
+
+    __slots__ = (
+        "title",
+        "text",
+        "content",
+        "doc_id",
+        "length",
+        "terms",
+        "term_ids",
+        "positions",
+        "lengths",
+        "token_types",
+    )
+
     _doc_id_counter = 0
 
     def __init__(self, text: str, title: str = ""):
         self.title = title
         self.text = text
         self.content = self.title + " " + self.text
-        self.tokens = []
-        self.vocab = None
+        self._set_tokens([])
         self.doc_id = Document._doc_id_counter
         Document._doc_id_counter += 1
 
         self.strip_html()
 
+    @classmethod
+    def restore(cls, doc_id: int, title: str, text: str) -> "Document":
+        """Recreate an already indexed document without assigning a new doc_id."""
+        doc = cls.__new__(cls)
+        doc.title = title
+        doc.text = text
+        doc.content = None
+        doc._set_tokens([])
+        doc.doc_id = doc_id
+        return doc
+
+    def _set_tokens(self, tokens: list[Token]):
+        # the terms are interned, every document shares the same string objects
+        self.terms = tuple(
+            sorted(set(sys.intern(token.processed_form) for token in tokens))
+        )
+        term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.term_ids = array("I", (term_ids[token.processed_form] for token in tokens))
+        self.positions = array("I", (token.position for token in tokens))
+        self.lengths = array("I", (token.length for token in tokens))
+        self.token_types = array("B", (token.token_type.value for token in tokens))
+        self.length = len(tokens)
+
+    @property
+    def tokens(self) -> list[Token]:
+        """The tokens as objects, materialized on every access."""
+        return [
+            Token(self.terms[term_id], position, length, TokenType(token_type))
+            for term_id, position, length, token_type in zip(
+                self.term_ids, self.positions, self.lengths, self.token_types
+            )
+        ]
+
+    def get_term_positions(self) -> Iterator[tuple[str, int]]:
+        """
+        Yields the term and the token ordinal (the position among the tokens
+        left after preprocessing) of every token, the positions of the index.
+        """
+        terms = self.terms
+        for ordinal, term_id in enumerate(self.term_ids):
+            yield terms[term_id], ordinal
+
     def strip_html(self):
         self.content = BeautifulSoup(self.content, "html.parser").get_text()
 
     def tokenize(self, tokenizer: Tokenizer = None):
         tokenizer = tokenizer or RegexMatchTokenizer()
-        self.tokens = tokenizer.tokenize(self.content)
+        self._set_tokens(tokenizer.tokenize(self.content))
         self.content = None  # let the garbage collector free up memory
         return self
 
     def preprocess(self, pipeline: PreprocessingPipeline = config.PIPELINE):
-        self.tokens = pipeline.preprocess(self.tokens, self.text)
+        self._set_tokens(pipeline.preprocess(self.tokens, self.text))
         return self
 
     def get_unique_terms(self):
-        return list(set(token.processed_form for token in self.tokens))
+        return list(self.terms)
 
     def __repr__(self):
         content = self.title + " " + self.text
@@ -53,5 +116,6 @@ class Document:
     def build_vocabulary(documents: Iterable["Document"]):
         vocab = Counter()
         for doc in documents:
-            vocab.update((token.processed_form for token in doc.tokens))
+            terms = doc.terms
+            vocab.update(terms[term_id] for term_id in doc.term_ids)
         return vocab
@@ -0,0 +1,163 @@
+import hashlib
+import io
+import os
+from typing import Callable
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+from model.document import Document
+import config
+
+
+def content_hash(doc: Document) -> bytes:
+    return hashlib.sha1((doc.title + " " + doc.text).encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    On-disk cache of document embeddings keyed by a content hash of the document.
+
+    The embeddings are kept as a memory mapped float32 `.npy` matrix with one row
+    per document, in the same order as the documents they were last stored for.
+    Documents with the same content have the same hash, each of them still has
+    its own row.
+    """
+
+    def __init__(self, directory: str, model_name: str):
+        self.directory = directory
+        self.model_name = model_name
+        self.embeddings_file = os.path.join(directory, "embeddings.npy")
+        self.hashes_file = os.path.join(directory, "hashes.npy")
+        self.model_file = os.path.join(directory, "model.txt")
+
+    def _load(self) -> tuple[np.ndarray | None, list[bytes]]:
+        """Returns the cached embeddings and the content hash of every row."""
+        if not os.path.exists(self.embeddings_file):
+            return None, []
+        with open(self.model_file, "r", encoding="utf-8") as f:
+            if f.read().strip() != self.model_name:
+                print("Embedding cache was built with a different model, ignoring it")
+                return None, []
+        embeddings = np.load(self.embeddings_file, mmap_mode="r")
+        hashes = np.load(self.hashes_file)
+        return embeddings, [row.tobytes() for row in hashes]
+
+    def _save(self, embeddings: np.ndarray, hashes: list[bytes]):
+        os.makedirs(self.directory, exist_ok=True)
+        self._replace(self.embeddings_file, embeddings)
+        self._save_hashes(hashes)
+        with open(self.model_file, "w", encoding="utf-8") as f:
+            f.write(self.model_name)
+
+    def _save_hashes(self, hashes: list[bytes]):
+        self._replace(
+            self.hashes_file,
+            np.frombuffer(b"".join(hashes), dtype=np.uint8).reshape(-1, 20),
+        )
+
+    @staticmethod
+    def _replace(file: str, array: np.ndarray):
+        # write to a temporary file first, the old matrix may still be mapped
+        tmp_file = file + ".tmp.npy"
+        np.save(tmp_file, array)
+        os.replace(tmp_file, file)
+
+    def append(self, documents: list[Document], embeddings: np.ndarray) -> np.ndarray:
+        """
+        Append the embeddings of new documents to the stored matrix (the one
+        returned by get_embeddings) and returns it mapped again, the existing
+        rows are not read.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        cached, hashes = self._load()
+        hashes += [content_hash(doc) for doc in documents]
+        if cached is None:
+            self._save(embeddings, hashes)
+            return np.load(self.embeddings_file, mmap_mode="r")
+        if not self._append_rows(embeddings):
+            # the whole matrix is rewritten
+            self._replace(self.embeddings_file, np.concatenate([cached, embeddings]))
+        self._save_hashes(hashes)
+        return np.load(self.embeddings_file, mmap_mode="r")
+
+    def _append_rows(self, embeddings: np.ndarray) -> bool:
+        """
+        Write the rows at the end of the .npy file and rewrite only its header,
+        False when the header has no room for the new row count.
+        """
+        with open(self.embeddings_file, "r+b") as f:
+            if npy_format.read_magic(f) != (1, 0):
+                return False
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+            if fortran_order or dtype != embeddings.dtype:
+                return False
+            data_offset = f.tell()
+            header = io.BytesIO()
+            npy_format.write_array_header_1_0(
+                header,
+                {
+                    "descr": npy_format.dtype_to_descr(dtype),
+                    "fortran_order": False,
+                    "shape": (shape[0] + len(embeddings), *shape[1:]),
+                },
+            )
+            # numpy pads the header for the row count to grow, a file written by
+            # an old numpy version may not have the room
+            if header.tell() != data_offset:
+                return False
+            # the rows first, a header counting missing rows couldn't be mapped
+            f.seek(data_offset + int(np.prod(shape)) * dtype.itemsize)
+            f.write(embeddings.tobytes())
+            f.truncate()
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
+
+    def get_embeddings(
+        self,
+        documents: list[Document],
+        encode: Callable[[list[str]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Returns the embeddings of the documents (row i belongs to documents[i]).
+        Only the documents missing in the cache are encoded, the cache is then
+        rewritten in the order of the documents so it can be mapped as is.
+        """
+        if not documents:
+            return np.empty((0, 0), dtype=np.float32)
+
+        cached, cached_hashes = self._load()
+        hashes = [content_hash(doc) for doc in documents]
+        if cached is not None and cached_hashes == hashes:
+            print(f"Loaded {len(documents)} embeddings from cache {self.directory}")
+            return cached
+
+        # any row with the same content will do for a duplicate document
+        rows = {doc_hash: i for i, doc_hash in enumerate(cached_hashes)}
+        doc_rows = [rows.get(doc_hash) for doc_hash in hashes]
+
+        missing = [i for i, row in enumerate(doc_rows) if row is None]
+        print(
+            f"Encoding {len(missing)} documents, "
+            f"{len(documents) - len(missing)} embeddings loaded from cache"
+        )
+        encoded = (
+            encode([documents[i].title + " " + documents[i].text for i in missing])
+            if missing
+            else None
+        )
+
+        dimension = cached.shape[1] if cached is not None else encoded.shape[1]
+        embeddings = np.empty((len(documents), dimension), dtype=np.float32)
+        for i, row in enumerate(doc_rows):
+            if row is not None:
+                embeddings[i] = cached[row]
+        if missing:
+            embeddings[missing] = encoded
+
+        if not config.SAVE_TO_DISK:
+            return embeddings
+        self._save(embeddings, hashes)
+        return np.load(self.embeddings_file, mmap_mode="r")
@@ -1,32 +1,185 @@
+import threading
+
 import engines
+from interface.search_engine import SearchEngine
 from model.dataset import Dataset
+from model.document import Document
+from utils.heap import HeapEntry
+from utils.query_cache import QueryCache, normalize_query
+import config
+
+# cheapest first, the background warm-up makes the fast engines available early
+ENGINE_NAMES = ("boolean_se", "tfidf_se", "lsa_se", "sent_trans_se")
 
 
 class EngineCollection:
-    dataset: Dataset
+    """
+    Search engines over one dataset. An engine is constructed on first use, the
+    optional background warm-up constructs them all ahead of the first query.
+    """
 
-    lsa_se: engines.LSASearchEngine
-    boolean_se: engines.BooleanSearchEngine
-    sent_trans_se: engines.SentenceTransformersSearchEngine
-    tfidf_se: engines.TfIdfSearchEngine
+    dataset: Dataset
 
-    def __init__(self, dataset: Dataset):
+    def __init__(self, dataset: Dataset, warm_up: bool = config.WARM_UP_ENGINES):
         self.dataset = dataset
+        self.engines: dict[str, SearchEngine] = {}
+        self.errors: dict[str, str] = {}
+        # one lock per engine, a slow engine doesn't block the other ones
+        self.locks = {name: threading.Lock() for name in ENGINE_NAMES}
+        self.query_cache = QueryCache(config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL)
+
+        print("\nCreated search engine collection for dataset:", dataset.tag)
+        if warm_up:
+            self.start_warm_up()
+
+    @property
+    def lsa_se(self) -> engines.LSASearchEngine:
+        return self.get_engine("lsa_se")
+
+    @property
+    def boolean_se(self) -> engines.BooleanSearchEngine:
+        return self.get_engine("boolean_se")
+
+    @property
+    def sent_trans_se(self) -> engines.SentenceTransformersSearchEngine:
+        return self.get_engine("sent_trans_se")
 
-        print("\nCreating search engine collection for dataset:", dataset.tag)
-        self.load_engines()
-        print("Search engine collection for dataset", dataset.tag, "created")
+    @property
+    def tfidf_se(self) -> engines.TfIdfSearchEngine:
+        return self.get_engine("tfidf_se")
 
-    def load_engines(self):
+    def get_engine(self, name: str) -> SearchEngine:
+        """Returns the engine, constructing it (or waiting for it) if not ready."""
+        engine = self.engines.get(name)
+        if engine is not None:
+            return engine
+        with self.locks[name]:
+            if name not in self.engines:
+                self.engines[name] = self._create_engine(name)
+                self.errors.pop(name, None)
+            return self.engines[name]
+
+    def _create_engine(self, name: str) -> SearchEngine:
         index = self.dataset.index
-        documents = list(index.documents_dict.values())
+        match name:
+            case "lsa_se":
+                return engines.LSASearchEngine(
+                    index=index, model_dir=self.dataset.get_artifact_path("lsa")
+                )
+            case "boolean_se":
+                return engines.BooleanSearchEngine(index=index)
+            case "sent_trans_se":
+                # a consistent snapshot, a writer may be adding documents or
+                # flushing them to a segment (replacing documents_dict)
+                with index.lock:
+                    documents = list(index.documents_dict.values())
+                return engines.SentenceTransformersSearchEngine(
+                    documents,
+                    cache_dir=self.dataset.get_artifact_path("embeddings"),
+                    ann_dir=self.dataset.get_artifact_path("ivf"),
+                    quantized_dir=self.dataset.get_artifact_path("quantized"),
+                )
+            case "tfidf_se":
+                return engines.TfIdfSearchEngine(index=index)
+            case _:
+                raise ValueError(f"Unknown engine name: {name}")
+
+    def search_scored(self, name: str, query: str, k: int) -> list[HeapEntry]:
+        """
+        Search with the engine through the query cache, the results are cached
+        per engine settings and invalidated when the index generation changes.
+        """
+        engine = self.get_engine(name)
+        # read before the search, results computed while the documents change
+        # are stored under the old generation and never hit
+        generation = self.dataset.index.generation
+        key = (
+            self.dataset.tag,
+            name,
+            engine.get_settings(),
+            normalize_query(query),
+            k,
+        )
+        results = self.query_cache.get(key, generation)
+        if results is None:
+            results = engine.search_scored(query=query, k=k)
+            self.query_cache.put(key, generation, results)
+        return results
+
+    def is_ready(self, name: str) -> bool:
+        return name in self.engines
+
+    def get_status(self) -> dict[str, str]:
+        """Returns engine name -> "ready", "loading", "failed: ..." or "not loaded"."""
+        status = {}
+        for name in ENGINE_NAMES:
+            if name in self.engines:
+                status[name] = "ready"
+            elif self.locks[name].locked():
+                status[name] = "loading"
+            elif name in self.errors:
+                status[name] = f"failed: {self.errors[name]}"
+            else:
+                status[name] = "not loaded"
+        return status
+
+    def start_warm_up(self):
+        """Construct all engines in a background thread."""
+        threading.Thread(
+            target=self._warm_up, name=f"warm-up {self.dataset.tag}", daemon=True
+        ).start()
+
+    def _warm_up(self):
+        for name in ENGINE_NAMES:
+            try:
+                self.get_engine(name)
+            except Exception as e:
+                # the engine is retried (and the error raised) on its first use
+                print(f"Warm-up of {name} for dataset {self.dataset.tag} failed: {e}")
+                self.errors[name] = str(e)
+        print("Warm-up of engines for dataset", self.dataset.tag, "finished")
+
+    def add_documents(self, documents: list[Document]):
+        """
+        Add the documents to the index and incrementally update the engines
+        constructed so far, the other ones see them when they are constructed.
+        """
+        self.dataset.index.add_documents(documents)
+        for name in ENGINE_NAMES:
+            # waits for an engine under construction, which may have seen the
+            # documents already (the engines skip the documents they know)
+            with self.locks[name]:
+                if name in self.engines:
+                    self.engines[name].add_documents(documents)
+        # a search between the index and the engine update may have cached the
+        # results of an outdated engine under the new generation
+        self.query_cache.clear()
+
+    def delete_documents(self, doc_ids: list[int]):
+        """Delete the documents from the index and from the constructed engines."""
+        self.dataset.index.delete_documents(doc_ids)
+        for name in ENGINE_NAMES:
+            with self.locks[name]:
+                if name in self.engines:
+                    self.engines[name].remove_documents(doc_ids)
+        self.query_cache.clear()
 
-        self.lsa_se = engines.LSASearchEngine(index=index)
-        self.boolean_se = engines.BooleanSearchEngine(index=index)
-        self.sent_trans_se = engines.SentenceTransformersSearchEngine(documents)
-        self.tfidf_se = engines.TfIdfSearchEngine(index=index)
+    def update_document(self, doc_id: int, doc: Document):
+        """Replace the document with a new version, which gets a new doc id."""
+        self.dataset.index.update_document(doc_id, doc)
+        for name in ENGINE_NAMES:
+            with self.locks[name]:
+                if name in self.engines:
+                    self.engines[name].remove_documents([doc_id])
+                    self.engines[name].add_documents([doc])
+        self.query_cache.clear()
 
     def refresh_engines(self):
+        """Drop the engines after the index changed, they are rebuilt on next use."""
         print("Refreshing search engine collection for dataset:", self.dataset.tag)
-        self.load_engines()
-        print("Search engine collection for dataset", self.dataset.tag, "refreshed")
+        for name in ENGINE_NAMES:
+            with self.locks[name]:
+                self.engines.pop(name, None)
+        self.query_cache.clear()
+        if config.WARM_UP_ENGINES:
+            self.start_warm_up()
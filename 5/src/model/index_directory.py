@@ -0,0 +1,117 @@
+import json
+import os
+import re
+
+MANIFEST = "segments.json"
+SEGMENT_FILE = re.compile(r"segment_(\d+)\.(seg|del)")
+
+
+class IndexDirectory:
+    """
+    Directory holding the immutable segment files of an index and the manifest
+    listing the live ones. A segment is only visible once the manifest, which
+    is replaced atomically, references it, so a crash during a flush or a merge
+    leaves the previous state of the index intact.
+
+    The tombstones of a segment are kept next to it in a `.del` file, which is
+    replaced atomically on every deletion.
+
+    The manifest also records whether the initial build of the index finished,
+    segments are flushed while the build runs, so an interrupted build leaves a
+    valid but partial index behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest_file = os.path.join(path, MANIFEST)
+        self.next_segment = 0
+        # kept in the manifest, so the doc ids of deleted documents aren't reused
+        self.next_document_id = 0
+        self.complete = False
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_file)
+
+    def is_complete(self) -> bool:
+        """Whether the index exists and its build finished."""
+        if not self.exists():
+            return False
+        self.read_manifest()
+        return self.complete
+
+    def read_manifest(self) -> list[str]:
+        """Returns the file names of the live segments, oldest first."""
+        with open(self.manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.next_segment = manifest["next_segment"]
+        self.next_document_id = manifest.get("next_document_id", 0)
+        self.complete = manifest.get("complete", False)
+        return manifest["segments"]
+
+    def write_manifest(self, segment_files: list[str]):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "next_segment": self.next_segment,
+                    "next_document_id": self.next_document_id,
+                    "complete": self.complete,
+                    "segments": [os.path.basename(file) for file in segment_files],
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+    def new_segment_file(self) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        file = os.path.join(self.path, f"segment_{self.next_segment:06d}.seg")
+        self.next_segment += 1
+        return file
+
+    @staticmethod
+    def get_deletions_file(segment_file: str) -> str:
+        return os.path.splitext(segment_file)[0] + ".del"
+
+    def read_deletions(self, segment_file: str) -> bytes | None:
+        file = self.get_deletions_file(segment_file)
+        if not os.path.exists(file):
+            return None
+        with open(file, "rb") as f:
+            return f.read()
+
+    def write_deletions(self, segment_file: str, bitmap: bytes):
+        file = self.get_deletions_file(segment_file)
+        tmp_file = file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(bitmap)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+
+    def remove_orphans(self, segment_files: list[str]):
+        """
+        Delete the files which are not referenced by the manifest, left behind
+        by a flush or a merge interrupted by a crash. Only safe while no flush
+        or merge is running.
+        """
+        live = {os.path.basename(file) for file in segment_files}
+        live.update(
+            os.path.basename(self.get_deletions_file(file)) for file in segment_files
+        )
+        for name in os.listdir(self.path):
+            if (SEGMENT_FILE.fullmatch(name) and name not in live) or name.endswith(
+                ".tmp"
+            ):
+                os.remove(os.path.join(self.path, name))
+
+    @staticmethod
+    def remove_segments(segment_files: list[str]):
+        """Delete merged away segments, open memory maps keep them readable."""
+        for file in segment_files:
+            os.remove(file)
+            deletions_file = IndexDirectory.get_deletions_file(file)
+            if os.path.exists(deletions_file):
+                os.remove(deletions_file)
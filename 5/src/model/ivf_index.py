@@ -0,0 +1,172 @@
+import os
+import time
+
+import numpy as np
+
+from utils.embeddings import exact_top_k, fingerprint, normalize
+from utils.heap import top_k_indices
+import config
+
+
+class IVFIndex:
+    """
+    Inverted file index for approximate nearest neighbor (cosine) search.
+
+    The embeddings are clustered with spherical k-means, every inverted list
+    holds the rows assigned to one centroid. A query only scores the rows of the
+    `nprobe` lists with the closest centroids.
+    """
+
+    # lists x dimension, unit vectors
+    centroids: np.ndarray
+    # rows sorted by their list, list i is rows[offsets[i] : offsets[i + 1]]
+    rows: np.ndarray
+    offsets: np.ndarray
+
+    def __init__(self, embeddings: np.ndarray, centroids: np.ndarray):
+        self.embeddings = embeddings
+        self.norms = np.linalg.norm(embeddings, axis=1)
+        self.centroids = centroids
+        self.assign()
+
+    @staticmethod
+    def train(embeddings: np.ndarray, lists: int, iterations: int = 20) -> np.ndarray:
+        """Spherical k-means over a sample of the embeddings, returns the centroids."""
+        rng = np.random.default_rng(0)
+        sample_size = min(len(embeddings), lists * config.IVF_TRAINING_POINTS_PER_LIST)
+        sample_rows = np.sort(rng.choice(len(embeddings), sample_size, replace=False))
+        sample = normalize(np.asarray(embeddings[sample_rows]))
+        centroids = sample[rng.choice(len(sample), lists, replace=False)]
+        print(f"Training IVF index with {lists} lists on {len(sample)} embeddings")
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=lists)
+            # re-seed empty lists with random sample points
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), empty.sum())]
+            centroids = normalize(sums)
+        return centroids
+
+    def assign(self, block_size: int = 4096):
+        """Assign every row of the embeddings to the list of its closest centroid."""
+        assignment = np.empty(len(self.embeddings), dtype=np.int64)
+        for start in range(0, len(self.embeddings), block_size):
+            block = np.asarray(self.embeddings[start : start + block_size])
+            assignment[start : start + block_size] = np.argmax(
+                block @ self.centroids.T, axis=1
+            )
+        self.rows = np.argsort(assignment, kind="stable")
+        self.offsets = np.searchsorted(
+            assignment[self.rows], np.arange(len(self.centroids) + 1)
+        )
+
+    def add(self, embeddings: np.ndarray):
+        """
+        Add the rows appended to the embedding matrix since the index was built,
+        they are assigned to the existing centroids without retraining.
+        """
+        start = len(self.norms)
+        new = np.asarray(embeddings[start:])
+        self.embeddings = embeddings
+        self.norms = np.concatenate([self.norms, np.linalg.norm(new, axis=1)])
+        if len(new) == 0:
+            return
+
+        lists = np.argmax(new @ self.centroids.T, axis=1)
+        order = np.argsort(lists, kind="stable")
+        # insert every new row at the end of its list
+        self.rows = np.insert(
+            self.rows, self.offsets[lists[order] + 1], start + order
+        )
+        self.offsets = self.offsets + np.concatenate(
+            [[0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))]
+        )
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Returns the sorted rows of the `nprobe` lists closest to the query."""
+        query = normalize(np.asarray(query, dtype=np.float32))
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        # sorted rows read the (memory mapped) embeddings sequentially
+        return np.sort(
+            np.concatenate(
+                [self.rows[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+            )
+        )
+
+    def search(
+        self, query: np.ndarray, k: int, nprobe: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns rows and cosine similarities of the approximate top k, best first."""
+        query = normalize(np.asarray(query, dtype=np.float32))
+        candidates = self.candidates(query, nprobe)
+        norms = self.norms[candidates]
+        scores = np.divide(
+            self.embeddings[candidates] @ query,
+            norms,
+            out=np.zeros(len(candidates), dtype=np.float32),
+            where=norms != 0,
+        )
+
+        top = top_k_indices(scores, k, candidates)
+        return candidates[top], scores[top]
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "rows.npy"), self.rows)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        with open(os.path.join(directory, "fingerprint.txt"), "w") as f:
+            f.write(fingerprint(self.embeddings))
+
+    @staticmethod
+    def load_or_build(embeddings: np.ndarray, directory: str | None) -> "IVFIndex":
+        """
+        Loads the persisted index. When the embeddings changed since it was saved,
+        the rows are reassigned to the persisted centroids without retraining.
+        """
+        if directory and os.path.exists(os.path.join(directory, "centroids.npy")):
+            print(f"Loading IVF index from {directory}")
+            ivf = IVFIndex.__new__(IVFIndex)
+            ivf.embeddings = embeddings
+            ivf.norms = np.linalg.norm(embeddings, axis=1)
+            ivf.centroids = np.load(os.path.join(directory, "centroids.npy"))
+            with open(os.path.join(directory, "fingerprint.txt")) as f:
+                unchanged = f.read() == fingerprint(embeddings)
+            if unchanged:
+                ivf.rows = np.load(os.path.join(directory, "rows.npy"))
+                ivf.offsets = np.load(os.path.join(directory, "offsets.npy"))
+                return ivf
+            print("Embeddings changed, reassigning IVF lists")
+            ivf.assign()
+        else:
+            lists = config.IVF_LISTS or max(1, int(4 * np.sqrt(len(embeddings))))
+            ivf = IVFIndex(
+                embeddings,
+                IVFIndex.train(embeddings, min(lists, len(embeddings))),
+            )
+        if directory and config.SAVE_TO_DISK:
+            ivf.save(directory)
+        return ivf
+
+    def recall_report(self, queries: np.ndarray, k: int, nprobes: list[int]):
+        """Print recall@k and latency of the IVF search against brute force search."""
+        start = time.perf_counter()
+        exact = exact_top_k(self.embeddings, queries, k)
+        brute_force_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        print(f"Recall@{k} over {len(queries)} queries")
+        print(f"  brute force: {brute_force_ms:.2f} ms/query")
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            found = [self.search(query, k, nprobe)[0] for query in queries]
+            ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = np.mean(
+                [
+                    len(expected.intersection(rows)) / len(expected)
+                    for expected, rows in zip(exact, found)
+                ]
+            )
+            print(f"  nprobe={nprobe}: recall {recall:.3f}, {ms:.2f} ms/query")
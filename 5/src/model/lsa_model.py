@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+import scipy.sparse as ss
+import scipy.sparse.linalg as sl
+
+from model.term_dictionary import TermDictionary
+from utils.tfidf import TfIdf
+from utils.tfidf_matrix import TfIdfMatrix
+import config
+
+
+class LSAModel:
+    """
+    Truncated SVD A ~ U S Vt of the whole collection ltc (term x document) matrix.
+
+    The model is persisted as memory mappable `.npy` files, queries (and documents
+    added after the model was built) are folded into the latent space.
+    """
+
+    # terms x dimensions
+    U: np.ndarray
+    # dimensions
+    S: np.ndarray
+    # dimensions x documents
+    Vt: np.ndarray
+    # column of Vt -> doc_id
+    doc_ids: np.ndarray
+    # shared term dictionary of the index
+    terms: TermDictionary
+    # term id -> row of U, -1 for the terms unknown to the model
+    term_rows: np.ndarray
+
+    def __init__(self, U, S, Vt, doc_ids, terms: TermDictionary, term_rows: np.ndarray):
+        self.U = U
+        self.S = S
+        self.Vt = Vt
+        self.doc_ids = doc_ids
+        self.terms = terms
+        self.term_rows = term_rows
+        self._update_doc_norms()
+
+    def _update_doc_norms(self):
+        # norms of the document vectors S v_d in the latent space
+        self.doc_norms = np.linalg.norm(self.S[:, np.newaxis] * self.Vt, axis=0)
+
+    @staticmethod
+    def build(index, dimensions: int) -> "LSAModel":
+        total_documents = index.get_documents_count()
+        tfidf = TfIdfMatrix(
+            index=index,
+            total_documents=total_documents,
+            avg_document_length=index.get_avg_document_length(),
+            slope=config.TF_IDF_PIVOT_SLOPE,
+        )
+        # ltn -> ltc, cosine normalize the document columns
+        norms = tfidf.get_norms()
+        inverse_norms = np.divide(1, norms, out=np.zeros_like(norms), where=norms != 0)
+        A = tfidf.matrix @ ss.diags_array(inverse_norms)
+
+        m, n = A.shape
+        k = min(dimensions, min(m, n) - 1)
+        if k < 1:
+            # svds needs 0 < k < min(m, n), a collection with less than two
+            # documents or terms has no latent space, no query matches then
+            print(f"TF-IDF matrix {m}x{n} is too small for SVD, the LSA model is empty")
+            U, S, Vt = np.zeros((m, 0)), np.zeros(0), np.zeros((0, n))
+        else:
+            print(f"Computing SVD of {m}x{n} TF-IDF matrix with {k} dimensions")
+            U, S, Vt = sl.svds(A, k=k)
+
+        # drop the (numerically) zero singular values, they can't be inverted
+        keep = S > 1e-10
+        # the rows of the TF-IDF matrix are the term ids
+        return LSAModel(
+            U[:, keep], S[keep], Vt[keep], tfidf.doc_ids, tfidf.terms, np.arange(m)
+        )
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        print(f"Saving LSA model to {directory}")
+        np.save(os.path.join(directory, "U.npy"), self.U)
+        np.save(os.path.join(directory, "S.npy"), self.S)
+        np.save(os.path.join(directory, "Vt.npy"), self.Vt)
+        np.save(os.path.join(directory, "doc_ids.npy"), self.doc_ids)
+        # the term ids aren't stable across restarts, the terms are saved in
+        # the order of the rows of U
+        term_ids = np.flatnonzero(self.term_rows >= 0)
+        row_terms = [""] * len(self.U)
+        for term_id, term in zip(term_ids, self.terms.get_terms(term_ids.tolist())):
+            row_terms[self.term_rows[term_id]] = term
+        with open(os.path.join(directory, "terms.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(row_terms))
+
+    @staticmethod
+    def load(directory: str, terms: TermDictionary) -> "LSAModel":
+        print(f"Loading LSA model from {directory}")
+        term_rows = np.full(len(terms), -1)
+        with open(os.path.join(directory, "terms.txt"), "r", encoding="utf-8") as f:
+            for row, term in enumerate(f.read().split("\n")):
+                term_id = terms.get_id(term)
+                if term_id is not None:
+                    term_rows[term_id] = row
+        return LSAModel(
+            U=np.load(os.path.join(directory, "U.npy"), mmap_mode="r"),
+            S=np.load(os.path.join(directory, "S.npy")),
+            Vt=np.load(os.path.join(directory, "Vt.npy"), mmap_mode="r"),
+            doc_ids=np.load(os.path.join(directory, "doc_ids.npy")),
+            terms=terms,
+            term_rows=term_rows,
+        )
+
+    @staticmethod
+    def load_or_build(index, directory: str | None, dimensions: int) -> "LSAModel":
+        """
+        Loads the persisted model if it was built for (a subset of) the documents
+        of the index, the remaining documents are folded in and the documents
+        deleted since are dropped. Otherwise the model is built from scratch and
+        saved.
+        """
+        if directory and os.path.exists(os.path.join(directory, "Vt.npy")):
+            model = LSAModel.load(directory, index.get_term_dictionary())
+            index_doc_ids = np.fromiter(index.get_documents_dict().keys(), dtype=np.int64)
+            known = np.isin(model.doc_ids, index_doc_ids)
+            # the doc ids are never reused, the unknown ones were deleted
+            if known.any():
+                model.remove_documents(model.doc_ids[~known])
+                model.fold_in_documents(
+                    index, index_doc_ids[~np.isin(index_doc_ids, model.doc_ids)]
+                )
+                return model
+            print("LSA model does not match the index, rebuilding it")
+
+        model = LSAModel.build(index, dimensions)
+        if directory and config.SAVE_TO_DISK:
+            model.save(directory)
+        return model
+
+    def project(self, term_ids: list[int | None], weights: list[float]) -> np.ndarray:
+        """
+        Returns U^T x for the (sparse) term vector x, the terms unknown to the
+        model (None for a term not in the dictionary) are skipped.
+        """
+        rows, row_weights = [], []
+        for term_id, weight in zip(term_ids, weights, strict=True):
+            if term_id is not None and term_id < len(self.term_rows):
+                row = self.term_rows[term_id]
+                if row >= 0:
+                    rows.append(row)
+                    row_weights.append(weight)
+        return self.U[rows].T @ np.array(row_weights)
+
+    def fold_in_documents(self, index, doc_ids):
+        """Fold documents into the latent space: v_d = S^-1 U^T d."""
+        if len(doc_ids) == 0:
+            return
+        print(f"Folding {len(doc_ids)} documents into the LSA model")
+        total_documents = index.get_documents_count()
+        columns = []
+        for doc_id in doc_ids:
+            terms = index.get_unique_terms(int(doc_id))
+            weights = TfIdf.ltc_weighting(
+                tf_vector=[index.get_term_frequency(term, int(doc_id)) for term in terms],
+                df_vector=[index.get_document_frequency(term) for term in terms],
+                total_documents=total_documents,
+            )
+            term_ids = [self.terms.get_id(term) for term in terms]
+            columns.append(self.project(term_ids, weights) / self.S)
+        self.Vt = np.hstack([self.Vt, np.column_stack(columns)])
+        self.doc_ids = np.concatenate([self.doc_ids, np.asarray(doc_ids, dtype=np.int64)])
+        self._update_doc_norms()
+
+    def remove_documents(self, doc_ids):
+        keep = ~np.isin(self.doc_ids, doc_ids)
+        if keep.all():
+            return
+        self.Vt = self.Vt[:, keep]
+        self.doc_ids = self.doc_ids[keep]
+        self._update_doc_norms()
+
+    def score(
+        self, term_ids: list[int | None], weights: list[float]
+    ) -> np.ndarray | None:
+        """
+        Cosine similarity of the folded query S^-1 U^T q and every document S v_d,
+        returned in the order of `doc_ids`. None when the folded query is the
+        zero vector (none of its terms is known to the model).
+        """
+        projected = self.project(term_ids, weights)
+        query_norm = np.linalg.norm(projected / self.S)
+        if query_norm == 0:
+            return None
+        norms = self.doc_norms * query_norm
+        return np.divide(
+            projected @ self.Vt, norms, out=np.zeros(len(norms)), where=norms != 0
+        )
@@ -1,35 +1,396 @@
-from collections import defaultdict
+from collections import ChainMap, defaultdict
 import json
+import math
+import os
+import threading
+import config
 from typing import Iterable
+import numpy as np
 from tqdm import tqdm
 from model.document import Document
+from model.index_directory import IndexDirectory
+from model.segment import Segment, SegmentWeights, SegmentWriter, StoredDocuments
+from model.term_dictionary import TermDictionary
+from utils.doc_id_iterator import (
+    ArrayIterator,
+    BitmapIterator,
+    DocIdIterator,
+    OrIterator,
+)
+from utils.roaring import RoaringBitmap
+from utils.tfidf import TfIdf
+from utils.vector import VectorUtils
 
 
 class PositionalIndex:
+    """
+    Segmented index. New documents are added to an in memory buffer, which is
+    flushed to an immutable memory mapped segment once it holds
+    `config.INDEX_FLUSH_DOCUMENTS` documents (for an index persisted in a
+    directory). Segments are merged in the background by a tiered merge policy,
+    the getters combine the statistics and postings of all segments.
 
+    Deleted in memory documents are dropped right away, deleted segment
+    documents are only marked in the segment tombstones and their postings are
+    dropped when the segment is merged (or compacted).
+    """
+
+    # postings of the documents added in memory (not yet written to a segment)
     index: defaultdict[str, defaultdict[int, list[int]]]
 
-    # doc_id -> Document
-    documents_dict: dict[int, Document]
+    # doc_id -> Document, in memory documents first, then the segment ones
+    documents_dict: ChainMap[int, Document]
 
-    def __init__(self, documents: Iterable[Document], show_progress: bool = False):
-        self.index = defaultdict(self._index_posting_factory)
+    # memory mapped segments with the documents indexed on disk, the list is
+    # never modified in place, so a search can keep iterating over a snapshot
+    segments: list[Segment]
 
-        self.documents_dict = {}
+    def __init__(
+        self,
+        documents: Iterable[Document] = (),
+        show_progress: bool = False,
+        segments: Iterable[Segment] = (),
+        directory: IndexDirectory | None = None,
+    ):
+        self.index = defaultdict(self._index_posting_factory)
+        self.memory_documents_dict = {}
+        self.memory_norms = {}
+        # term -> RoaringBitmap of the frequent terms, replaced by an empty dict
+        # whenever the documents change
+        self.bitmaps = {}
+        # incremented whenever the documents change, e.g. to invalidate cached
+        # search results
+        self.generation = 0
+        # the df of every term and segment -> SegmentWeights (the document norms
+        # and the term weight bounds), computed from the current statistics of
+        # the whole index on first use. Every added document changes the idf of
+        # all terms, so the weights are dropped, while the dfs (globally and by
+        # segment -> term id) are kept up to date and only a deletion drops them
+        self.document_frequencies = None
+        self.segment_dfs = {}
+        self.segment_weights = {}
+        self.segments = list(segments)
+        self.directory = directory
+        # vocabulary with the term ids shared by the engines, built on first use
+        self.term_dictionary = None
+        self._init_writer_state()
+        self._update_documents_dict()
 
         if show_progress:
             self.add_documents(tqdm(documents, desc="Indexing documents"))
         else:
             self.add_documents(documents)
 
+    def _init_writer_state(self):
+        # serializes the writers (adds, flushes, merge commits), the readers
+        # don't take it
+        self.lock = threading.RLock()
+        self.merge_thread = None
+        # segments being merged, the merge policy doesn't pick them again
+        self.merging = set()
+
+    def __getstate__(self):
+        # partial indexes are sent between processes, locks and threads can't be
+        state = self.__dict__.copy()
+        del state["lock"], state["merge_thread"], state["merging"]
+        state["term_dictionary"] = None
+        state["document_frequencies"] = None
+        state["segment_dfs"] = {}
+        state["segment_weights"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_writer_state()
+
+    @staticmethod
+    def open(path: str) -> "PositionalIndex":
+        """Open the index persisted in the directory, over its live segments."""
+        directory = IndexDirectory(path)
+        files = [os.path.join(path, name) for name in directory.read_manifest()]
+        directory.remove_orphans(files)
+        segments = []
+        for file in files:
+            segment = Segment(file)
+            bitmap = directory.read_deletions(file)
+            if bitmap is not None:
+                segment.load_deletion_bitmap(bitmap)
+            segments.append(segment)
+        return PositionalIndex(segments=segments, directory=directory)
+
+    @staticmethod
+    def create(path: str) -> "PositionalIndex":
+        """Create an empty index persisted in the directory, replacing any old one."""
+        directory = IndexDirectory(path)
+        if directory.exists():
+            # keep numbering the segments, old files may still be mapped
+            directory.read_manifest()
+            directory.next_document_id = 0
+        directory.complete = False
+        directory.write_manifest([])
+        directory.remove_orphans([])
+        return PositionalIndex(directory=directory)
+
+    def mark_complete(self):
+        """Record in the manifest that the build of the index finished."""
+        if self.directory is None:
+            return
+        with self.lock:
+            self.directory.complete = True
+            self.directory.write_manifest([segment.file for segment in self.segments])
+
+    def _update_documents_dict(self):
+        self.documents_dict = ChainMap(
+            self.memory_documents_dict,
+            *(StoredDocuments(segment) for segment in self.segments),
+        )
+
     def add_documents(self, documents: Iterable[Document]):
         for doc in documents:
             self.add_document(doc)
 
     def add_document(self, doc: Document):
-        self.documents_dict[doc.doc_id] = doc
-        for token in doc.tokens:
-            self.index[token.processed_form][doc.doc_id].append(token.position)
+        with self.lock:
+            # the collection size changed, the in memory norms have to be recomputed
+            self.memory_norms.clear()
+            self.bitmaps = {}
+            self.generation += 1
+            self.segment_weights = {}
+            self._add_document_frequencies({term: 1 for term in doc.get_unique_terms()})
+            self.memory_documents_dict[doc.doc_id] = doc
+            for term, position in doc.get_term_positions():
+                self.index[term][doc.doc_id].append(position)
+            self._maybe_flush()
+
+    def merge(self, other: "PositionalIndex"):
+        """
+        Merge an in memory index over a disjoint set of documents into this one,
+        e.g. a partial index built by another process.
+        """
+        with self.lock:
+            self.memory_norms.clear()
+            self.bitmaps = {}
+            self.generation += 1
+            self.segment_weights = {}
+            self._add_document_frequencies(
+                {term: len(postings) for term, postings in other.index.items()}
+            )
+            self.memory_documents_dict.update(other.memory_documents_dict)
+            for term, postings in other.index.items():
+                self.index[term].update(postings)
+            self._maybe_flush()
+
+    def delete_documents(self, doc_ids: Iterable[int]):
+        """
+        Delete the documents from the index, raises KeyError for a doc id which
+        is not in the index. The tombstones are persisted right away.
+        """
+        with self.lock:
+            # the collection size changed, the in memory norms have to be recomputed
+            self.memory_norms.clear()
+            self.bitmaps = {}
+            self.generation += 1
+            self.document_frequencies = None
+            self.segment_dfs = {}
+            self.segment_weights = {}
+            # find all the documents first, nothing is deleted on a KeyError
+            memory_doc_ids = []
+            deleted = defaultdict(list)
+            for doc_id in doc_ids:
+                if doc_id in self.memory_documents_dict:
+                    memory_doc_ids.append(doc_id)
+                else:
+                    deleted[self._find_segment(doc_id)].append(doc_id)
+
+            for doc_id in memory_doc_ids:
+                doc = self.memory_documents_dict.pop(doc_id)
+                for term in doc.get_unique_terms():
+                    postings = self.index[term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self.index[term]
+
+            for segment, segment_doc_ids in deleted.items():
+                segment.delete(segment_doc_ids)
+                if self.directory is not None:
+                    self.directory.write_deletions(
+                        segment.file, segment.get_deletion_bitmap()
+                    )
+        if deleted:
+            self._maybe_merge()
+
+    def update_document(self, doc_id: int, doc: Document):
+        """Replace the document with a new one (with its own doc id)."""
+        with self.lock:
+            self.delete_documents([doc_id])
+            self.add_document(doc)
+
+    def _maybe_flush(self):
+        if len(self.memory_documents_dict) >= config.INDEX_FLUSH_DOCUMENTS:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the in memory documents to a new segment. The segment becomes
+        visible (and durable) once the manifest referencing it is written.
+        """
+        if self.directory is None:
+            return
+        with self.lock:
+            if not self.memory_documents_dict:
+                return
+            buffer = PositionalIndex()
+            buffer.index = self.index
+            buffer.memory_documents_dict = self.memory_documents_dict
+            buffer._update_documents_dict()
+
+            file = self.directory.new_segment_file()
+            SegmentWriter.write(buffer, file)
+            self._replace_segments([], Segment(file))
+
+            # new objects, a search still holding the old ones is not affected
+            self.index = defaultdict(self._index_posting_factory)
+            self.memory_documents_dict = {}
+            self.memory_norms = {}
+            self._update_documents_dict()
+        self._maybe_merge()
+
+    def _replace_segments(self, removed: list[Segment], added: Segment | None):
+        """
+        Swap the merged segments for the new one (in place of the first of
+        them), `added` is None when all their documents were deleted.
+        """
+        segments = []
+        for segment in self.segments:
+            if removed and segment is removed[0]:
+                if added is not None:
+                    segments.append(added)
+            elif segment not in removed:
+                segments.append(segment)
+        if not removed:
+            segments.append(added)
+        self.directory.next_document_id = self.get_next_document_id()
+        self.directory.write_manifest([segment.file for segment in segments])
+        self.segments = segments
+        # the statistics don't change, only the weights of the new segment are
+        # computed on its first use
+        self.segment_dfs = {
+            segment: dfs
+            for segment, dfs in self.segment_dfs.items()
+            if segment in segments
+        }
+        self.segment_weights = {
+            segment: weights
+            for segment, weights in self.segment_weights.items()
+            if segment in segments
+        }
+        self._update_documents_dict()
+
+    def _find_merge(self) -> list[Segment] | None:
+        """
+        Tiered merge policy, a segment of up to INDEX_FLUSH_DOCUMENTS *
+        INDEX_MERGE_FACTOR^t documents belongs to the tier t. Once a tier holds
+        INDEX_MERGE_FACTOR segments, its oldest ones are merged into a segment
+        of the next tier, so every document is rewritten once per tier.
+
+        A segment with at least INDEX_COMPACT_DELETED_RATIO of its documents
+        deleted is compacted (merged on its own) to drop the deleted postings.
+        """
+        segments = [
+            segment for segment in self.segments if segment not in self.merging
+        ]
+        tiers = defaultdict(list)
+        for segment in segments:
+            size = max(segment.documents_count / config.INDEX_FLUSH_DOCUMENTS, 1)
+            tier = math.floor(math.log(size, config.INDEX_MERGE_FACTOR))
+            tiers[tier].append(segment)
+            if len(tiers[tier]) == config.INDEX_MERGE_FACTOR:
+                return tiers[tier]
+        for segment in segments:
+            if segment.get_deleted_ratio() >= config.INDEX_COMPACT_DELETED_RATIO:
+                return [segment]
+        return None
+
+    def _maybe_merge(self):
+        with self.lock:
+            if self.merge_thread is not None and self.merge_thread.is_alive():
+                return
+            if self._find_merge() is None:
+                return
+            if not config.INDEX_BACKGROUND_MERGE:
+                self.merge_segments()
+                return
+            self.merge_thread = threading.Thread(
+                target=self.merge_segments, name="segment merge", daemon=True
+            )
+            self.merge_thread.start()
+
+    def merge_segments(self):
+        """Merge the segments picked by the merge policy until nothing is left."""
+        while True:
+            with self.lock:
+                selected = self._find_merge()
+                if selected is None:
+                    return
+                self.merging.update(selected)
+            self._merge(selected)
+
+    def compact(self):
+        """Rewrite all segments with deleted documents, dropping their postings."""
+        with self.lock:
+            selected = [
+                segment
+                for segment in self.segments
+                if segment.deleted and segment not in self.merging
+            ]
+            self.merging.update(selected)
+        for segment in selected:
+            self._merge([segment])
+
+    def _merge(self, selected: list[Segment]):
+        """Write the live documents of the segments into a new one and swap them."""
+        with self.lock:
+            snapshots = [segment.snapshot() for segment in selected]
+            file = self.directory.new_segment_file()
+
+        # the segments are immutable, the merge doesn't block the writers
+        merged_index = PositionalIndex(segments=snapshots)
+        merged = None
+        if merged_index.get_documents_count():
+            SegmentWriter.write(merged_index, file)
+            merged = Segment(file)
+
+        with self.lock:
+            # carry over the documents deleted while the merge was running
+            deleted = [
+                doc_id
+                for segment, snapshot in zip(selected, snapshots)
+                for doc_id in segment.deleted - snapshot.deleted
+            ]
+            if deleted:
+                merged.delete(deleted)
+                self.directory.write_deletions(file, merged.get_deletion_bitmap())
+            self._replace_segments(selected, merged)
+            self.merging.difference_update(selected)
+        IndexDirectory.remove_segments([segment.file for segment in selected])
+        if merged is None:
+            print(f"Dropped {len(selected)} segments with only deleted documents")
+        else:
+            print(
+                f"Merged {len(selected)} segments into {os.path.basename(file)} "
+                f"with {merged.live_documents_count} documents"
+            )
+
+    def wait_for_merges(self):
+        thread = self.merge_thread
+        if thread is not None:
+            thread.join()
+
+    def _find_segment(self, doc_id: int) -> Segment:
+        for segment in self.segments:
+            if segment.has_document(doc_id):
+                return segment
+        raise KeyError(doc_id)
 
     def _index_posting_factory(self) -> defaultdict[int, list[int]]:
         """
@@ -41,37 +402,271 @@ class PositionalIndex:
         return defaultdict(list)
 
     def get_document_frequency(self, term: str):
-        return len(self.index[term].keys()) if term in self.index else 0
+        df = len(self.index[term].keys()) if term in self.index else 0
+        for segment in self.segments:
+            df += segment.get_document_frequency(term)
+        return df
 
     def get_term_frequency(self, term: str, doc_id: int):
         positions = self.get_positions(term, doc_id)
         return len(positions) if positions else 0
 
-    def get_positions(self, term: str, doc_id: int):
-        postings = self.get_postings(term)
-        return postings[doc_id] if postings and doc_id in postings else None
+    def get_term_frequencies(self, term: str):
+        """Returns doc_id -> term frequency for all documents containing the term."""
+        frequencies = None
+        for segment in self.segments:
+            segment_frequencies = segment.get_term_frequencies(term)
+            if segment_frequencies:
+                # the decoded segment frequencies are cached, never modify them in place
+                frequencies = (
+                    {**frequencies, **segment_frequencies}
+                    if frequencies
+                    else segment_frequencies
+                )
+        if term in self.index:
+            memory_frequencies = {
+                doc_id: len(positions) for doc_id, positions in self.index[term].items()
+            }
+            frequencies = (
+                {**frequencies, **memory_frequencies}
+                if frequencies
+                else memory_frequencies
+            )
+        return frequencies
+
+    def get_positions(self, term: str, doc_id: int) -> list[int] | None:
+        """
+        Returns the sorted token ordinals of the term in the document, only the
+        posting list of the segment holding the document is decoded.
+        """
+        if doc_id in self.memory_documents_dict:
+            postings = self.index.get(term)
+            return postings.get(doc_id) if postings else None
+        for segment in self.segments:
+            if segment.has_document(doc_id):
+                return segment.get_positions(term, doc_id)
+        return None
 
     def get_document_length(self, doc_id: int):
-        return len(self.documents_dict[doc_id].tokens)
+        if doc_id in self.memory_documents_dict:
+            return self.memory_documents_dict[doc_id].length
+        return self._find_segment(doc_id).get_document_length(doc_id)
+
+    def get_document_norm(self, doc_id: int) -> float:
+        """
+        Returns the L2 norm of the document ltn (tf-idf) vector, computed from
+        the current df counts and collection size. Norms of the segment
+        documents are computed for the whole segment at once, norms of the in
+        memory documents one by one, both on first use after a change.
+        """
+        if doc_id not in self.memory_documents_dict:
+            segment = self._find_segment(doc_id)
+            return segment.get_document_norm(doc_id, self._get_segment_weights(segment))
+        if doc_id not in self.memory_norms:
+            terms = self.get_unique_terms(doc_id)
+            self.memory_norms[doc_id] = VectorUtils.compute_magnitude(
+                TfIdf.ltn_weighting(
+                    tf_vector=[len(self.index[term][doc_id]) for term in terms],
+                    df_vector=[self.get_document_frequency(term) for term in terms],
+                    total_documents=self.get_documents_count(),
+                )
+            )
+        return self.memory_norms[doc_id]
+
+    def get_max_term_weight(
+        self, term: str, avg_document_length: float | None = None
+    ) -> float:
+        """
+        Returns the maximum of (1 + log tf) / norm over the documents containing
+        the term, the norm being the document L2 norm, or the pivoted norm when
+        `avg_document_length` is given. Multiplied by the idf and the query weight
+        it is an upper bound of the term contribution to any document score.
+        """
+        return max(
+            (
+                max_weight
+                for _, max_weight in self.get_frequency_iterators(
+                    term, avg_document_length
+                )
+            ),
+            default=0.0,
+        )
+
+    def get_frequency_iterators(
+        self, term: str, avg_document_length: float | None = None
+    ) -> list[tuple[DocIdIterator, float]]:
+        """
+        Returns a lazy iterator with the term frequencies over the posting list
+        of every segment containing the term (decoded block by block) and of the
+        in memory documents, each with the maximum normalized term weight of its
+        documents (see `get_max_term_weight`).
+        """
+        sources = []
+        for segment in self.segments:
+            term_id = segment.get_term_id(term)
+            if term_id is not None:
+                sources.append(
+                    (
+                        segment.get_doc_id_iterator(term),
+                        self._get_segment_max_term_weight(
+                            segment, term_id, avg_document_length
+                        ),
+                    )
+                )
+        if term in self.index:
+            postings = self.index[term]
+            doc_ids = sorted(postings.keys())
+            sources.append(
+                (
+                    ArrayIterator(doc_ids, [len(postings[d]) for d in doc_ids]),
+                    self._get_memory_max_term_weight(term, avg_document_length),
+                )
+            )
+        return sources
+
+    def _get_segment_max_term_weight(
+        self, segment: Segment, term_id: int, avg_document_length: float | None
+    ) -> float:
+        weights = self._get_segment_weights(segment)
+        if avg_document_length is None:
+            return float(weights.max_weights[term_id])
+        max_weight = float(weights.max_pivoted_weights[term_id])
+        if avg_document_length > weights.avg_document_length:
+            # a larger average shrinks the length part of the pivoted norm
+            max_weight *= avg_document_length / weights.avg_document_length
+        return max_weight
+
+    def _get_memory_max_term_weight(
+        self, term: str, avg_document_length: float | None
+    ) -> float:
+        max_weight = 0.0
+        doc_ids = self.index[term].keys()
+        tf_weights = TfIdf.tf_log([len(self.index[term][d]) for d in doc_ids])
+        for doc_id, tf_weight in zip(doc_ids, tf_weights):
+            norm = self.get_document_norm(doc_id)
+            if avg_document_length is not None:
+                norm = TfIdf.pivoted_norm(
+                    norm=norm,
+                    document_length=self.get_document_length(doc_id),
+                    avg_document_length=avg_document_length,
+                    slope=config.TF_IDF_PIVOT_SLOPE,
+                )
+            if norm:
+                max_weight = max(max_weight, tf_weight / norm)
+        return max_weight
+
+    def _get_segment_weights(self, segment: Segment) -> SegmentWeights:
+        weights = self.segment_weights.get(segment)
+        if weights is not None:
+            return weights
+        # computed under the lock, the writers can't change the statistics
+        with self.lock:
+            if segment not in self.segment_weights:
+                dfs = self.segment_dfs.get(segment)
+                if dfs is None:
+                    document_frequencies = self._get_document_frequencies()
+                    dfs = np.fromiter(
+                        (document_frequencies.get(term, 0) for term in segment.terms),
+                        dtype=np.float64,
+                        count=segment.terms_count,
+                    )
+                    self.segment_dfs[segment] = dfs
+                total_documents = self.get_documents_count()
+                # a term of deleted documents only doesn't weigh anything
+                idf = np.log10(
+                    total_documents / np.maximum(dfs, 1),
+                    where=dfs > 0,
+                    out=np.zeros_like(dfs),
+                )
+                self.segment_weights[segment] = segment.compute_weights(
+                    idf, self.get_avg_document_length()
+                )
+            return self.segment_weights[segment]
+
+    def _get_document_frequencies(self) -> dict[str, int]:
+        """The df of every term over the live documents, the caller holds the lock."""
+        if self.document_frequencies is None:
+            dfs = {term: len(postings) for term, postings in self.index.items()}
+            for segment in self.segments:
+                segment_dfs = segment.get_live_document_frequencies().tolist()
+                for term, df in zip(segment.terms, segment_dfs):
+                    dfs[term] = dfs.get(term, 0) + df
+            self.document_frequencies = dfs
+        return self.document_frequencies
+
+    def _add_document_frequencies(self, counts: dict[str, int]):
+        """
+        Add the dfs (term -> df) of added documents to the computed ones, the
+        caller holds the lock.
+        """
+        if self.document_frequencies is not None:
+            for term, count in counts.items():
+                self.document_frequencies[term] = (
+                    self.document_frequencies.get(term, 0) + count
+                )
+        for segment, dfs in self.segment_dfs.items():
+            for term, count in counts.items():
+                term_id = segment.get_term_id(term)
+                if term_id is not None:
+                    dfs[term_id] += count
 
     def get_documents_count(self):
-        return len(self.documents_dict)
+        count = len(self.memory_documents_dict)
+        for segment in self.segments:
+            count += segment.live_documents_count
+        return count
+
+    def get_next_document_id(self) -> int:
+        """Returns the doc id following the highest one in the index."""
+        last_ids = [
+            segment.doc_ids[-1] for segment in self.segments if len(segment.doc_ids)
+        ]
+        last_ids.extend(self.memory_documents_dict.keys())
+        next_document_id = max(last_ids, default=-1) + 1
+        if self.directory is not None:
+            # the last documents may have been deleted and merged away
+            next_document_id = max(next_document_id, self.directory.next_document_id)
+        return next_document_id
 
     def get_documents_dict(self):
         return self.documents_dict
 
     def get_unique_terms(self, doc_id: int | None = None):
         if doc_id is None:
-            return list(self.index.keys())
+            if not self.segments:
+                return list(self.index.keys())
+            terms = {}
+            for segment in self.segments:
+                terms.update(dict.fromkeys(segment.get_terms()))
+            terms.update(dict.fromkeys(self.index.keys()))
+            if any(segment.deleted for segment in self.segments):
+                # skip the terms occurring only in deleted documents
+                return [term for term in terms if self.get_document_frequency(term)]
+            return list(terms)
+        elif doc_id in self.memory_documents_dict:
+            return self.memory_documents_dict[doc_id].get_unique_terms()
         else:
-            return self.documents_dict[doc_id].get_unique_terms()
+            return self._find_segment(doc_id).get_unique_terms(doc_id)
+
+    def get_term_dictionary(self) -> TermDictionary:
+        """
+        Returns the vocabulary of the index mapping the terms to dense ids, one
+        instance shared by all engines. Terms added to the index after it was
+        built get their ids once an engine adds them, the ids never change.
+        """
+        with self.lock:
+            if self.term_dictionary is None:
+                self.term_dictionary = TermDictionary.build(
+                    sorted(self.get_unique_terms())
+                )
+            return self.term_dictionary
 
     def get_avg_document_length(self):
-        doc_ids = self.documents_dict.keys()
-        return (
-            sum([self.get_document_length(doc_id) for doc_id in doc_ids])
-            / self.get_documents_count()
-        )
+        total_length = sum(doc.length for doc in self.memory_documents_dict.values())
+        for segment in self.segments:
+            total_length += segment.get_total_document_length()
+        documents_count = self.get_documents_count()
+        return total_length / documents_count if documents_count else 0
 
     def get_postings(self, term: str):
         """
@@ -80,16 +675,66 @@ class PositionalIndex:
         Posting list is a dictionary where the keys are document IDs
         and the values are lists of positions at which the term occurs in the document
         """
-        return self.index[term] if term in self.index else None
+        postings = None
+        for segment in self.segments:
+            segment_postings = segment.get_postings(term)
+            if segment_postings:
+                # the decoded segment postings are cached, never modify them in place
+                postings = (
+                    {**postings, **segment_postings} if postings else segment_postings
+                )
+        if term in self.index:
+            memory_postings = self.index[term]
+            postings = {**postings, **memory_postings} if postings else memory_postings
+        return postings
+
+    def get_doc_id_iterator(self, term: str) -> DocIdIterator:
+        """
+        Returns a lazy iterator over the doc ids of the term in ascending order,
+        the segment posting lists are decoded block by block as it advances.
+        A frequent term is iterated from its bitmap.
+        """
+        bitmap = self.get_doc_id_bitmap(term)
+        if bitmap is not None:
+            return BitmapIterator(bitmap)
+        return self._get_postings_iterator(term)
+
+    def get_doc_id_bitmap(self, term: str) -> RoaringBitmap | None:
+        """
+        Returns the doc ids of a term in at least
+        `config.BITMAP_MIN_DOCUMENT_FREQUENCY` documents as a roaring bitmap,
+        built on first use, None for a rarer term.
+        """
+        bitmaps = self.bitmaps
+        bitmap = bitmaps.get(term)
+        if bitmap is None:
+            if self.get_document_frequency(term) < config.BITMAP_MIN_DOCUMENT_FREQUENCY:
+                return None
+            bitmap = RoaringBitmap.from_doc_ids(self._get_postings_iterator(term))
+            # a bitmap built while the documents changed lands in the old dict
+            bitmaps[term] = bitmap
+        return bitmap
+
+    def _get_postings_iterator(self, term: str) -> DocIdIterator:
+        iterators = [
+            segment.get_doc_id_iterator(term)
+            for segment in self.segments
+            if segment.get_term_id(term) is not None
+        ]
+        if term in self.index:
+            iterators.append(ArrayIterator(sorted(self.index[term].keys())))
+        if not iterators:
+            return ArrayIterator([])
+        return iterators[0] if len(iterators) == 1 else OrIterator(iterators)
 
     def __repr__(self):
         return json.dumps(
             {
                 term: {
                     doc_id: {"tf": len(positions), "positions": positions}
-                    for doc_id, positions in postings.items()
+                    for doc_id, positions in self.get_postings(term).items()
                 }
-                for term, postings in self.index.items()
+                for term in self.get_unique_terms()
             },
             indent=2,
             ensure_ascii=False,
@@ -0,0 +1,255 @@
+import os
+import time
+
+import numpy as np
+
+from utils.embeddings import exact_top_k, fingerprint, normalize
+from utils.heap import top_k_indices
+import config
+
+BLOCK_SIZE = 4096
+
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantization, every dimension is mapped linearly from its
+    [minimum, maximum] range to 256 levels (4x smaller than float32).
+    """
+
+    def __init__(self, minimum: np.ndarray, scale: np.ndarray):
+        self.minimum = minimum
+        self.scale = scale
+
+    @staticmethod
+    def train(vectors: np.ndarray) -> "ScalarQuantizer":
+        minimum = vectors.min(axis=0)
+        scale = (vectors.max(axis=0) - minimum) / 255
+        return ScalarQuantizer(minimum, np.where(scale == 0, 1, scale))
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.minimum) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Asymmetric dot products of the float query and the quantized vectors."""
+        # q . (minimum + scale * code) = q . minimum + (q * scale) . code
+        return codes.astype(np.float32) @ (query * self.scale) + query @ self.minimum
+
+    def save(self, file: str):
+        np.savez(file, minimum=self.minimum, scale=self.scale)
+
+    @staticmethod
+    def load(file: str) -> "ScalarQuantizer":
+        data = np.load(file)
+        return ScalarQuantizer(data["minimum"], data["scale"])
+
+
+class ProductQuantizer:
+    """
+    Product quantization, the vector is split into subspaces and every subvector
+    is replaced by the id of the closest of 256 centroids of its subspace
+    (one byte per subspace).
+    """
+
+    def __init__(self, codebooks: list[np.ndarray]):
+        self.codebooks = codebooks
+        self.splits = np.cumsum([len(codebook[0]) for codebook in codebooks])[:-1]
+
+    @staticmethod
+    def train(
+        vectors: np.ndarray, subspaces: int, iterations: int = 15
+    ) -> "ProductQuantizer":
+        rng = np.random.default_rng(0)
+        codebooks = []
+        print(f"Training product quantizer with {subspaces} subspaces")
+        for subvectors in np.array_split(vectors, subspaces, axis=1):
+            centroids = subvectors[
+                rng.choice(len(subvectors), min(256, len(subvectors)), replace=False)
+            ]
+            for _ in range(iterations):
+                assignment = ProductQuantizer._closest(subvectors, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, subvectors)
+                counts = np.bincount(assignment, minlength=len(centroids))
+                # keep the old centroid for empty clusters
+                centroids = np.where(
+                    counts[:, np.newaxis] > 0,
+                    sums / np.maximum(counts, 1)[:, np.newaxis],
+                    centroids,
+                )
+            codebooks.append(centroids.astype(np.float32))
+        return ProductQuantizer(codebooks)
+
+    @staticmethod
+    def _closest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin ||x - c||^2 = argmin ||c||^2 - 2 x . c
+        distances = (centroids**2).sum(axis=1) - 2 * vectors @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.column_stack(
+            [
+                self._closest(subvectors, codebook)
+                for subvectors, codebook in zip(
+                    np.split(vectors, self.splits, axis=1), self.codebooks
+                )
+            ]
+        ).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Asymmetric dot products through per-subspace lookup tables."""
+        tables = [
+            codebook @ subquery
+            for subquery, codebook in zip(np.split(query, self.splits), self.codebooks)
+        ]
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for subspace, table in enumerate(tables):
+            scores += table[codes[:, subspace]]
+        return scores
+
+    def save(self, file: str):
+        np.savez(
+            file,
+            **{f"codebook_{i}": codebook for i, codebook in enumerate(self.codebooks)},
+        )
+
+    @staticmethod
+    def load(file: str) -> "ProductQuantizer":
+        data = np.load(file)
+        return ProductQuantizer(
+            [data[f"codebook_{i}"] for i in range(len(data.files))]
+        )
+
+
+QUANTIZERS = {
+    "int8": ScalarQuantizer,
+    "pq": ProductQuantizer,
+}
+
+
+class QuantizedEmbeddings:
+    """
+    Compressed copy of the (unit normalized) embeddings used for the candidate
+    scoring. The top candidates are re-ranked with the exact float embeddings,
+    which can stay memory mapped on disk as only the re-ranked rows are read.
+    """
+
+    def __init__(self, quantizer, codes: np.ndarray, embeddings: np.ndarray):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.embeddings = embeddings
+
+    @staticmethod
+    def build(embeddings: np.ndarray, method: str) -> "QuantizedEmbeddings":
+        rng = np.random.default_rng(0)
+        sample_size = min(len(embeddings), config.QUANTIZATION_TRAINING_POINTS)
+        sample_rows = np.sort(rng.choice(len(embeddings), sample_size, replace=False))
+        sample = normalize(np.asarray(embeddings[sample_rows], dtype=np.float32))
+
+        if method == "pq":
+            quantizer = ProductQuantizer.train(sample, config.PQ_SUBSPACES)
+        elif method == "int8":
+            quantizer = ScalarQuantizer.train(sample)
+        else:
+            raise ValueError(f"Invalid quantization method: {method}")
+
+        codes = np.concatenate(
+            [
+                quantizer.encode(
+                    normalize(np.asarray(embeddings[start : start + BLOCK_SIZE]))
+                )
+                for start in range(0, len(embeddings), BLOCK_SIZE)
+            ]
+        )
+        return QuantizedEmbeddings(quantizer, codes, embeddings)
+
+    @staticmethod
+    def load_or_build(
+        embeddings: np.ndarray, method: str, directory: str | None
+    ) -> "QuantizedEmbeddings":
+        if directory:
+            quantizer_file = os.path.join(directory, f"{method}.npz")
+            codes_file = os.path.join(directory, f"{method}_codes.npy")
+            fingerprint_file = os.path.join(directory, f"{method}_fingerprint.txt")
+            if os.path.exists(fingerprint_file):
+                with open(fingerprint_file) as f:
+                    if f.read() == fingerprint(embeddings):
+                        print(f"Loading {method} quantized embeddings from {directory}")
+                        return QuantizedEmbeddings(
+                            QUANTIZERS[method].load(quantizer_file),
+                            np.load(codes_file),
+                            embeddings,
+                        )
+
+        quantized = QuantizedEmbeddings.build(embeddings, method)
+        if directory and config.SAVE_TO_DISK:
+            os.makedirs(directory, exist_ok=True)
+            quantized.quantizer.save(quantizer_file)
+            np.save(codes_file, quantized.codes)
+            with open(fingerprint_file, "w") as f:
+                f.write(fingerprint(embeddings))
+        return quantized
+
+    def add(self, embeddings: np.ndarray):
+        """Encode the rows appended to the embedding matrix since the last build."""
+        new = np.asarray(embeddings[len(self.codes) :])
+        self.embeddings = embeddings
+        if len(new):
+            self.codes = np.concatenate(
+                [self.codes, self.quantizer.encode(normalize(new))]
+            )
+
+    def approximate_scores(
+        self, query: np.ndarray, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        codes = self.codes if rows is None else self.codes[rows]
+        return self.quantizer.scores(codes, query)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        rerank: int,
+        rows: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns rows and scores of the top k, best first. The `rerank` best
+        candidates by the approximate score (at least k) are scored exactly.
+        `rows` limits the search to a subset of rows (e.g. IVF candidates).
+        """
+        query = normalize(np.asarray(query, dtype=np.float32))
+        if rows is None:
+            rows = np.arange(len(self.codes))
+        scores = self.approximate_scores(query, rows)
+
+        top = np.sort(top_k_indices(scores, max(k, rerank), rows))
+        rows = rows[top]
+        if rerank:
+            exact = normalize(np.asarray(self.embeddings[rows], dtype=np.float32))
+            scores = exact @ query
+        else:
+            scores = scores[top]
+
+        top = top_k_indices(scores, k, rows)
+        return rows[top], scores[top]
+
+    def recall_report(self, queries: np.ndarray, k: int, reranks: list[int]):
+        """Print recall@k of the quantized search against the float brute force search."""
+        exact = exact_top_k(self.embeddings, queries, k)
+        float_bytes = self.embeddings.shape[1] * 4
+        code_bytes = self.codes.shape[1]
+        print(
+            f"Recall@{k} over {len(queries)} queries, "
+            f"{code_bytes} bytes/vector ({float_bytes / code_bytes:.0f}x smaller)"
+        )
+        for rerank in reranks:
+            start = time.perf_counter()
+            found = [self.search(query, k, rerank)[0] for query in queries]
+            ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = np.mean(
+                [
+                    len(expected.intersection(rows.tolist())) / len(expected)
+                    for expected, rows in zip(exact, found)
+                ]
+            )
+            print(f"  rerank={rerank}: recall {recall:.3f}, {ms:.2f} ms/query")
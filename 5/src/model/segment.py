@@ -0,0 +1,713 @@
+import copy
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from functools import lru_cache
+from itertools import accumulate
+from typing import Iterable
+
+import numpy as np
+from tqdm import tqdm
+from model.document import Document
+from model.term_dictionary import TermDictionary
+from utils import vbyte
+from utils.doc_id_iterator import BlockIterator
+from utils.tfidf import TfIdf
+import config
+
+MAGIC = b"IRSEG007"
+
+# Sections of the segment file as listed in the header. Every section is a flat
+# array in native (little-endian) byte order, aligned to 8 bytes.
+#
+# Nothing depending on the idf is stored, the document norms and the upper
+# bounds of the term weights change with the collection and are computed from
+# the current statistics of the whole index (see `Segment.compute_weights`).
+#
+# The posting list of a term is split into blocks of POSTINGS_BLOCK_SIZE
+# documents, the last doc id of every block is kept uncompressed as a skip
+# pointer, so a block can be located and decoded without touching the others.
+SECTIONS = [
+    "term_dictionary",  # sorted terms, front coded (see TermDictionary)
+    "term_dictionary_offsets",  # Q[n_terms / 16] - front coded block offsets
+    "term_dfs",  # I[n_terms] - number of documents containing the term
+    "term_block_offsets",  # Q[n_terms + 1] - term boundaries in the blocks
+    "block_last_doc_ids",  # I[n_blocks] - last doc id of the block
+    "block_postings_offsets",  # Q[n_blocks + 1] - block boundaries in postings
+    "block_positions_offsets",  # Q[n_blocks + 1] - block boundaries in positions
+    "postings",  # per block: VByte doc id deltas, then VByte term frequencies
+    "positions",  # per block and doc: VByte token ordinal deltas
+    "doc_ids",  # I[n_docs] - sorted doc ids
+    "doc_lengths",  # I[n_docs] - number of tokens in the document
+    "stored_offsets",  # Q[2 * n_docs + 1] - title/text boundaries in stored
+    "stored",  # utf-8 encoded titles and texts
+    "vector_offsets",  # Q[n_docs + 1] - doc boundaries in vectors (in items)
+    "vectors",  # I[] - per doc: delta encoded sorted ids of its unique terms
+    "vector_frequencies",  # I[] - per doc: term frequencies of its unique terms
+]
+
+SECTION_TYPECODES = {
+    "term_dictionary": "B",
+    "term_dictionary_offsets": "Q",
+    "term_dfs": "I",
+    "term_block_offsets": "Q",
+    "block_last_doc_ids": "I",
+    "block_postings_offsets": "Q",
+    "block_positions_offsets": "Q",
+    "postings": "B",
+    "positions": "B",
+    "doc_ids": "I",
+    "doc_lengths": "I",
+    "stored_offsets": "Q",
+    "stored": "B",
+    "vector_offsets": "Q",
+    "vectors": "I",
+    "vector_frequencies": "I",
+}
+
+# magic, terms count, documents count, postings block size, then the sections
+HEADER = struct.Struct("<8sQQQ" + "QQ" * len(SECTIONS))
+
+
+def _delta_encode(values) -> array:
+    deltas = array("I")
+    previous = 0
+    for value in values:
+        deltas.append(value - previous)
+        previous = value
+    return deltas
+
+
+def _prefix_sums(deltas: np.ndarray, run_lengths: np.ndarray) -> np.ndarray:
+    """Prefix sums of the deltas, restarting at every run of the given lengths."""
+    sums = np.cumsum(deltas)
+    starts = np.cumsum(run_lengths) - run_lengths
+    sums -= np.repeat(sums[starts] - deltas[starts], run_lengths)
+    return sums
+
+
+def _pad(f):
+    padding = -f.tell() % 8
+    if padding:
+        f.write(b"\0" * padding)
+
+
+class SegmentWriter:
+    """
+    Writes an index into a single immutable segment file which can be memory
+    mapped by `Segment`. The file is written to a temporary file first and then
+    atomically moved into place, so an existing segment is never left half written.
+    """
+
+    @staticmethod
+    def write(index, file: str, show_progress: bool = False):
+        terms = sorted(index.get_unique_terms())
+        term_ids = {term: i for i, term in enumerate(terms)}
+        doc_ids = sorted(index.get_documents_dict().keys())
+
+        directory = os.path.dirname(os.path.abspath(file))
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"\0" * HEADER.size)
+                sections = SegmentWriter._write_sections(
+                    f, index, terms, term_ids, doc_ids, show_progress
+                )
+                f.seek(0)
+                f.write(
+                    HEADER.pack(
+                        MAGIC,
+                        len(terms),
+                        len(doc_ids),
+                        config.POSTINGS_BLOCK_SIZE,
+                        *(value for name in SECTIONS for value in sections[name]),
+                    )
+                )
+            os.replace(tmp_file, file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+    @staticmethod
+    def _write_sections(f, index, terms, term_ids, doc_ids, show_progress):
+        sections = {}
+
+        def write_section(name, data):
+            _pad(f)
+            start = f.tell()
+            if isinstance(data, (bytes, bytearray)):
+                f.write(data)
+            else:
+                data.tofile(f)
+            sections[name] = (start, f.tell() - start)
+
+        term_dictionary, term_dictionary_offsets, _ = TermDictionary.encode(terms)
+        write_section("term_dictionary", term_dictionary)
+        write_section("term_dictionary_offsets", term_dictionary_offsets)
+
+        term_dfs = array("I")
+        term_block_offsets = array("Q", [0])
+        block_last_doc_ids = array("I")
+        block_postings_offsets = array("Q", [0])
+        block_positions_offsets = array("Q", [0])
+
+        # term frequencies of the document vectors, filled term by term
+        doc_frequencies = {doc_id: {} for doc_id in doc_ids}
+
+        # postings and positions are written in a single pass over the terms,
+        # the positions are spooled to a temporary file and appended afterwards
+        with tempfile.TemporaryFile() as positions_file:
+            _pad(f)
+            postings_start = f.tell()
+            postings_bytes = 0
+            positions_bytes = 0
+
+            iterable = tqdm(terms, desc="Writing postings") if show_progress else terms
+            for term in iterable:
+                postings = index.get_postings(term)
+                term_doc_ids = sorted(postings.keys())
+                frequencies = [len(postings[doc_id]) for doc_id in term_doc_ids]
+
+                for start in range(0, len(term_doc_ids), config.POSTINGS_BLOCK_SIZE):
+                    end = start + config.POSTINGS_BLOCK_SIZE
+                    block_doc_ids = term_doc_ids[start:end]
+                    # the first doc id of a block is stored as is, so every
+                    # block can be decoded on its own
+                    block_frequencies = array("I", frequencies[start:end])
+                    encoded = vbyte.encode(
+                        _delta_encode(block_doc_ids) + block_frequencies
+                    )
+                    f.write(encoded)
+                    positions = array("I")
+                    for doc_id in block_doc_ids:
+                        positions.extend(_delta_encode(postings[doc_id]))
+                    encoded_positions = vbyte.encode(positions)
+                    positions_file.write(encoded_positions)
+
+                    postings_bytes += len(encoded)
+                    positions_bytes += len(encoded_positions)
+                    block_last_doc_ids.append(block_doc_ids[-1])
+                    block_postings_offsets.append(postings_bytes)
+                    block_positions_offsets.append(positions_bytes)
+                term_dfs.append(len(term_doc_ids))
+                term_block_offsets.append(len(block_last_doc_ids))
+
+                for doc_id, frequency in zip(term_doc_ids, frequencies):
+                    doc_frequencies[doc_id][term_ids[term]] = frequency
+
+            sections["postings"] = (postings_start, f.tell() - postings_start)
+            # offsets are written after the postings section in the file, but
+            # the header keeps them in the SECTIONS order
+            positions_file.seek(0)
+            _pad(f)
+            positions_start = f.tell()
+            shutil.copyfileobj(positions_file, f)
+            sections["positions"] = (positions_start, f.tell() - positions_start)
+
+        write_section("term_dfs", term_dfs)
+        write_section("term_block_offsets", term_block_offsets)
+        write_section("block_last_doc_ids", block_last_doc_ids)
+        write_section("block_postings_offsets", block_postings_offsets)
+        write_section("block_positions_offsets", block_positions_offsets)
+
+        documents_dict = index.get_documents_dict()
+        stored_offsets = array("Q", [0])
+        vector_offsets = array("Q", [0])
+        stored = bytearray()
+        vectors = array("I")
+        vector_frequencies = array("I")
+        for doc_id in doc_ids:
+            doc = documents_dict[doc_id]
+            stored += doc.title.encode("utf-8")
+            stored_offsets.append(len(stored))
+            stored += doc.text.encode("utf-8")
+            stored_offsets.append(len(stored))
+            vector = sorted(doc_frequencies[doc_id].items())
+            vectors.extend(_delta_encode(term_id for term_id, _ in vector))
+            vector_frequencies.extend(frequency for _, frequency in vector)
+            vector_offsets.append(len(vectors))
+
+        write_section("doc_ids", array("I", doc_ids))
+        write_section(
+            "doc_lengths",
+            array("I", (index.get_document_length(doc_id) for doc_id in doc_ids)),
+        )
+        write_section("stored_offsets", stored_offsets)
+        write_section("stored", stored)
+        write_section("vector_offsets", vector_offsets)
+        write_section("vectors", vectors)
+        write_section("vector_frequencies", vector_frequencies)
+
+        return sections
+
+
+class Segment:
+    """
+    Read-only view of a segment file written by `SegmentWriter`.
+
+    The file is memory mapped, so opening a segment only parses the header and
+    the pages are loaded by the OS once the queries actually touch them.
+
+    The file itself is never modified, deleted documents are recorded in the
+    `deleted` tombstones (persisted as a bitmap over the document ordinals) and
+    filtered out of everything the segment returns until it is merged away.
+    """
+
+    # doc ids of the deleted documents, replaced on every deletion (never
+    # modified in place), so a snapshot keeps seeing the old set
+    deleted: frozenset[int]
+
+    def __init__(self, file: str):
+        self.file = file
+        with open(file, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self._mmap)
+        if header[0] != MAGIC:
+            raise ValueError(f"File {file} is not a valid index segment")
+        self.terms_count, self.documents_count = header[1], header[2]
+        self.block_size = header[3]
+
+        self._view = view = memoryview(self._mmap)
+        for i, name in enumerate(SECTIONS):
+            start, length = header[4 + 2 * i], header[5 + 2 * i]
+            section = view[start : start + length]
+            typecode = SECTION_TYPECODES[name]
+            setattr(self, name, section if typecode == "B" else section.cast(typecode))
+
+        self.terms = TermDictionary(
+            self.term_dictionary, self.term_dictionary_offsets, self.terms_count
+        )
+        self.deleted = frozenset()
+        # the dfs over the live documents (by term id), None without deletions
+        self.live_dfs = None
+        self._decode_postings = lru_cache(maxsize=config.POSTINGS_CACHE_SIZE)(
+            self._decode_postings
+        )
+        self._decode_frequencies = lru_cache(maxsize=config.POSTINGS_CACHE_SIZE)(
+            self._decode_frequencies
+        )
+
+    def close(self):
+        self._decode_postings.cache_clear()
+        self._decode_frequencies.cache_clear()
+        for name in SECTIONS:
+            getattr(self, name).release()
+        self._view.release()
+        self.terms = None
+        self._mmap.close()
+
+    def delete(self, doc_ids: Iterable[int]):
+        deleted = self.deleted.union(doc_ids)
+        self._subtract_live_dfs(deleted - self.deleted)
+        self.deleted = deleted
+
+    def snapshot(self) -> "Segment":
+        """Returns a view of the segment which doesn't see later deletions."""
+        return copy.copy(self)
+
+    @property
+    def live_documents_count(self) -> int:
+        return self.documents_count - len(self.deleted)
+
+    def get_deleted_ratio(self) -> float:
+        return len(self.deleted) / self.documents_count if self.documents_count else 0
+
+    def get_deletion_bitmap(self) -> bytes:
+        bitmap = bytearray((self.documents_count + 7) // 8)
+        for doc_id in self.deleted:
+            i = self._get_doc_index(doc_id)
+            bitmap[i >> 3] |= 1 << (i & 7)
+        return bytes(bitmap)
+
+    def load_deletion_bitmap(self, bitmap: bytes):
+        self.deleted = frozenset(
+            self.doc_ids[8 * byte_index + bit]
+            for byte_index, byte in enumerate(bitmap)
+            if byte
+            for bit in range(8)
+            if byte >> bit & 1
+        )
+        self.live_dfs = None
+        self._subtract_live_dfs(self.deleted)
+
+    def _subtract_live_dfs(self, doc_ids: Iterable[int]):
+        """
+        Subtract the newly deleted documents from the live dfs. A new array,
+        a snapshot of the segment keeps the old one.
+        """
+        term_ids = []
+        for doc_id in doc_ids:
+            i = self._get_doc_index(doc_id)
+            term_ids.extend(
+                accumulate(
+                    self.vectors[self.vector_offsets[i] : self.vector_offsets[i + 1]]
+                )
+            )
+        if not term_ids:
+            return
+        live_dfs = self.live_dfs
+        if live_dfs is None:
+            live_dfs = np.array(self.term_dfs, dtype=np.int64)
+        self.live_dfs = live_dfs - np.bincount(term_ids, minlength=self.terms_count)
+
+    def get_term_id(self, term: str) -> int | None:
+        return self.terms.get_id(term)
+
+    def get_term(self, term_id: int) -> str:
+        return self.terms.get_term(term_id)
+
+    def get_terms(self) -> list[str]:
+        return list(self.terms)
+
+    def get_document_frequency(self, term: str) -> int:
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return 0
+        if self.live_dfs is not None:
+            return int(self.live_dfs[term_id])
+        return self.term_dfs[term_id]
+
+    def get_postings(self, term: str) -> dict[int, list[int]] | None:
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return None
+        return self._filter_deleted(self._decode_postings(term_id))
+
+    def get_positions(self, term: str, doc_id: int) -> list[int] | None:
+        """The positions of the term in a live document of the segment."""
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return None
+        return self._decode_postings(term_id).get(doc_id)
+
+    def _filter_deleted(self, postings: dict) -> dict:
+        # the decoded postings are cached, the filtered ones are a new dict
+        if not self.deleted:
+            return postings
+        return {
+            doc_id: value
+            for doc_id, value in postings.items()
+            if doc_id not in self.deleted
+        }
+
+    def get_blocks(self, term: str) -> range:
+        """
+        Returns the numbers of the posting list blocks of the term, the blocks
+        can be skipped by their last doc ids in `block_last_doc_ids`.
+        """
+        term_id = self.get_term_id(term)
+        return self._get_term_blocks(term_id) if term_id is not None else range(0)
+
+    def get_doc_id_iterator(self, term: str) -> BlockIterator:
+        """Returns a lazy iterator over the live doc ids of the term."""
+        return BlockIterator(self, self.get_blocks(term))
+
+    def decode_block(self, block: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the doc ids and term frequencies of the block, deleted included."""
+        start = self.block_postings_offsets[block]
+        end = self.block_postings_offsets[block + 1]
+        values = vbyte.decode(self.postings[start:end])
+        count = len(values) // 2
+        return np.cumsum(values[:count]), values[count:]
+
+    def _decode_term(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the doc ids and term frequencies of the whole posting list,
+        all its blocks are decoded at once.
+        """
+        blocks = self._get_term_blocks(term_id)
+        start = self.block_postings_offsets[blocks.start]
+        end = self.block_postings_offsets[blocks.stop]
+        values = vbyte.decode(self.postings[start:end])
+
+        # every block holds its doc id deltas followed by its term frequencies
+        df = self.term_dfs[term_id]
+        if len(blocks) == 1:
+            return np.cumsum(values[:df]), values[df:]
+        block_lengths = np.full(len(blocks), self.block_size)
+        block_lengths[-1] = df - self.block_size * (len(blocks) - 1)
+        is_doc_id = np.repeat(
+            np.tile([True, False], len(blocks)), np.repeat(block_lengths, 2)
+        )
+        doc_ids = _prefix_sums(values[is_doc_id], block_lengths)
+        return doc_ids, values[~is_doc_id]
+
+    def decode_block_positions(
+        self, block: int, frequencies: np.ndarray
+    ) -> list[np.ndarray]:
+        """Returns the positions of every document of the block."""
+        start = self.block_positions_offsets[block]
+        end = self.block_positions_offsets[block + 1]
+        deltas = vbyte.decode(self.positions[start:end])
+        return np.split(
+            _prefix_sums(deltas, frequencies), np.cumsum(frequencies)[:-1]
+        )
+
+    def _get_term_blocks(self, term_id: int) -> range:
+        return range(
+            self.term_block_offsets[term_id], self.term_block_offsets[term_id + 1]
+        )
+
+    def _decode_term_positions(
+        self, term_id: int, frequencies: np.ndarray
+    ) -> np.ndarray:
+        """Returns the positions of all documents of the term, concatenated."""
+        blocks = self._get_term_blocks(term_id)
+        start = self.block_positions_offsets[blocks.start]
+        end = self.block_positions_offsets[blocks.stop]
+        return _prefix_sums(vbyte.decode(self.positions[start:end]), frequencies)
+
+    def _decode_postings(self, term_id: int) -> dict[int, list[int]]:
+        doc_ids, frequencies = self._decode_term(term_id)
+        positions = self._decode_term_positions(term_id, frequencies).tolist()
+        ends = np.cumsum(frequencies).tolist()
+        return {
+            doc_id: positions[doc_end - tf : doc_end]
+            for doc_id, tf, doc_end in zip(doc_ids.tolist(), frequencies.tolist(), ends)
+        }
+
+    def get_live_document_frequencies(self) -> np.ndarray:
+        """The df of every term (by term id) over the live documents."""
+        if self.live_dfs is not None:
+            return self.live_dfs
+        return np.array(self.term_dfs, dtype=np.int64)
+
+    def compute_weights(
+        self,
+        idf: np.ndarray,
+        avg_document_length: float,
+        slope: float = config.TF_IDF_PIVOT_SLOPE,
+    ) -> "SegmentWeights":
+        """
+        Computes the ltn document norms and the upper bounds of the normalized
+        term weights from the idf of every term (by term id) of the collection
+        the segment is part of.
+        """
+        ordinals, term_ids, frequencies = self._decode_vectors()
+        tf_weights = 1 + np.log10(frequencies)
+        norms = np.sqrt(
+            np.bincount(
+                ordinals,
+                weights=(tf_weights * idf[term_ids]) ** 2,
+                minlength=self.documents_count,
+            )
+        )
+        pivoted_norms = TfIdf.pivoted_norm(
+            norm=norms,
+            document_length=np.frombuffer(self.doc_lengths, dtype=np.uint32),
+            avg_document_length=avg_document_length,
+            slope=slope,
+        )
+
+        # the deleted documents don't count to the bounds
+        live = self._get_live_mask()[ordinals]
+        max_weights = np.zeros(self.terms_count)
+        max_pivoted_weights = np.zeros(self.terms_count)
+        for target, doc_norms in (
+            (max_weights, norms),
+            (max_pivoted_weights, pivoted_norms),
+        ):
+            entry_norms = doc_norms[ordinals]
+            mask = live & (entry_norms != 0)
+            np.maximum.at(target, term_ids[mask], tf_weights[mask] / entry_norms[mask])
+        return SegmentWeights(
+            norms, max_weights, max_pivoted_weights, avg_document_length
+        )
+
+    def _decode_vectors(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the document ordinal, the term id and the term frequency of
+        every (document, unique term) pair of the segment, document by document.
+        """
+        lengths = np.diff(np.frombuffer(self.vector_offsets, dtype=np.uint64))
+        lengths = lengths.astype(np.int64)
+        ordinals = np.repeat(np.arange(self.documents_count), lengths)
+        deltas = np.frombuffer(self.vectors, dtype=np.uint32).astype(np.int64)
+        # documents without any term have no run to restart the sums at
+        term_ids = _prefix_sums(deltas, lengths[lengths > 0])
+        frequencies = np.frombuffer(self.vector_frequencies, dtype=np.uint32)
+        return ordinals, term_ids, frequencies
+
+    def _get_live_mask(self) -> np.ndarray:
+        live = np.ones(self.documents_count, dtype=bool)
+        for doc_id in self.deleted:
+            live[self._get_doc_index(doc_id)] = False
+        return live
+
+    def get_term_frequencies(self, term: str) -> dict[int, int] | None:
+        term_id = self.get_term_id(term)
+        if term_id is None:
+            return None
+        return self._filter_deleted(self._decode_frequencies(term_id))
+
+    def _decode_frequencies(self, term_id: int) -> dict[int, int]:
+        """Decode only the doc ids and term frequencies, skipping the positions."""
+        doc_ids, frequencies = self._decode_term(term_id)
+        return dict(zip(doc_ids.tolist(), frequencies.tolist()))
+
+    def compression_report(self):
+        """
+        Print the bytes per posting and the decode throughput of the compressed
+        posting lists, compared with plain uint32 delta arrays and the dicts of
+        lists `PositionalIndex` keeps in memory.
+        """
+        postings_count = sum(self.term_dfs)
+        blocks = range(len(self.block_last_doc_ids))
+        if not postings_count:
+            print("Segment has no postings")
+            return
+        term_ids = range(self.terms_count)
+
+        start = time.perf_counter()
+        decoded = [self._decode_term(term_id) for term_id in term_ids]
+        postings_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for block in blocks:
+            self.decode_block(block)
+        blocks_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for term_id, (_, frequencies) in zip(term_ids, decoded):
+            self._decode_term_positions(term_id, frequencies)
+        positions_seconds = time.perf_counter() - start
+        positions_count = sum(int(frequencies.sum()) for _, frequencies in decoded)
+
+        # the same doc ids as uint32 delta arrays, decoded by a prefix sum
+        uint32_deltas = [
+            np.diff(doc_ids, prepend=0).astype(np.uint32) for doc_ids, _ in decoded
+        ]
+        start = time.perf_counter()
+        for deltas in uint32_deltas:
+            np.cumsum(deltas)
+        uint32_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dicts = [self._decode_postings(term_id) for term_id in term_ids]
+        dicts_seconds = time.perf_counter() - start
+        dict_bytes = 0
+        for postings in dicts:
+            dict_bytes += sys.getsizeof(postings)
+            for doc_id, positions in postings.items():
+                dict_bytes += sys.getsizeof(doc_id) + sys.getsizeof(positions)
+                dict_bytes += sum(sys.getsizeof(position) for position in positions)
+
+        # skip pointers and block offsets are counted to the compressed postings
+        postings_bytes = len(self.postings) + len(blocks) * (4 + 8)
+        positions_bytes = len(self.positions) + len(blocks) * 8
+        print(
+            f"Postings of {os.path.basename(self.file)}: {postings_count} postings, "
+            f"{positions_count} positions, {len(blocks)} blocks"
+        )
+        print(
+            f"  VByte blocks: {postings_bytes / postings_count:.2f} B/posting, "
+            f"{positions_bytes / positions_count:.2f} B/position, "
+            f"{postings_count / postings_seconds / 1e6:.2f} M postings/s, "
+            f"{positions_count / positions_seconds / 1e6:.2f} M positions/s "
+            f"({postings_count / blocks_seconds / 1e6:.2f} M postings/s "
+            f"block by block)"
+        )
+        print(
+            f"  uint32 arrays: {8:.2f} B/posting, {4:.2f} B/position, "
+            f"{postings_count / uint32_seconds / 1e6:.2f} M postings/s (doc ids only)"
+        )
+        print(
+            f"  dicts of lists: {dict_bytes / postings_count:.2f} B/posting "
+            f"(positions included), built from the blocks at "
+            f"{postings_count / dicts_seconds / 1e6:.2f} M postings/s"
+        )
+
+    def _get_doc_index(self, doc_id: int) -> int | None:
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < self.documents_count and self.doc_ids[i] == doc_id:
+            return i
+        return None
+
+    def has_document(self, doc_id: int) -> bool:
+        return doc_id not in self.deleted and self._get_doc_index(doc_id) is not None
+
+    def get_document_ids(self) -> list[int]:
+        return [doc_id for doc_id in self.doc_ids if doc_id not in self.deleted]
+
+    def get_document_length(self, doc_id: int) -> int:
+        return self.doc_lengths[self._get_doc_index(doc_id)]
+
+    def get_document_norm(self, doc_id: int, weights: "SegmentWeights") -> float:
+        return float(weights.norms[self._get_doc_index(doc_id)])
+
+    def get_total_document_length(self) -> int:
+        """Total length of the live documents."""
+        total_length = sum(self.doc_lengths)
+        for doc_id in self.deleted:
+            total_length -= self.get_document_length(doc_id)
+        return total_length
+
+    def get_unique_terms(self, doc_id: int) -> list[str]:
+        i = self._get_doc_index(doc_id)
+        term_ids = accumulate(
+            self.vectors[self.vector_offsets[i] : self.vector_offsets[i + 1]]
+        )
+        return self.terms.get_terms(term_ids)
+
+    def get_document(self, doc_id: int) -> Document | None:
+        i = self._get_doc_index(doc_id)
+        if i is None or doc_id in self.deleted:
+            return None
+        title_start, text_start, text_end = self.stored_offsets[2 * i : 2 * i + 3]
+        return Document.restore(
+            doc_id=doc_id,
+            title=str(self.stored[title_start:text_start], "utf-8"),
+            text=str(self.stored[text_start:text_end], "utf-8"),
+        )
+
+
+class SegmentWeights:
+    """
+    The document norms (by document ordinal) of a segment and the upper bounds
+    of its normalized term weights (by term id), valid for the collection
+    statistics they were computed from.
+    """
+
+    def __init__(
+        self,
+        norms: np.ndarray,
+        max_weights: np.ndarray,
+        max_pivoted_weights: np.ndarray,
+        avg_document_length: float,
+    ):
+        self.norms = norms
+        # max (1 + log tf) / norm over the live documents containing the term,
+        # the pivoted variant for the pivoted norm at `avg_document_length`
+        self.max_weights = max_weights
+        self.max_pivoted_weights = max_pivoted_weights
+        self.avg_document_length = avg_document_length
+
+
+class StoredDocuments(Mapping):
+    """doc_id -> Document mapping decoding the stored documents of a segment on access."""
+
+    def __init__(self, segment: Segment):
+        self.segment = segment
+
+    def __getitem__(self, doc_id: int) -> Document:
+        doc = self.segment.get_document(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __contains__(self, doc_id) -> bool:
+        return self.segment.has_document(doc_id)
+
+    def __iter__(self):
+        if not self.segment.deleted:
+            return iter(self.segment.doc_ids)
+        return iter(self.segment.get_document_ids())
+
+    def __len__(self):
+        return self.segment.live_documents_count
@@ -0,0 +1,163 @@
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator
+
+# terms per front coded block, a lookup decodes at most one block
+BLOCK_SIZE = 16
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class _BlockHeads:
+    """Lazy sequence over the first (whole) terms of the blocks, for bisect."""
+
+    def __init__(self, dictionary: "TermDictionary"):
+        self.dictionary = dictionary
+
+    def __len__(self):
+        return len(self.dictionary.block_offsets)
+
+    def __getitem__(self, block: int) -> bytes:
+        data = self.dictionary.data
+        _, pos = _read_varint(data, self.dictionary.block_offsets[block])
+        length, pos = _read_varint(data, pos)
+        return bytes(data[pos : pos + length])
+
+
+class TermDictionary:
+    """
+    Sorted vocabulary mapping the terms to dense ids (their rank).
+
+    The terms are front coded in blocks of BLOCK_SIZE, the first term of a block
+    is stored whole, every other one as the length of the prefix shared with the
+    previous term and the rest of it. A lookup is a binary search over the first
+    terms of the blocks and a scan of a single block.
+
+    The data can be a memory mapped section of a segment. Terms added after the
+    dictionary was built get the following ids, so the ids handed out never
+    change, the added terms are kept in a plain dict.
+    """
+
+    def __init__(self, data, block_offsets, terms_count: int):
+        self.data = data
+        self.block_offsets = block_offsets
+        self.terms_count = terms_count
+        self._heads = _BlockHeads(self)
+        self.added: dict[str, int] = {}
+        self.added_terms: list[str] = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def encode(sorted_terms: Iterable[str]) -> tuple[bytes, array, int]:
+        """Returns the front coded terms, the block offsets and the terms count."""
+        data = bytearray()
+        block_offsets = array("Q")
+        previous = b""
+        count = 0
+        for count, term in enumerate(sorted_terms, start=1):
+            encoded = term.encode("utf-8")
+            prefix = 0
+            if (count - 1) % BLOCK_SIZE == 0:
+                block_offsets.append(len(data))
+            else:
+                limit = min(len(previous), len(encoded))
+                while prefix < limit and previous[prefix] == encoded[prefix]:
+                    prefix += 1
+            _write_varint(data, prefix)
+            _write_varint(data, len(encoded) - prefix)
+            data += encoded[prefix:]
+            previous = encoded
+        return bytes(data), block_offsets, count
+
+    @staticmethod
+    def build(sorted_terms: Iterable[str]) -> "TermDictionary":
+        return TermDictionary(*TermDictionary.encode(sorted_terms))
+
+    def __len__(self):
+        return self.terms_count + len(self.added_terms)
+
+    def __contains__(self, term: str) -> bool:
+        return self.get_id(term) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        """The terms in the order of their ids."""
+        for block in range(len(self.block_offsets)):
+            for _, encoded in self._iter_block(block):
+                yield encoded.decode("utf-8")
+        yield from list(self.added_terms)
+
+    def _iter_block(self, block: int) -> Iterator[tuple[int, bytes]]:
+        """Yields the term ids and the utf-8 encoded terms of the block."""
+        data = self.data
+        pos = self.block_offsets[block]
+        term = b""
+        first = block * BLOCK_SIZE
+        for term_id in range(first, min(first + BLOCK_SIZE, self.terms_count)):
+            prefix, pos = _read_varint(data, pos)
+            length, pos = _read_varint(data, pos)
+            term = term[:prefix] + bytes(data[pos : pos + length])
+            pos += length
+            yield term_id, term
+
+    def get_id(self, term: str) -> int | None:
+        encoded = term.encode("utf-8")
+        block = bisect_right(self._heads, encoded) - 1
+        if block >= 0:
+            for term_id, block_term in self._iter_block(block):
+                if block_term == encoded:
+                    return term_id
+                if block_term > encoded:
+                    break
+        return self.added.get(term)
+
+    def get_term(self, term_id: int) -> str:
+        if term_id >= self.terms_count:
+            return self.added_terms[term_id - self.terms_count]
+        for i, encoded in self._iter_block(term_id // BLOCK_SIZE):
+            if i == term_id:
+                return encoded.decode("utf-8")
+        raise IndexError(term_id)
+
+    def get_terms(self, term_ids: Iterable[int]) -> list[str]:
+        """Returns the terms of the sorted ids, decoding every block only once."""
+        terms = []
+        block_terms = {}
+        block = None
+        for term_id in term_ids:
+            if term_id >= self.terms_count:
+                terms.append(self.added_terms[term_id - self.terms_count])
+                continue
+            if term_id // BLOCK_SIZE != block:
+                block = term_id // BLOCK_SIZE
+                block_terms = dict(self._iter_block(block))
+            terms.append(block_terms[term_id].decode("utf-8"))
+        return terms
+
+    def add(self, term: str) -> int:
+        """Returns the id of the term, a new term gets the next free id."""
+        term_id = self.get_id(term)
+        if term_id is not None:
+            return term_id
+        with self.lock:
+            if term not in self.added:
+                # readers may look the id up as soon as it's in the dict
+                self.added_terms.append(term)
+                self.added[term] = self.terms_count + len(self.added_terms) - 1
+            return self.added[term]
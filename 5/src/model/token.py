@@ -12,7 +12,7 @@ class TokenType(Enum):
     PUNCT = 7
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     processed_form: str
     position: int
@@ -1,9 +1,11 @@
 import os
+import tracemalloc
 
 from model.dataset import Dataset
 from model.document import Document
 from engines.boolean_engine import BooleanSearchEngine
 from engines.tf_idf_engine import TfIdfSearchEngine
+from engines.st_engine import SentenceTransformersSearchEngine
 from lemmatizer import bulk_lemmatize
 import parsers
 
@@ -14,7 +16,7 @@ os.makedirs(OUT_DIR, exist_ok=True)
 
 dataset = Dataset(
     json_file=os.path.join(BASE_DIR, "..", "data", "zh.json"),
-    pickle_file=os.path.join(OUT_DIR, "zh_index.pkl"),
+    index_dir=os.path.join(OUT_DIR, "zh_index"),
     parser=parsers.ZHParser,
     tag="Zatrolene hry",
 )
@@ -30,6 +32,20 @@ def boolean():
     )
 
     print(res)
+    print(engine.explain("Prodám AND Dixit AND NOT rozšíření"))
+
+
+def boolean_filter():
+
+    boolean_engine = BooleanSearchEngine(index=dataset.index)
+    tfidf_engine = TfIdfSearchEngine(index=dataset.index)
+
+    doc_filter = boolean_engine.get_filter("Prodám AND NOT Dixit")
+    print(f"Filter: {len(doc_filter)} documents, {doc_filter.nbytes} B")
+
+    res = tfidf_engine.search(query="karetní hra", k=10, doc_filter=doc_filter)
+
+    print(res)
 
 
 def tfidf():
@@ -44,6 +60,55 @@ def tfidf():
     print(res)
 
 
+def dense_recall():
+
+    engine = SentenceTransformersSearchEngine(
+        documents=list(dataset.index.documents_dict.values()),
+        cache_dir=dataset.get_artifact_path("embeddings"),
+        ann_dir=dataset.get_artifact_path("ivf"),
+        quantized_dir=dataset.get_artifact_path("quantized"),
+    )
+
+    queries = ["Prodám karetní hru", "deskové hry pro děti", "Dixit rozšíření"]
+    engine.ann_recall_report(queries=queries, k=10)
+    engine.quantization_recall_report(queries=queries, k=10)
+
+
+def postings_benchmark():
+    for segment in dataset.index.segments:
+        segment.compression_report()
+
+
+def document_memory(sample: int = 1000):
+    """Compares the memory of the token objects and the columnar token storage."""
+    stored = list(dataset.index.documents_dict.values())[:sample]
+    documents = [
+        Document(text=doc.text, title=doc.title).tokenize().preprocess()
+        for doc in stored
+    ]
+
+    tracemalloc.start()
+    tokens = [doc.tokens for doc in documents]
+    objects_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tokens
+
+    tracemalloc.start()
+    columns = [
+        Document(text=doc.text, title=doc.title).tokenize().preprocess()
+        for doc in stored
+    ]
+    columns = [
+        (doc.terms, doc.term_ids, doc.positions, doc.lengths, doc.token_types)
+        for doc in columns
+    ]
+    columnar_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"Token objects: {objects_size / len(documents):.0f} B/document")
+    print(f"Columnar tokens: {columnar_size / len(documents):.0f} B/document")
+
+
 def pipeline():
     doc1 = Document(
         text="Karetní 1x hry <div>hry</div> 44 karet",
@@ -81,4 +146,8 @@ if __name__ == "__main__":
     # boolean()
     # tfidf()
     # tokenization_preprocessing()
+    # dense_recall()
+    # postings_benchmark()
+    # document_memory()
+    # boolean_filter()
     pipeline()
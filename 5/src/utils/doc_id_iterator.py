@@ -0,0 +1,280 @@
+import sys
+from bisect import bisect_left
+from typing import Callable, Iterator, Sequence
+
+END = sys.maxsize
+
+
+def _gallop(doc_ids: Sequence[int], doc_id: int, position: int) -> int:
+    """
+    Returns the index of the first doc id >= doc_id at or after the position,
+    found by galloping (exponential) search followed by a binary search.
+    """
+    lo, hi, step = position, position, 1
+    while hi < len(doc_ids) and doc_ids[hi] < doc_id:
+        lo = hi
+        hi += step
+        step *= 2
+    return bisect_left(doc_ids, doc_id, lo, min(hi, len(doc_ids)))
+
+
+class DocIdIterator:
+    """
+    Lazy iterator over doc ids in ascending order. `doc_id` is the current
+    document (END once exhausted), `next` moves to the following one and
+    `skip_to` to the first document >= the given doc id, skipping the
+    documents in between without looking at them where possible.
+
+    The iterators over posting lists also give the term frequency of the
+    current document, `frequency`, read from the decoded block.
+    """
+
+    doc_id: int = END
+
+    def next(self):
+        raise NotImplementedError()
+
+    def frequency(self) -> int:
+        raise NotImplementedError(f"{type(self).__name__} has no term frequencies")
+
+    def skip_to(self, doc_id: int):
+        while self.doc_id < doc_id:
+            self.next()
+
+    def __iter__(self) -> Iterator[int]:
+        while self.doc_id != END:
+            yield self.doc_id
+            self.next()
+
+
+class ArrayIterator(DocIdIterator):
+    """Iterator over a sorted list of doc ids, with their term frequencies."""
+
+    def __init__(self, doc_ids: list[int], frequencies: list[int] | None = None):
+        self.doc_ids = doc_ids
+        self.frequencies = frequencies
+        self.position = 0
+        self.doc_id = doc_ids[0] if doc_ids else END
+
+    def _move(self, position: int):
+        self.position = position
+        self.doc_id = self.doc_ids[position] if position < len(self.doc_ids) else END
+
+    def next(self):
+        self._move(self.position + 1)
+
+    def skip_to(self, doc_id: int):
+        if doc_id > self.doc_id:
+            self._move(_gallop(self.doc_ids, doc_id, self.position))
+
+    def frequency(self) -> int:
+        if self.frequencies is None:
+            return super().frequency()
+        return self.frequencies[self.position]
+
+
+class BlockIterator(DocIdIterator):
+    """
+    Iterator over the posting list blocks of a segment term. A block is decoded
+    only once the iterator enters it, `skip_to` jumps over the blocks whose
+    last doc id (the skip pointer) is lower than the target. Deleted documents
+    of the segment are skipped.
+    """
+
+    def __init__(self, segment, blocks: range):
+        self.segment = segment
+        self.blocks = blocks
+        self.deleted = segment.deleted
+        self.block = blocks.start
+        self._load_block(blocks.start)
+
+    def _load_block(self, block: int):
+        self.block = block
+        if block < self.blocks.stop:
+            doc_ids, frequencies = self.segment.decode_block(block)
+            self.doc_ids, self.frequencies = doc_ids.tolist(), frequencies.tolist()
+        else:
+            self.doc_ids = self.frequencies = []
+        self._move(0)
+
+    def _move(self, position: int):
+        while position < len(self.doc_ids) and self.doc_ids[position] in self.deleted:
+            position += 1
+        self.position = position
+        if position < len(self.doc_ids):
+            self.doc_id = self.doc_ids[position]
+        elif self.block < self.blocks.stop:
+            self._load_block(self.block + 1)
+        else:
+            self.doc_id = END
+
+    def next(self):
+        self._move(self.position + 1)
+
+    def skip_to(self, doc_id: int):
+        if doc_id <= self.doc_id:
+            return
+        if doc_id > self.doc_ids[-1]:
+            block = bisect_left(
+                self.segment.block_last_doc_ids,
+                doc_id,
+                self.block + 1,
+                self.blocks.stop,
+            )
+            self._load_block(block)
+            if self.doc_id >= doc_id:
+                return
+        self._move(_gallop(self.doc_ids, doc_id, self.position))
+
+    def frequency(self) -> int:
+        return self.frequencies[self.position]
+
+
+class BitmapIterator(DocIdIterator):
+    """
+    Iterator over a RoaringBitmap, a chunk is converted to doc ids only once
+    the iterator enters it, `skip_to` jumps over the chunks below the target.
+    """
+
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self.chunks = list(bitmap.containers.keys())
+        self._load_chunk(0)
+
+    def _load_chunk(self, chunk: int):
+        self.chunk = chunk
+        if chunk < len(self.chunks):
+            self.doc_ids = self.bitmap.get_chunk_doc_ids(self.chunks[chunk])
+        else:
+            self.doc_ids = []
+        self.position = 0
+        self.doc_id = self.doc_ids[0] if self.doc_ids else END
+
+    def next(self):
+        self.position += 1
+        if self.position < len(self.doc_ids):
+            self.doc_id = self.doc_ids[self.position]
+        else:
+            self._load_chunk(self.chunk + 1)
+
+    def skip_to(self, doc_id: int):
+        if doc_id <= self.doc_id:
+            return
+        if doc_id > self.doc_ids[-1]:
+            chunk = bisect_left(self.chunks, doc_id >> 16, self.chunk + 1)
+            self._load_chunk(chunk)
+            if self.doc_id >= doc_id:
+                return
+        self.position = _gallop(self.doc_ids, doc_id, self.position)
+        if self.position < len(self.doc_ids):
+            self.doc_id = self.doc_ids[self.position]
+        else:
+            self._load_chunk(self.chunk + 1)
+
+
+class AndIterator(DocIdIterator):
+    """
+    Intersection, the children leapfrog to each other's doc ids. The term
+    frequency is the one of the first child, e.g. a posting list intersected
+    with a filter.
+    """
+
+    def __init__(self, children: list[DocIdIterator]):
+        self.children = children
+        self._align()
+
+    def _align(self):
+        doc_id = self.children[0].doc_id
+        while doc_id != END:
+            for child in self.children:
+                child.skip_to(doc_id)
+                if child.doc_id != doc_id:
+                    doc_id = child.doc_id
+                    break
+            else:
+                break
+        self.doc_id = doc_id
+
+    def next(self):
+        self.children[0].next()
+        self._align()
+
+    def skip_to(self, doc_id: int):
+        if doc_id > self.doc_id:
+            self.children[0].skip_to(doc_id)
+            self._align()
+
+    def frequency(self) -> int:
+        return self.children[0].frequency()
+
+
+class OrIterator(DocIdIterator):
+    """Union, the current document is the lowest doc id of the children."""
+
+    def __init__(self, children: list[DocIdIterator]):
+        self.children = children
+        self.doc_id = min(child.doc_id for child in children)
+
+    def next(self):
+        for child in self.children:
+            if child.doc_id == self.doc_id:
+                child.next()
+        self.doc_id = min(child.doc_id for child in self.children)
+
+    def skip_to(self, doc_id: int):
+        if doc_id > self.doc_id:
+            for child in self.children:
+                child.skip_to(doc_id)
+            self.doc_id = min(child.doc_id for child in self.children)
+
+
+class AndNotIterator(DocIdIterator):
+    """
+    Difference A - B, the excluded iterator is only advanced to the documents
+    of the included one.
+    """
+
+    def __init__(self, include: DocIdIterator, exclude: DocIdIterator):
+        self.include = include
+        self.exclude = exclude
+        self._align()
+
+    def _align(self):
+        while self.include.doc_id != END:
+            self.exclude.skip_to(self.include.doc_id)
+            if self.exclude.doc_id != self.include.doc_id:
+                break
+            self.include.next()
+        self.doc_id = self.include.doc_id
+
+    def next(self):
+        self.include.next()
+        self._align()
+
+    def skip_to(self, doc_id: int):
+        if doc_id > self.doc_id:
+            self.include.skip_to(doc_id)
+            self._align()
+
+
+class FilterIterator(DocIdIterator):
+    """The documents of the iterator passing a (more expensive) check."""
+
+    def __init__(self, iterator: DocIdIterator, predicate: Callable[[int], bool]):
+        self.iterator = iterator
+        self.predicate = predicate
+        self._align()
+
+    def _align(self):
+        while self.iterator.doc_id != END and not self.predicate(self.iterator.doc_id):
+            self.iterator.next()
+        self.doc_id = self.iterator.doc_id
+
+    def next(self):
+        self.iterator.next()
+        self._align()
+
+    def skip_to(self, doc_id: int):
+        if doc_id > self.doc_id:
+            self.iterator.skip_to(doc_id)
+            self._align()
@@ -0,0 +1,32 @@
+import hashlib
+
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2 normalize the vectors (along the last axis), zero vectors are kept."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms != 0)
+
+
+def fingerprint(embeddings: np.ndarray, block_size: int = 4096) -> str:
+    """
+    Fingerprint of an embedding matrix (its shape, dtype and every row), hashed
+    block by block so a memory mapped matrix isn't loaded at once.
+    """
+    digest = hashlib.sha1(f"{embeddings.shape} {embeddings.dtype}".encode())
+    for start in range(0, len(embeddings), block_size):
+        digest.update(np.ascontiguousarray(embeddings[start : start + block_size]))
+    return digest.hexdigest()
+
+
+def exact_top_k(
+    embeddings: np.ndarray, queries: np.ndarray, k: int, block_size: int = 4096
+) -> list[set[int]]:
+    """Brute force top k rows (cosine similarity) for every query, the recall baseline."""
+    queries = normalize(np.asarray(queries, dtype=np.float32))
+    scores = np.empty((len(queries), len(embeddings)), dtype=np.float32)
+    for start in range(0, len(embeddings), block_size):
+        block = normalize(np.asarray(embeddings[start : start + block_size]))
+        scores[:, start : start + block_size] = queries @ block.T
+    return [set(np.argsort(-row, kind="stable")[:k].tolist()) for row in scores]
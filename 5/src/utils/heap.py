@@ -1,4 +1,7 @@
 import heapq
+import math
+
+import numpy as np
 from model.document import Document
 
 
@@ -20,20 +23,65 @@ class HeapEntry:
         return f"({self.score}) {self.document}"
 
 
-class MinHeap:
-    def __init__(self, max_size=10):
-        self.max_size = max_size
-        self.heap: list[HeapEntry] = []
+def top_k_indices(
+    scores: np.ndarray, k: int, doc_ids: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Returns the positions of the k best scores, best first. Ties are broken by
+    ascending doc id (by position when no doc ids are given), so the result
+    does not depend on the order of the input.
+    """
+    scores = np.asarray(scores)
+    doc_ids = np.arange(len(scores)) if doc_ids is None else np.asarray(doc_ids)
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if len(scores) > k:
+        # every score reaching the k-th best one is a candidate, the ties at
+        # the boundary are then decided by the doc id
+        kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(len(scores))
+
+    order = np.lexsort((doc_ids[candidates], -scores[candidates]))[:k]
+    return candidates[order]
+
+
+def top_k(scores, doc_ids, k: int) -> list[tuple[int, float]]:
+    """Returns the top k (doc_id, score) pairs of the score array, best first."""
+    scores = np.asarray(scores, dtype=np.float64)
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    top = top_k_indices(scores, k, doc_ids)
+    return list(zip(doc_ids[top].tolist(), scores[top].tolist()))
+
+
+class TopKHeap:
+    """
+    Streaming top k selection for scorers producing one document at a time,
+    with the same ordering (and tie breaking) as `top_k`.
+    """
 
-    def push(self, val: HeapEntry):
-        heapq.heappush(self.heap, val)
+    def __init__(self, k: int):
+        self.k = k
+        # (score, -doc_id), the root is the worst of the kept entries
+        self.heap: list[tuple[float, int]] = []
 
-        if len(self.heap) > self.max_size:
-            heapq.heappop(self.heap)
+    def push(self, doc_id: int, score: float):
+        entry = (score, -doc_id)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif self.heap and entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
 
-    def sort(self):
-        self.heap.sort(reverse=True)
-        return self
+    def threshold(self) -> float | None:
+        """
+        Score a document has to beat to get in, None until there are k entries
+        (infinity for k <= 0, nothing gets in).
+        """
+        if self.k <= 0:
+            return math.inf
+        return self.heap[0][0] if len(self.heap) >= self.k else None
 
-    def get_documents(self):
-        return [entry.document for entry in self.heap]
+    def get_top_k(self) -> list[tuple[int, float]]:
+        return [(-doc_id, score) for score, doc_id in sorted(self.heap, reverse=True)]
@@ -0,0 +1,78 @@
+import json
+import re
+from typing import Iterator, TextIO
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+DELIMITER = re.compile(r"[ \t\n\r]*([,\]])?")
+
+
+def iter_json_array(file: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator:
+    """
+    Incrementally parse a top level JSON array, yielding one item at a time.
+    Only the item being parsed (and at most one chunk ahead) is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+        return bool(chunk)
+
+    def skip(characters: str):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    def next_character() -> str:
+        skip(WHITESPACE)
+        if position >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        return buffer[position]
+
+    skip(WHITESPACE)
+    if buffer[position : position + 1] != "[":
+        raise ValueError("Expected a JSON array")
+    position += 1
+    if next_character() == "]":
+        return
+
+    while True:
+        # exactly one ',' between the items, none before the first one or ']'
+        if next_character() in ",]":
+            raise ValueError("Expected a JSON array item")
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                raise
+            # accept the item only when followed by a delimiter, a number at
+            # the end of the buffer may continue in the next chunk
+            if DELIMITER.match(buffer, end).group(1) is None:
+                if fill():
+                    continue
+                raise ValueError("Expected ',' or ']' after a JSON array item")
+            break
+        position = end
+        yield item
+        if next_character() == "]":
+            return
+        position += 1
+
+
+def iter_json_lines(file: TextIO) -> Iterator:
+    """Yield the items of a JSON Lines file (one JSON value per line)."""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
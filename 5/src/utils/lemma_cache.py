@@ -0,0 +1,85 @@
+from collections import OrderedDict
+import json
+import os
+import re
+import threading
+
+import config
+
+# splits text roughly the way stanza tokenizes it, a token which stanza would
+# split differently is simply not found and the text goes through stanza
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+class LemmaCache:
+    """
+    Bounded (least recently used) surface form -> lemma mapping filled from the
+    stanza output, persisted as a JSON file. Thread safe, the web server
+    lemmatizes the queries in request threads.
+
+    Only one process writes the file, the index build workers return the lemmas
+    they found (see `bulk_lemmatize`) and the parent process merges them.
+    """
+
+    def __init__(self, file: str, max_size: int):
+        self.file = file
+        self.max_size = max_size
+        self.lemmas: OrderedDict[str, str] = OrderedDict()
+        self.modified = False
+        self.lock = threading.Lock()
+        if os.path.exists(file):
+            with open(file, "r", encoding="utf-8") as f:
+                self.lemmas.update(json.load(f))
+            print(f"Loaded {len(self.lemmas)} cached lemmas from {file}")
+
+    def put(self, word: str, lemma: str):
+        with self.lock:
+            self._put(word, lemma)
+
+    def update(self, lemmas: dict[str, str]):
+        """Merge the lemmas found by another process."""
+        with self.lock:
+            for word, lemma in lemmas.items():
+                self._put(word, lemma)
+
+    def _put(self, word: str, lemma: str):
+        if self.lemmas.get(word) == lemma:
+            self.lemmas.move_to_end(word)
+            return
+        self.lemmas[word] = lemma
+        self.lemmas.move_to_end(word)
+        self.modified = True
+        if len(self.lemmas) > self.max_size:
+            self.lemmas.popitem(last=False)
+
+    def lemmatize_text(self, text: str) -> str | None:
+        """
+        Returns the lemmatized text when every token of it is cached, None
+        otherwise (the text has to go through stanza).
+        """
+        words = TOKEN_PATTERN.findall(text)
+        lemmas = []
+        with self.lock:
+            for word in words:
+                lemma = self.lemmas.get(word)
+                if lemma is None:
+                    return None
+                lemmas.append(lemma)
+            for word in words:
+                self.lemmas.move_to_end(word)
+        return " ".join(lemmas)
+
+    def save(self):
+        if not config.SAVE_TO_DISK:
+            return
+        with self.lock:
+            if not self.modified:
+                return
+            lemmas = dict(self.lemmas)
+            self.modified = False
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        # written to a temporary file first, a crash doesn't leave it half written
+        temp_file = f"{self.file}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(lemmas, f, ensure_ascii=False)
+        os.replace(temp_file, self.file)
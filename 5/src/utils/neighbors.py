@@ -0,0 +1,59 @@
+import numpy as np
+from tqdm import tqdm
+
+
+class NeighborTable:
+    """
+    Table of the k nearest neighbors (cosine similarity) of every row of an
+    embedding matrix. The table is computed lazily in blocks of rows, so at most
+    `block_size` x N similarities are held in memory at once.
+    """
+
+    def __init__(self, embeddings: np.ndarray, k: int, block_size: int):
+        self.embeddings = embeddings
+        self.rows = len(embeddings)
+        self.k = max(min(k, self.rows - 1), 0)
+        self.block_size = block_size
+        self.norms = np.linalg.norm(embeddings, axis=1)
+
+        self.indices = np.zeros((self.rows, self.k), dtype=np.int64)
+        self.scores = np.zeros((self.rows, self.k), dtype=np.float32)
+        self.computed_blocks = np.zeros(
+            (self.rows + block_size - 1) // block_size, dtype=bool
+        )
+
+    def get_neighbors(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns indices and similarities of the nearest rows, most similar first."""
+        block = row // self.block_size
+        if not self.computed_blocks[block]:
+            self._compute_block(block)
+        return self.indices[row], self.scores[row]
+
+    def build(self):
+        """Compute the whole table at once (e.g. in a background warm-up)."""
+        for block in tqdm(range(len(self.computed_blocks)), desc="Computing neighbors"):
+            if not self.computed_blocks[block]:
+                self._compute_block(block)
+
+    def _compute_block(self, block: int):
+        start = block * self.block_size
+        end = min(start + self.block_size, self.rows)
+
+        similarities = self.embeddings[start:end] @ self.embeddings.T
+        norms = self.norms[start:end, np.newaxis] * self.norms[np.newaxis, :]
+        similarities = np.divide(
+            similarities,
+            norms,
+            out=np.zeros_like(similarities),
+            where=norms != 0,
+        )
+        # a document is not its own neighbor
+        similarities[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+        if self.k:
+            top = np.argpartition(-similarities, self.k - 1, axis=1)[:, : self.k]
+            top_scores = np.take_along_axis(similarities, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            self.indices[start:end] = np.take_along_axis(top, order, axis=1)
+            self.scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+        self.computed_blocks[block] = True
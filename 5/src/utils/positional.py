@@ -0,0 +1,75 @@
+from bisect import bisect_left
+import heapq
+
+# (first, last) token ordinal of an occurrence of a term, phrase or NEAR match
+Span = tuple[int, int]
+
+
+def phrase_spans(position_lists: list[list[int]]) -> list[Span]:
+    """
+    Occurrences of the terms at consecutive positions, the sorted position
+    lists of the terms in phrase order are merged, every list is only advanced.
+    """
+    if not position_lists or not all(position_lists):
+        return []
+    pointers = [0] * len(position_lists)
+    spans = []
+    for start in position_lists[0]:
+        for i in range(1, len(position_lists)):
+            positions = position_lists[i]
+            pointers[i] = bisect_left(positions, start + i, pointers[i])
+            if pointers[i] == len(positions):
+                return spans
+            if positions[pointers[i]] != start + i:
+                break
+        else:
+            spans.append((start, start + len(position_lists) - 1))
+    return spans
+
+
+def near_spans(left: list[Span], right: list[Span], distance: int) -> list[Span]:
+    """
+    Pairs of non-overlapping occurrences at most `distance` tokens apart in
+    either order (adjacent ones are 1 apart), a match spans both of them. The
+    spans are sorted by their first position.
+    """
+    if not left or not right:
+        return []
+    longest = max(last - first for first, last in right)
+    right_firsts = [first for first, _ in right]
+    spans = []
+    lo = 0
+    for first, last in left:
+        # the right spans starting before this bound end too early, for this
+        # and all the following left spans
+        lo = bisect_left(right_firsts, first - distance - longest, lo)
+        for right_first, right_last in right[lo:]:
+            if right_first > last + distance:
+                break
+            gap = max(right_first - last, first - right_last)
+            if 1 <= gap <= distance:
+                spans.append((min(first, right_first), max(last, right_last)))
+    spans.sort()
+    return spans
+
+
+def min_distance(position_lists: list[list[int]]) -> int | None:
+    """
+    The smallest distance between the positions of two different terms, the
+    sorted position lists are merged. None when fewer than two terms occur.
+    """
+    merged = heapq.merge(
+        *(
+            ((position, term) for position in positions)
+            for term, positions in enumerate(position_lists)
+        )
+    )
+    best = None
+    previous_position, previous_term = None, None
+    for position, term in merged:
+        if previous_term is not None and term != previous_term:
+            gap = position - previous_position
+            if best is None or gap < best:
+                best = gap
+        previous_position, previous_term = position, term
+    return best
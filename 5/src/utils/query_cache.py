@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import Hashable
+
+from utils.heap import HeapEntry
+
+
+def normalize_query(query: str) -> str:
+    """
+    Whitespace is collapsed, the case is kept (the Boolean operators and the
+    sentence transformers model are case sensitive).
+    """
+    return " ".join(query.split())
+
+
+class QueryCache:
+    """
+    Bounded (least recently used) query -> search results mapping, an entry
+    expires after `ttl` seconds or once the index generation it was computed at
+    is not the current one (the documents changed).
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (index generation, expiration time, results)
+        self.entries: OrderedDict[Hashable, tuple[int, float, list[HeapEntry]]] = (
+            OrderedDict()
+        )
+        # the web server handles the requests in threads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, generation: int) -> list[HeapEntry] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_generation, expires, results = entry
+                if entry_generation == generation and time.monotonic() < expires:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return list(results)
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, generation: int, results: list[HeapEntry]):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (generation, time.monotonic() + self.ttl, list(results))
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> dict[str, int | float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
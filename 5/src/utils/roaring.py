@@ -0,0 +1,182 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# doc ids are split into chunks by their high 16 bits, a chunk with at most
+# ARRAY_MAX documents is a sorted uint16 array of the low bits, a denser one a
+# bitmap of 2^16 bits (1024 uint64 words, 8 kB)
+CHUNK_BITS = 16
+ARRAY_MAX = 4096
+
+
+def _is_bitmap(container: np.ndarray) -> bool:
+    return container.dtype == np.uint64
+
+
+def _to_bitmap(container: np.ndarray) -> np.ndarray:
+    if _is_bitmap(container):
+        return container
+    bits = np.zeros(1 << CHUNK_BITS, dtype=bool)
+    bits[container] = True
+    return np.packbits(bits, bitorder="little").view(np.uint64)
+
+
+def _to_array(container: np.ndarray) -> np.ndarray:
+    if not _is_bitmap(container):
+        return container
+    bits = np.unpackbits(container.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _cardinality(container: np.ndarray) -> int:
+    if _is_bitmap(container):
+        return int(np.unpackbits(container.view(np.uint8)).sum())
+    return len(container)
+
+
+def _contains(container: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Returns the mask of the (uint16) values present in the container."""
+    if _is_bitmap(container):
+        words = container[values >> 6]
+        return ((words >> (values & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+    if not len(container):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(container, values), len(container) - 1)
+    return container[positions] == values
+
+
+def _normalize(container: np.ndarray) -> np.ndarray | None:
+    """Sparse bitmaps become arrays, empty containers are dropped."""
+    if _is_bitmap(container):
+        if not container.any():
+            return None
+        if _cardinality(container) <= ARRAY_MAX:
+            return _to_array(container)
+        return container
+    if not len(container):
+        return None
+    if len(container) > ARRAY_MAX:
+        return _to_bitmap(container)
+    return container
+
+
+def _and(a: np.ndarray, b: np.ndarray) -> np.ndarray | None:
+    if _is_bitmap(a) and _is_bitmap(b):
+        return _normalize(a & b)
+    if _is_bitmap(a):
+        a, b = b, a
+    if _is_bitmap(b):
+        return _normalize(a[_contains(b, a)])
+    return _normalize(np.intersect1d(a, b, assume_unique=True))
+
+
+def _or(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if _is_bitmap(a) or _is_bitmap(b):
+        return _to_bitmap(a) | _to_bitmap(b)
+    return _normalize(np.union1d(a, b))
+
+
+def _and_not(a: np.ndarray, b: np.ndarray) -> np.ndarray | None:
+    if _is_bitmap(a):
+        return _normalize(a & ~_to_bitmap(b))
+    return _normalize(a[~_contains(b, a)])
+
+
+class RoaringBitmap:
+    """
+    Immutable set of doc ids in the roaring layout, the ids are grouped into
+    chunks of 2^16 by their high bits and every chunk picks the smaller
+    representation, a sorted array for sparse chunks and a bitmap for dense
+    ones. AND, OR and ANDNOT are computed chunk by chunk with NumPy.
+    """
+
+    def __init__(self, containers: dict[int, np.ndarray] | None = None):
+        # high bits of the chunk -> container, in ascending order of the chunks
+        self.containers = containers or {}
+
+    @staticmethod
+    def from_doc_ids(doc_ids: Iterable[int]) -> "RoaringBitmap":
+        doc_ids = np.unique(np.fromiter(doc_ids, dtype=np.int64))
+        highs = doc_ids >> CHUNK_BITS
+        chunks, starts = np.unique(highs, return_index=True)
+        containers = {}
+        for high, values in zip(chunks.tolist(), np.split(doc_ids, starts[1:])):
+            containers[high] = _normalize(values.astype(np.uint16))
+        return RoaringBitmap(containers)
+
+    def __and__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        containers = {}
+        for high, container in self.containers.items():
+            if high in other.containers:
+                result = _and(container, other.containers[high])
+                if result is not None:
+                    containers[high] = result
+        return RoaringBitmap(containers)
+
+    def __or__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        containers = {}
+        for high in sorted(self.containers.keys() | other.containers.keys()):
+            if high not in other.containers:
+                containers[high] = self.containers[high]
+            elif high not in self.containers:
+                containers[high] = other.containers[high]
+            else:
+                containers[high] = _or(self.containers[high], other.containers[high])
+        return RoaringBitmap(containers)
+
+    def __sub__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        """ANDNOT, the doc ids of this bitmap missing in the other one."""
+        containers = {}
+        for high, container in self.containers.items():
+            if high in other.containers:
+                container = _and_not(container, other.containers[high])
+            if container is not None:
+                containers[high] = container
+        return RoaringBitmap(containers)
+
+    def __len__(self) -> int:
+        return sum(_cardinality(container) for container in self.containers.values())
+
+    def __contains__(self, doc_id: int) -> bool:
+        container = self.containers.get(doc_id >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = np.array([doc_id & 0xFFFF], dtype=np.uint16)
+        return bool(_contains(container, low)[0])
+
+    def __iter__(self) -> Iterator[int]:
+        for high in self.containers:
+            yield from self.get_chunk_doc_ids(high)
+
+    def get_chunk_doc_ids(self, high: int) -> list[int]:
+        """The sorted doc ids of a chunk."""
+        low = _to_array(self.containers[high]).astype(np.int64)
+        return (low | (high << CHUNK_BITS)).tolist()
+
+    def to_array(self) -> np.ndarray:
+        """The sorted doc ids as an int64 array."""
+        if not self.containers:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(
+            [
+                _to_array(container).astype(np.int64) | (high << CHUNK_BITS)
+                for high, container in self.containers.items()
+            ]
+        )
+
+    def contains_array(self, doc_ids: np.ndarray) -> np.ndarray:
+        """Returns the mask of the doc ids in the bitmap, e.g. to filter results."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        mask = np.zeros(len(doc_ids), dtype=bool)
+        highs = doc_ids >> CHUNK_BITS
+        for high in np.unique(highs).tolist():
+            container = self.containers.get(high)
+            if container is not None:
+                in_chunk = highs == high
+                low = (doc_ids[in_chunk] & 0xFFFF).astype(np.uint16)
+                mask[in_chunk] = _contains(container, low)
+        return mask
+
+    @property
+    def nbytes(self) -> int:
+        return sum(container.nbytes for container in self.containers.values())
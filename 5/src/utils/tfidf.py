@@ -41,14 +41,27 @@ class TfIdf:
         """
         tf_idf_vect = TfIdf.tf_log(tf_vector)
         tf_idf_vect = TfIdf.tf_idf(tf_idf_vect, df_vector, total_documents)
+        pivot_norm = TfIdf.pivoted_norm(
+            norm=VectorUtils.compute_magnitude(tf_idf_vect),
+            document_length=document_length,
+            avg_document_length=avg_document_length,
+            slope=slope,
+        )
+        tf_idf_vect = [tf_idf / pivot_norm for tf_idf in tf_idf_vect]
+        return tf_idf_vect
+
+    @staticmethod
+    def pivoted_norm(
+        norm: float,
+        document_length: int,
+        avg_document_length: float,
+        slope: float = 0.5,
+    ) -> float:
+        """Pivoted cosine normalization of a vector with the given L2 norm."""
         # aprox pivot... should be cosine normalization value at which the two curves intersect
         pivot = document_length / avg_document_length
-        pivot_norm = (1 - slope) * pivot + VectorUtils.compute_magnitude(
-            tf_idf_vect
-        ) * slope
         # pivot_norm = (1 - slope) + pivot * slope
-        tf_idf_vect = [tf_idf / pivot_norm for tf_idf in tf_idf_vect]
-        return tf_idf_vect
+        return (1 - slope) * pivot + norm * slope
 
     @staticmethod
     def ltc_weighting(
@@ -0,0 +1,218 @@
+import numpy as np
+import scipy.sparse as ss
+from tqdm import tqdm
+
+from utils.tfidf import TfIdf
+
+
+class TfIdfMatrix:
+    """
+    Term x document CSR matrix of the logarithmic term frequency weights built
+    from the index, the idf is applied per query term at scoring time. All the
+    candidate documents of a query are scored with a single sparse matrix-vector
+    product over the rows of the query terms.
+
+    Keeping the idf out of the matrix lets documents be added without touching
+    the weights of the documents already in it. The document norms do depend on
+    the idf, so they are recomputed from the matrix on the first query after the
+    documents changed, once for a whole batch of inserts or deletions.
+
+    The rows are the ids of the shared term dictionary of the index.
+    """
+
+    def __init__(
+        self,
+        index,
+        total_documents: int,
+        avg_document_length: float,
+        slope: float,
+    ):
+        self.terms = index.get_term_dictionary()
+        self.total_documents = total_documents
+        self.slope = slope
+        self.doc_ids = np.array(sorted(index.get_documents_dict().keys()), dtype=np.int64)
+        self.doc_columns = {int(doc_id): i for i, doc_id in enumerate(self.doc_ids)}
+
+        indptr = [0]
+        indices = []
+        tf_vector = []
+        # iterated in the order of the term ids
+        terms = tqdm(self.terms, total=len(self.terms), desc="Building TF-IDF matrix")
+        for term in terms:
+            # a term of deleted documents only has no postings
+            frequencies = index.get_term_frequencies(term) or {}
+            indices.extend(self.doc_columns[doc_id] for doc_id in frequencies.keys())
+            tf_vector.extend(frequencies.values())
+            indptr.append(len(indices))
+
+        indptr = np.array(indptr, dtype=np.int64)
+        self.df_vector = np.diff(indptr)
+        self.tf_matrix = ss.csr_array(
+            (
+                1 + np.log10(np.array(tf_vector, dtype=np.float64)),
+                np.array(indices, dtype=np.int32),
+                indptr,
+            ),
+            shape=(len(indptr) - 1, len(self.doc_ids)),
+        )
+
+        self.document_lengths = np.array(
+            [index.get_document_length(int(doc_id)) for doc_id in self.doc_ids]
+        )
+        self.avg_document_length = avg_document_length
+        # computed on first use, None whenever the documents change
+        self.norms = None
+        self.pivoted_norms = None
+
+    def get_idf_vector(self) -> np.ndarray:
+        return np.log10(self.total_documents / np.maximum(self.df_vector, 1))
+
+    @property
+    def matrix(self) -> ss.csr_array:
+        """The term x document matrix of ltn weights."""
+        return ss.diags_array(self.get_idf_vector()) @ self.tf_matrix
+
+    def get_norms(self, pivoted: bool = False) -> np.ndarray:
+        """
+        The L2 norms of the ltn document columns (or their pivoted variant),
+        a removed column has norm 0.
+        """
+        if self.norms is None:
+            # the idf of every entry, the entries are stored row by row
+            rows = np.repeat(
+                np.arange(self.tf_matrix.shape[0]), np.diff(self.tf_matrix.indptr)
+            )
+            weights = self.tf_matrix.data * self.get_idf_vector()[rows]
+            self.norms = np.sqrt(
+                np.bincount(
+                    self.tf_matrix.indices,
+                    weights=weights**2,
+                    minlength=self.tf_matrix.shape[1],
+                )
+            )
+            self.pivoted_norms = TfIdf.pivoted_norm(
+                norm=self.norms,
+                document_length=self.document_lengths,
+                avg_document_length=self.avg_document_length,
+                slope=self.slope,
+            )
+        return self.pivoted_norms if pivoted else self.norms
+
+    def add_documents(
+        self,
+        index,
+        doc_ids: list[int],
+        total_documents: int,
+        avg_document_length: float,
+    ):
+        """
+        Append the columns of documents added to the index, the new terms get
+        new rows. Only the postings of the new documents are read.
+        """
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id not in self.doc_columns]
+        self.total_documents = total_documents
+        if doc_ids:
+            rows, columns, tf_vector = [], [], []
+            for column, doc_id in enumerate(doc_ids, start=len(self.doc_ids)):
+                self.doc_columns[doc_id] = column
+                for term in index.get_unique_terms(doc_id):
+                    rows.append(self.terms.add(term))
+                    columns.append(column)
+                    tf_vector.append(index.get_term_frequency(term, doc_id))
+
+            shape = (
+                max(self.tf_matrix.shape[0], max(rows, default=-1) + 1),
+                len(self.doc_ids) + len(doc_ids),
+            )
+            new_columns = ss.csr_array(
+                (1 + np.log10(np.array(tf_vector, dtype=np.float64)), (rows, columns)),
+                shape=shape,
+            )
+            # the new terms are empty rows at the end of the existing matrix
+            old = self.tf_matrix
+            indptr = np.concatenate(
+                [old.indptr, np.full(shape[0] - old.shape[0], old.indptr[-1])]
+            )
+            self.tf_matrix = ss.csr_array(
+                (old.data, old.indices, indptr), shape=shape
+            ) + new_columns
+
+            new_terms = shape[0] - len(self.df_vector)
+            self.df_vector = np.concatenate(
+                [self.df_vector, np.zeros(new_terms, dtype=np.int64)]
+            )
+            np.add.at(self.df_vector, rows, 1)
+            self.doc_ids = np.concatenate(
+                [self.doc_ids, np.array(doc_ids, dtype=np.int64)]
+            )
+            self.document_lengths = np.concatenate(
+                [
+                    self.document_lengths,
+                    [index.get_document_length(doc_id) for doc_id in doc_ids],
+                ]
+            )
+        self.avg_document_length = avg_document_length
+        self.norms = self.pivoted_norms = None
+
+    def remove_documents(
+        self,
+        index,
+        doc_ids: list[int],
+        total_documents: int,
+        avg_document_length: float,
+    ):
+        """
+        Drop the entries of documents deleted from the index, their columns are
+        left empty so the other columns keep their numbers.
+        """
+        columns = [
+            self.doc_columns.pop(doc_id)
+            for doc_id in doc_ids
+            if doc_id in self.doc_columns
+        ]
+        self.total_documents = total_documents
+        if columns:
+            removed = np.isin(self.tf_matrix.indices, columns)
+            rows = np.repeat(
+                np.arange(self.tf_matrix.shape[0]), np.diff(self.tf_matrix.indptr)
+            )
+            np.subtract.at(self.df_vector, rows[removed], 1)
+            # the 1 + log tf weights are never 0, only the removed entries are
+            self.tf_matrix.data[removed] = 0
+            self.tf_matrix.eliminate_zeros()
+        self.avg_document_length = avg_document_length
+        self.norms = self.pivoted_norms = None
+
+    def score(
+        self,
+        query_term_ids: list[int | None],
+        query_vector: list[float],
+        pivoted: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the doc ids of all documents containing at least one of the query
+        terms (None for a term not in the dictionary) and their normalized scores.
+        """
+        rows, weights = [], []
+        for term_id, weight in zip(query_term_ids, query_vector, strict=True):
+            if term_id is not None and term_id < self.tf_matrix.shape[0]:
+                rows.append(term_id)
+                weights.append(weight)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        query_rows = self.tf_matrix[rows]
+        idf_vector = np.log10(
+            self.total_documents / np.maximum(self.df_vector[rows], 1)
+        )
+        scores = query_rows.T @ (np.array(weights) * idf_vector)
+
+        candidates = np.unique(query_rows.indices)
+        norms = self.get_norms(pivoted)[candidates]
+        scores = np.divide(
+            scores[candidates],
+            norms,
+            out=np.zeros(len(candidates)),
+            where=norms != 0,
+        )
+        return self.doc_ids[candidates], scores
@@ -0,0 +1,47 @@
+import numpy as np
+
+# 7 payload bits per byte, the high bit marks the last byte of a value
+PAYLOAD_BITS = 7
+STOP_BIT = 0x80
+
+
+def encode(values) -> bytes:
+    """
+    Variable-byte encode non-negative integers (below 2^35), least significant
+    7 bits first. Small values (the deltas of a posting list) take a single byte.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for bits in range(PAYLOAD_BITS, 5 * PAYLOAD_BITS, PAYLOAD_BITS):
+        n_bytes += values >= (1 << bits)
+
+    ends = np.cumsum(n_bytes)
+    starts = ends - n_bytes
+    value_of_byte = np.repeat(np.arange(len(values)), n_bytes)
+    shifts = (PAYLOAD_BITS * (np.arange(ends[-1]) - starts[value_of_byte])).astype(
+        np.uint64
+    )
+    encoded = ((values[value_of_byte] >> shifts) & 0x7F).astype(np.uint8)
+    encoded[ends - 1] |= STOP_BIT
+    return encoded.tobytes()
+
+
+def decode(buffer) -> np.ndarray:
+    """Decode all the values of a variable-byte encoded buffer."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    stops = data >= STOP_BIT
+    if stops.all():
+        # every value fits into a single byte
+        return (data & 0x7F).astype(np.int64)
+    ends = np.flatnonzero(stops)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    value_of_byte = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (PAYLOAD_BITS * (np.arange(len(data)) - starts[value_of_byte])).astype(
+        np.uint64
+    )
+    payload = (data & 0x7F).astype(np.uint64) << shifts
+    return np.add.reduceat(payload, starts).astype(np.int64)
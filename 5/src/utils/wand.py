@@ -0,0 +1,100 @@
+import math
+from typing import Callable
+
+from utils.doc_id_iterator import END, DocIdIterator
+from utils.heap import TopKHeap
+
+
+class PostingCursor:
+    """
+    Cursor over a posting list sorted by doc id with the upper bound of the
+    term contribution to the score of its documents. The contribution itself is
+    computed only for the documents WAND fully scores, from the term frequency
+    of the iterator, which decodes a segment posting list block by block as it
+    advances (the skipped blocks are never decoded).
+    """
+
+    def __init__(
+        self,
+        iterator: DocIdIterator,
+        query_weight: float,
+        idf: float,
+        upper_bound: float,
+    ):
+        self.iterator = iterator
+        self.query_weight = query_weight
+        self.idf = idf
+        self.upper_bound = upper_bound
+
+    @property
+    def doc_id(self) -> int:
+        return self.iterator.doc_id
+
+    def score(self) -> float:
+        """The query weight times the ltn weight of the term in the document."""
+        tf_weight = 1 + math.log(self.iterator.frequency(), 10)
+        return self.query_weight * (tf_weight * self.idf)
+
+    def next(self):
+        self.iterator.next()
+
+    def skip_to(self, doc_id: int):
+        self.iterator.skip_to(doc_id)
+
+
+def wand_top_k(
+    cursors: list[PostingCursor],
+    k: int,
+    get_doc_norm: Callable[[int], float],
+) -> tuple[list[tuple[int, float]], int]:
+    """
+    Document-at-a-time WAND evaluation. A document is fully scored only when the
+    upper bounds of the terms it may contain can beat the current k-th best score.
+
+    Returns the top k (doc_id, score) pairs sorted by score and the number of
+    fully scored documents.
+    """
+    if k <= 0:
+        return [], 0
+    top_k = TopKHeap(k)
+    scored = 0
+    cursors = [cursor for cursor in cursors if cursor.doc_id != END]
+    while cursors:
+        cursors.sort(key=lambda cursor: cursor.doc_id)
+        while cursors and cursors[-1].doc_id == END:
+            cursors.pop()
+        if not cursors:
+            break
+
+        # until there are k results every document has to be scored
+        threshold = top_k.threshold()
+
+        pivot = None
+        upper_bound = 0.0
+        for i, cursor in enumerate(cursors):
+            upper_bound += cursor.upper_bound
+            if threshold is None or upper_bound > threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc_id = cursors[pivot].doc_id
+
+        if cursors[0].doc_id == pivot_doc_id:
+            score = 0.0
+            for cursor in cursors:
+                if cursor.doc_id != pivot_doc_id:
+                    break
+                score += cursor.score()
+                cursor.next()
+            norm = get_doc_norm(pivot_doc_id)
+            score = score / norm if norm else 0
+            scored += 1
+
+            top_k.push(pivot_doc_id, score)
+        else:
+            # documents before the pivot can't make it to the top k
+            for cursor in cursors[:pivot]:
+                cursor.skip_to(pivot_doc_id)
+
+    return top_k.get_top_k(), scored
@@ -1,18 +1,20 @@
 import re
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, jsonify, render_template, request, redirect, url_for
 from markupsafe import Markup
-from model.engine_collection import EngineCollection
+from model.engine_collection import ENGINE_NAMES, EngineCollection
 from model.document import Document
+from utils.heap import HeapEntry
 from web.request_manager import RequestManager
 from web.session_manager import SessionManager
 import config
 
 
 class HTMLDocument:
-    def __init__(self, doc_id: int, title: str, text: str):
+    def __init__(self, doc_id: int, title: str, text: str, score: float):
         self.doc_id = doc_id
         self.title = title
         self.text = text
+        self.score = score
 
 
 class Highlighter:
@@ -33,10 +35,13 @@ class Highlighter:
         )
         return Markup(highlighted_text)
 
-    def highlight_results(self, search_results: list[Document]) -> list[HTMLDocument]:
+    def highlight_results(
+        self, search_results: list[HeapEntry]
+    ) -> list[HTMLDocument]:
 
         highlighted_results = []
-        for doc in search_results:
+        for entry in search_results:
+            doc = entry.document
             highlighted_title = self.highlight(doc.title)
             highlighted_text = self.highlight(doc.text)
 
@@ -45,6 +50,7 @@ class Highlighter:
                     doc_id=doc.doc_id,
                     title=highlighted_title,
                     text=highlighted_text,
+                    score=entry.score,
                 )
             )
         return highlighted_results
@@ -82,24 +88,12 @@ class WebServer:
 
         highlighter = Highlighter(query)
 
-        match SessionManager.get_engine_name():
-            case "lsa_se":
-                results = ec.lsa_se.search(query=query, k=config.TOP_K)
-                return highlighter.highlight_results(results)
-            case "boolean_se":
-                results = ec.boolean_se.search(query=query, k=config.TOP_K)
-                # TODO
-                return highlighter.highlight_results(results)
-            case "sent_trans_se":
-                results = ec.sent_trans_se.search(query=query, k=config.TOP_K)
-                return highlighter.highlight_results(results)
-            case "tfidf_se":
-                results = ec.tfidf_se.search(query=query, k=config.TOP_K)
-                return highlighter.highlight_results(results)
-            case _:
-                raise ValueError(
-                    f"Unknown engine name: {SessionManager.get_engine_name()}"
-                )
+        engine_name = SessionManager.get_engine_name()
+        if engine_name not in ENGINE_NAMES:
+            raise ValueError(f"Unknown engine name: {engine_name}")
+
+        results = ec.search_scored(engine_name, query=query, k=config.TOP_K)
+        return highlighter.highlight_results(results)
 
     def setup_routes(self):
         @self.app.route("/", methods=["GET", "POST"])
@@ -124,12 +118,29 @@ class WebServer:
                 "settings.html",
                 current_dataset=SessionManager.get_dataset_name(),
                 current_engine=SessionManager.get_engine_name(),
+                engine_status=self.get_engine_collection().get_status(),
+            )
+
+        @self.app.route("/status")
+        def status():
+            return jsonify(
+                {"zh": self.zh_ec.get_status(), "cw": self.cw_ec.get_status()}
+            )
+
+        @self.app.route("/status/query_cache")
+        def query_cache_status():
+            return jsonify(
+                {
+                    "zh": self.zh_ec.query_cache.get_stats(),
+                    "cw": self.cw_ec.query_cache.get_stats(),
+                }
             )
 
         @self.app.route("/document/<int:doc_id>")
         def document(doc_id):
-            index = self.get_engine_collection().dataset.index
-            doc = index.documents_dict[doc_id]
+            ec = self.get_engine_collection()
+            index = ec.dataset.index
+            doc = index.documents_dict.get(doc_id)
 
             if not doc:
                 return "Document not found", 404
@@ -141,18 +152,33 @@ class WebServer:
             highlighted_text = highlighter.highlight(doc.text)
             highlighted_title = highlighter.highlight(doc.title)
 
+            # don't make the page wait for the sentence transformers model
+            similar = (
+                ec.sent_trans_se.more_like_this(doc_id=doc_id, k=config.TOP_K_SIMILAR)
+                if ec.is_ready("sent_trans_se")
+                else []
+            )
+
             return render_template(
                 "document.html",
                 doc=doc,
                 title=highlighted_title,
                 text=highlighted_text,
+                similar=similar,
             )
 
         @self.app.route("/insert", methods=["GET", "POST"])
         def insert():
             if request.method == "POST":
                 action = RequestManager.POST_action()
-                if action == "insert":
+                ec = self.get_engine_collection()
+                doc_id = RequestManager.POST_document_id()
+                if action in ("update", "delete") and (
+                    doc_id is None or doc_id not in ec.dataset.index.documents_dict
+                ):
+                    return "Document not found", 404
+
+                if action in ("insert", "update"):
                     title = RequestManager.POST_insert_title()
                     text = RequestManager.POST_insert_text()
                     print(f"Insert title: {title}")
@@ -163,11 +189,17 @@ class WebServer:
                             .tokenize()
                             .preprocess(config.PIPELINE)
                         )
-                        engine_collection = self.get_engine_collection()
-                        engine_collection.dataset.index.add_document(doc)
-                        engine_collection.refresh_engines()
+                        if action == "insert":
+                            ec.add_documents([doc])
+                        else:
+                            print(f"Update document: {doc_id}")
+                            ec.update_document(doc_id, doc)
+
+                elif action == "delete":
+                    print(f"Delete document: {doc_id}")
+                    ec.delete_documents([doc_id])
 
                 elif action == "save":
                     print("Save index")
-                    self.get_engine_collection().dataset.save_index()
+                    ec.dataset.save_index()
             return render_template("insert.html")
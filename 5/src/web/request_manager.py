@@ -20,6 +20,11 @@ class RequestManager:
     def GET_document_id():
         return request.args.get("doc_id", None)
 
+    @staticmethod
+    def POST_document_id():
+        doc_id = request.form.get("doc_id", "").strip()
+        return int(doc_id) if doc_id.isdigit() else None
+
     @staticmethod
     def POST_dataset_name():
         return request.form.get("dataset", config.DEFAULT_DATASET)
@@ -19,14 +19,14 @@ def run():
 
     ZH_DATASET = Dataset(
         json_file=os.path.join(BASE_DIR, "..", "..", "data", "zh.json"),
-        pickle_file=os.path.join(OUT_DIR, "zh_index.pkl"),
+        index_dir=os.path.join(OUT_DIR, "zh_index"),
         parser=ZHParser,
         tag="Zatrolene hry",
     )
 
     CW_DATASET = Dataset(
         json_file=os.path.join(BASE_DIR, "..", "..", "data", "cw.json"),
-        pickle_file=os.path.join(OUT_DIR, "cw_index.pkl"),
+        index_dir=os.path.join(OUT_DIR, "cw_index"),
         parser=CWParser,
         tag="Courseware data",
     )